@@ -0,0 +1,251 @@
+"""Club reading statistics, kept in rollup tables.
+
+Three small tables hold running counts, per club: reads per book
+(book_read_counts), books added by each member per month
+(member_month_reads) and new books per week (weekly_new_books). Every path
+that adds or deletes reads or books updates them in the same transaction,
+with `add_reads`/`remove_reads` and `add_books`/`remove_books`, so the stats
+page and API only read a few rows through an index.
+
+If the counts ever drift (e.g. rows changed by hand in the database),
+`flask analytics rebuild` recomputes them from the reads and books.
+"""
+
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import click
+
+from models import (db, User, Book, Read, BookReadCount, MemberMonthReads,
+                    WeeklyNewBooks)
+
+REBUILD_CHUNK_ROWS = 10000
+
+
+def month_of(when):
+    """First day of the month of `when` (None stays None)."""
+
+    return when and date(when.year, when.month, 1)
+
+
+def week_of(when):
+    """Monday of the week of `when` (None stays None)."""
+
+    if isinstance(when, datetime):
+        when = when.date()
+    return when and when - timedelta(days=when.weekday())
+
+
+##############################################################################
+# Counting
+
+
+def tally_reads(reads):
+    """Count (club_id, user_id, book_id, created_at) rows per book and
+    member-month.
+
+    Reads without a date count for their book only.
+    """
+
+    per_book = Counter()
+    per_member_month = Counter()
+    for club_id, user_id, book_id, created_at in reads:
+        per_book[club_id, book_id] += 1
+        if created_at:
+            per_member_month[club_id, user_id, month_of(created_at)] += 1
+    return per_book, per_member_month
+
+
+def tally_books(books):
+    """Count (club_id, created_at) rows per club and week, skipping unknown
+    creation times."""
+
+    return Counter((club_id, week_of(created_at))
+                   for club_id, created_at in books if created_at)
+
+
+def add_counts(model, key_names, count_name, counts, sign=1):
+    """Add `counts` ({key tuple: n}) times `sign` to a rollup table.
+
+    One upsert per key; rows brought down to zero are deleted.
+    """
+
+    if not counts:
+        return
+
+    table = model.__tablename__
+    keys = ', '.join(key_names)
+    params = [dict(zip(key_names, key), delta=sign * count)
+              for key, count in counts.items()]
+
+    # ON CONFLICT: Postgres, and SQLite 3.24+
+    db.session.execute(db.text(
+        f"INSERT INTO {table} ({keys}, {count_name}) "
+        f"VALUES ({', '.join(':' + name for name in key_names)}, :delta) "
+        f"ON CONFLICT ({keys}) DO UPDATE "
+        f"SET {count_name} = {table}.{count_name} + EXCLUDED.{count_name}"),
+        params)
+
+    if sign < 0:
+        matches = ' AND '.join(f"{name} = :{name}" for name in key_names)
+        db.session.execute(db.text(
+            f"DELETE FROM {table} WHERE {matches} AND {count_name} <= 0"),
+            params)
+
+
+def apply_reads(reads, sign):
+    per_book, per_member_month = tally_reads(reads)
+    add_counts(BookReadCount, ['club_id', 'book_id'], 'reads', per_book,
+               sign)
+    add_counts(MemberMonthReads, ['club_id', 'user_id', 'month'], 'reads',
+               per_member_month, sign)
+
+
+def add_reads(club_id, reads):
+    """Count a club's new reads, given as (user_id, book_id, created_at)
+    tuples.
+
+    Does not commit: call it in the transaction adding the reads.
+    """
+
+    apply_reads(((club_id, user_id, book_id, created_at)
+                 for user_id, book_id, created_at in reads), 1)
+
+
+def remove_reads(*criteria):
+    """Uncount the reads matching `criteria`, before they are deleted.
+
+    Does not commit: call it in the transaction deleting the reads.
+    """
+
+    reads = (db.session.query(Read.club_id, Read.user_id, Read.book_id,
+                              Read.created_at)
+             .filter(*criteria))
+    apply_reads(reads, -1)
+
+
+def add_books(club_id, created_ats):
+    """Count a club's new books, given their creation times. Does not
+    commit."""
+
+    add_counts(WeeklyNewBooks, ['club_id', 'week'], 'books',
+               tally_books((club_id, created_at)
+                           for created_at in created_ats))
+
+
+def remove_books(*criteria):
+    """Uncount the books matching `criteria`, before they are deleted.
+
+    Does not commit.
+    """
+
+    add_counts(WeeklyNewBooks, ['club_id', 'week'], 'books',
+               tally_books(db.session.query(Book.club_id, Book.created_at)
+                           .filter(*criteria)), -1)
+
+
+def rebuild():
+    """Recompute every rollup from the reads and books tables, and commit.
+
+    Returns {'books': rows, 'member_months': rows, 'weeks': rows}.
+    """
+
+    per_book, per_member_month = tally_reads(
+        db.session.query(Read.club_id, Read.user_id, Read.book_id,
+                         Read.created_at)
+        .yield_per(REBUILD_CHUNK_ROWS))
+    weeks = tally_books(
+        db.session.query(Book.club_id, Book.created_at)
+        .yield_per(REBUILD_CHUNK_ROWS))
+
+    BookReadCount.query.delete()
+    MemberMonthReads.query.delete()
+    WeeklyNewBooks.query.delete()
+
+    db.session.bulk_insert_mappings(BookReadCount, [
+        {'club_id': club_id, 'book_id': book_id, 'reads': count}
+        for (club_id, book_id), count in per_book.items()])
+    db.session.bulk_insert_mappings(MemberMonthReads, [
+        {'club_id': club_id, 'user_id': user_id, 'month': month,
+         'reads': count}
+        for (club_id, user_id, month), count in per_member_month.items()])
+    db.session.bulk_insert_mappings(WeeklyNewBooks, [
+        {'club_id': club_id, 'week': week, 'books': count}
+        for (club_id, week), count in weeks.items()])
+    db.session.commit()
+
+    return {'books': len(per_book), 'member_months': len(per_member_month),
+            'weeks': len(weeks)}
+
+
+##############################################################################
+# Reading the stats
+
+
+def most_read_books(club_id, limit=10):
+    """Get (book, reads) for the club's most read books."""
+
+    return (db.session.query(Book, BookReadCount.reads)
+            .join(BookReadCount, db.and_(BookReadCount.club_id == Book.club_id,
+                                         BookReadCount.book_id == Book.id))
+            .filter(BookReadCount.club_id == club_id)
+            .order_by(BookReadCount.reads.desc(),
+                      BookReadCount.book_id.desc())
+            .limit(limit)
+            .all())
+
+
+def most_active_members(club_id, month, limit=10):
+    """Get (user, reads) for the club members who added most reads in
+    `month`."""
+
+    return (db.session.query(User, MemberMonthReads.reads)
+            .join(MemberMonthReads, MemberMonthReads.user_id == User.id)
+            .filter(MemberMonthReads.club_id == club_id,
+                    MemberMonthReads.month == month_of(month))
+            .order_by(MemberMonthReads.reads.desc())
+            .limit(limit)
+            .all())
+
+
+def member_months(club_id, user_id, limit=12):
+    """Get (month, reads) for a club member's latest months with reads."""
+
+    return (db.session.query(MemberMonthReads.month, MemberMonthReads.reads)
+            .filter(MemberMonthReads.club_id == club_id,
+                    MemberMonthReads.user_id == user_id)
+            .order_by(MemberMonthReads.month.desc())
+            .limit(limit)
+            .all())
+
+
+def new_books_per_week(club_id, weeks=12, today=None):
+    """Get (week, books) for the club's last `weeks` weeks with new books."""
+
+    since = week_of(today or date.today()) - timedelta(weeks=weeks - 1)
+    return (db.session.query(WeeklyNewBooks.week, WeeklyNewBooks.books)
+            .filter(WeeklyNewBooks.club_id == club_id,
+                    WeeklyNewBooks.week >= since)
+            .order_by(WeeklyNewBooks.week)
+            .all())
+
+
+##############################################################################
+# Commands
+
+
+def init_analytics(app):
+    """Add the `flask analytics` commands."""
+
+    @app.cli.group('analytics')
+    def analytics_cli():
+        """Manage the reading statistics rollups."""
+
+    @analytics_cli.command('rebuild')
+    def rebuild_command():
+        """Recompute the rollups from scratch."""
+
+        counts = rebuild()
+        click.echo(f"{counts['books']} books, "
+                   f"{counts['member_months']} member-months, "
+                   f"{counts['weeks']} weeks")
@@ -0,0 +1,323 @@
+"""JSON API, version 1, mounted at /api/v1.
+
+Every list endpoint takes:
+
+    ?fields=id,booktitle   only return (and only query) these fields
+    ?limit=50              page size (max 200)
+    ?cursor=...            the `next_cursor` of the previous page
+
+and answers {"data": [...], "next_cursor": "..." or null}. Pages are cut
+on the primary key (keyset pagination), so deep pages cost the same as the
+first one. Responses are gzipped when the client accepts it.
+
+The API uses the same login session as the site, and only shows the
+member's own club.
+"""
+
+import base64
+import binascii
+import gzip
+import json
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, request
+
+from etags import conditional, catalog, members, viewed_user
+from models import db, User, Book, Read
+from catalog import search_everywhere
+import analytics
+import openlibrary
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+GZIP_MIN_BYTES = 500
+
+BOOK_FIELDS = {
+    'id': Book.id,
+    'booktitle': Book.booktitle,
+    'bookauthor': Book.bookauthor,
+    'bookimag_url': Book.bookimag_url,
+}
+
+# Never email or password
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'bio': User.bio,
+    'location': User.location,
+}
+
+READ_FIELDS = {
+    'id': Read.id,
+    'user_id': Read.user_id,
+    'book_id': Read.book_id,
+}
+
+SEARCH_FIELDS = ['key', 'title', 'author_name', 'first_publish_year',
+                 'cover_i']
+
+
+class ApiError(Exception):
+    """Error answered as {"error": message} with `status`."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+##############################################################################
+# Serialization
+
+
+def dumps(data):
+    """Serialize `data` to JSON bytes, with orjson when it is installed."""
+
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200):
+    return current_app.response_class(
+        dumps(data), status=status, mimetype='application/json')
+
+
+@bp.errorhandler(ApiError)
+def handle_api_error(error):
+    return json_response({'error': error.message}, error.status)
+
+
+@bp.after_request
+def compress(response):
+    """Gzip JSON responses for clients that accept it."""
+
+    if (response.direct_passthrough
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or not request.accept_encodings['gzip']):
+        return response
+
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+##############################################################################
+# Fields and pagination
+
+
+def selected_fields(available):
+    """Get {name: column} for the fields asked for in ?fields= (or all)."""
+
+    requested = request.args.get('fields')
+    if not requested:
+        return available
+
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. "
+                       f"Available: {', '.join(available)}")
+    return {name: available[name] for name in names}
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ApiError("Invalid cursor")
+
+
+def page_size():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError("limit must be a number")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def paginated(available, key_column, *criteria):
+    """Answer one page of rows with the selected fields, ordered by key.
+
+    `key_column` is the (unique) column pages are cut on; `criteria` filter
+    the rows.
+    """
+
+    fields = selected_fields(available)
+    limit = page_size()
+
+    query = db.session.query(key_column, *fields.values()).filter(*criteria)
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(key_column > decode_cursor(cursor))
+    rows = query.order_by(key_column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0])
+
+    return json_response({
+        'data': [dict(zip(fields, row[1:])) for row in rows],
+        'next_cursor': next_cursor,
+    })
+
+
+def single(available, key_column, key, *criteria):
+    """Answer the selected fields of the row whose key is `key`.
+
+    `criteria` further filter the row (e.g. to the member's club).
+    """
+
+    fields = selected_fields(available)
+    row = (db.session.query(*fields.values())
+           .filter(key_column == key, *criteria)
+           .first())
+    if row is None:
+        raise ApiError("Not found", 404)
+    return json_response({'data': dict(zip(fields, row))})
+
+
+##############################################################################
+# Endpoints
+
+
+@bp.before_request
+def require_login():
+    if not g.user:
+        raise ApiError("Access unauthorized.", 401)
+
+
+@bp.route('/books')
+@conditional(catalog)
+def list_books():
+    """Books in the club catalog."""
+
+    return paginated(BOOK_FIELDS, Book.id, Book.club_id == g.user.club_id)
+
+
+@bp.route('/books/<int:book_id>')
+@conditional(catalog)
+def get_book(book_id):
+    return single(BOOK_FIELDS, Book.id, book_id,
+                  Book.club_id == g.user.club_id)
+
+
+@bp.route('/users')
+@conditional(members)
+def list_users():
+    """Club members."""
+
+    return paginated(USER_FIELDS, User.id, User.club_id == g.user.club_id)
+
+
+@bp.route('/users/<int:user_id>')
+@conditional(viewed_user)
+def get_user(user_id):
+    return single(USER_FIELDS, User.id, user_id,
+                  User.club_id == g.user.club_id)
+
+
+@bp.route('/users/<int:user_id>/books')
+@conditional(viewed_user, catalog)
+def list_user_books(user_id):
+    """Books read by a member, in the order they were added."""
+
+    club_id = g.user.club_id
+    return paginated(BOOK_FIELDS, Read.id,
+                     Read.club_id == club_id, Book.club_id == club_id,
+                     Read.book_id == Book.id, Read.user_id == user_id)
+
+
+@bp.route('/reads')
+@conditional(members)
+def list_reads():
+    """Who read what: one entry per member and book."""
+
+    return paginated(READ_FIELDS, Read.id, Read.club_id == g.user.club_id)
+
+
+@bp.route('/stats')
+def club_stats():
+    """The member's club's stats, read from the analytics rollups.
+
+    Takes ?month=YYYY-MM for the most active members (default: this month)
+    and ?limit= for the list lengths.
+    """
+
+    month = datetime.utcnow()
+    if request.args.get('month'):
+        try:
+            month = datetime.strptime(request.args['month'], '%Y-%m')
+        except ValueError:
+            raise ApiError("month must look like 2024-01")
+    limit = page_size()
+    club_id = g.user.club_id
+
+    return json_response({'data': {
+        'most_read_books': [
+            {'id': book.id, 'booktitle': book.booktitle,
+             'bookauthor': book.bookauthor, 'reads': reads}
+            for book, reads in analytics.most_read_books(club_id, limit)],
+        'most_active_members': {
+            'month': month.strftime('%Y-%m'),
+            'members': [
+                {'id': user.id, 'username': user.username, 'reads': reads}
+                for user, reads
+                in analytics.most_active_members(club_id, month, limit)],
+        },
+        'new_books_per_week': [
+            {'week': week.isoformat(), 'books': books}
+            for week, books in analytics.new_books_per_week(club_id)],
+    }})
+
+
+@bp.route('/users/<int:user_id>/stats')
+def user_stats(user_id):
+    """Books a member added to their reads, per month (latest first)."""
+
+    return json_response({'data': [
+        {'month': month.strftime('%Y-%m'), 'reads': reads}
+        for month, reads in analytics.member_months(
+            g.user.club_id, user_id, page_size())]})
+
+
+@bp.route('/search')
+def search():
+    """Search the local catalog, topped up with Open Library's results.
+
+    Takes ?q=, ?fields= and ?limit= (no pagination).
+    """
+
+    query = request.args.get('q')
+    if not query:
+        raise ApiError("No query provided")
+
+    fields = list(selected_fields(dict.fromkeys(SEARCH_FIELDS)))
+
+    try:
+        docs = search_everywhere(query, limit=page_size(), fields=fields)
+    except openlibrary.OpenLibraryError:
+        raise ApiError("Failed to fetch data", 502)
+
+    return json_response({
+        'data': [{name: doc.get(name) for name in fields} for doc in docs],
+        'next_cursor': None,
+    })
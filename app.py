@@ -1,42 +1,107 @@
+import time
+_import_started = time.perf_counter()
+
+import logging
 import os
-from dotenv import load_dotenv
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, url_for
-from flask_debugtoolbar import DebugToolbarExtension
+from datetime import datetime
+
+import click
+from flask import Blueprint, Flask, Response, abort, current_app, render_template, request, flash, redirect, send_from_directory, session, g, jsonify, url_for, stream_with_context
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import and_
-from forms import UserAddForm, LoginForm, UserEditForm
-from models import db, connect_db, User, Book, Read
-import requests
-
-load_dotenv()
+from config import get_profile
+from forms import UserAddForm, LoginForm, UserEditForm, ReadingImportForm
+from models import db, connect_db, Club, User, Book, Read, ReadingImport, DEFAULT_CLUB_ID
+from cache import init_cache, bump_catalog, bump_user
+from etags import init_etags, conditional, catalog, members, viewed_user
+from pagecache import init_page_cache, anonymous_cache
+from jobs import init_jobs, enqueue, dashboard_stats
+from startup import StartupReport
+import openlibrary
+import api
+import analytics
+from suggest import init_suggest
+from catalog import init_catalog, search_everywhere
+from enrich import init_enrich
+from readinglist import start_import, upload_dir
+from export import init_export, export, ExportError, TABLES, MIMETYPES
+from events import init_events, publish, event_stream_response
+from profiler import init_profiler, load_profiles, profile_dir
+from privatedirs import unsafe_reason
+from sqlitedb import init_sqlite
+from templating import init_templating, compile_templates
+import tasks  # registers the background job handlers
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('main', __name__)
+
+
+def create_app(profile=None):
+    """Create and configure the app.
+
+    `profile` is a name from config.PROFILES (default: $BOOKCLUB_ENV).
+
+    Nothing here connects to the database or starts threads, so the app can
+    be built once in gunicorn's master (`--preload`) and shared with the
+    workers it forks (see gunicorn.conf.py).
+    """
+
+    report = StartupReport()
+    report.add('import app module', _import_finished - _import_started)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-# app.config['SQLALCHEMY_DATABASE_URI'] = (
-#     os.environ.get('DATABASE_URL', 'postgresql:///bookclub'))
-# If running on SUPABASE
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('SUPABASE_DB_URL', 'postgresql:///bookclub'))
+    with report.phase('create Flask app'):
+        app = Flask(__name__)
+        app.config.from_object(get_profile(profile))
+        init_templating(app)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-# app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+    with report.phase('extensions'):
+        if app.config['DEBUG_TOOLBAR']:
+            # Only installed/imported for development.
+            from flask_debugtoolbar import DebugToolbarExtension
+            DebugToolbarExtension(app)
 
-connect_db(app)
+        connect_db(app)
+        init_sqlite(app)
+        init_cache(app)
+        init_etags(app)
+        init_page_cache(app, user_key=CURR_USER_KEY)
+        init_jobs(app)
+        init_suggest(app)
+        init_catalog(app)
+        init_enrich(app)
+        init_export(app)
+        analytics.init_analytics(app)
+        init_events(app)
+        init_profiler(app)
+
+    with report.phase('routes'):
+        app.register_blueprint(bp)
+        app.register_blueprint(api.bp)
+
+    if app.config['TEMPLATE_WARMUP']:
+        with report.phase('templates'):
+            compile_templates(app)
+
+    @app.cli.command('startup-report')
+    def startup_report_command():
+        """Show how long building the app took."""
+
+        click.echo(app.startup_report.as_text())
+
+    app.startup_report = report
+    logger.info("App startup:\n%s", report.as_text())
+
+    return app
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
@@ -60,7 +125,15 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def is_admin():
+    """Is the current user allowed on the admin pages?"""
+
+    return (bool(g.user)
+            and g.user.username in current_app.config['ADMIN_USERNAMES'])
+
+
+@bp.route('/signup', methods=["GET", "POST"])
+@anonymous_cache('pages', 'signup')
 def signup():
     """Handle user signup.
 
@@ -76,12 +149,23 @@ def signup():
 
     if form.validate_on_submit():
         try:
+            club_id = DEFAULT_CLUB_ID
+            if form.club.data and form.club.data.strip():
+                invite_code = (form.invite_code.data or '').strip()
+                club = Club.join_or_start(form.club.data.strip(), invite_code)
+                if club is None:
+                    flash("That club already exists: ask one of its members "
+                          "for its invite code.", 'danger')
+                    return render_template('users/signup.html', form=form)
+                club_id = club.id
             user = User.signup(
                 username=form.username.data,
                 password=form.password.data,
                 email=form.email.data,
+                club_id=club_id,
                 # image_url=form.image_url.data or User.image_url.default.arg,
             )
+            bump_user(club_id)
             db.session.commit()
 
         except IntegrityError:
@@ -96,7 +180,8 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
+@anonymous_cache('pages', 'login')
 def login():
     """Handle user login."""
 
@@ -116,7 +201,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
     do_logout()
@@ -127,17 +212,22 @@ def logout():
 ##############################################################################
 # General user routes:
 # This route uses "index.html" and can be loaded by typing the route /users only 
-@app.route('/users')
+@bp.route('/users')
+@conditional(members, catalog)
 def list_users():
-    """Page with listing of users.
+    """Page with listing of the members of your club.
 
     Can take a 'q' param in querystring to search by that username.
     """
 
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
     search = request.args.get('q')
 
     # if not search:
-    users = User.query.all()
+    users = User.query.filter_by(club_id=g.user.club_id).all()
     # print(users)
     # else:
     #     users = User.query.filter(User.username.like(f"%{search}%")).all()
@@ -145,7 +235,8 @@ def list_users():
     return render_template('users/index.html', users=users)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@conditional(viewed_user, catalog)
 def users_show(user_id):
     """Show user profile."""
     if g.user.id != user_id:
@@ -153,12 +244,12 @@ def users_show(user_id):
         return redirect('/')
     else:
         user = User.query.get_or_404(user_id)
-        books = Book.query.all()
+        books = Book.query.filter_by(club_id=user.club_id).all()
     return render_template('users/show.html', user=user, books=books)
 
 
 # Profile page 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     #Check if user is logged on correctly
@@ -199,6 +290,7 @@ def profile():
             if form.bio.data:
                 g.user.bio = form.bio.data
 
+            bump_user(g.user.club_id, g.user.id)
             db.session.commit()
 
         except IntegrityError:
@@ -212,7 +304,7 @@ def profile():
         
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -222,130 +314,240 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    bump_user(g.user.club_id, g.user.id)
+    analytics.remove_reads(Read.club_id == g.user.club_id,
+                           Read.user_id == g.user.id)
+    User.bulk_delete(g.user.id)
     db.session.commit()
 
     return redirect("/signup")
 
+@bp.route('/users/import', methods=["GET", "POST"])
+def import_reads():
+    """Upload a Goodreads/StoryGraph export to add its books to your reads."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = ReadingImportForm()
+
+    if form.validate_on_submit():
+        reading_import = start_import(g.user.id, form.export.data,
+                                      upload_dir(current_app))
+        db.session.commit()
+        return redirect(f"/users/import/{reading_import.id}")
+
+    imports = (ReadingImport.query.filter_by(user_id=g.user.id)
+               .order_by(ReadingImport.id.desc()).limit(10).all())
+    return render_template('users/import.html', form=form, imports=imports)
+
+
+@bp.route('/users/import/<int:import_id>')
+def import_reads_status(import_id):
+    """Show the progress of a reading list import."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    reading_import = ReadingImport.query.get_or_404(import_id)
+    if reading_import.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return render_template('users/import_status.html',
+                           reading_import=reading_import)
+
 ##############################################################################
 # Books routes:
-@app.route('/users/books/addread/<int:book_id>', methods=['POST'])
+#   The page's script (static/js/live.js) posts to these asking for JSON and
+#   updates just the affected list item; plain form posts redirect home.
+
+
+def wants_json():
+    """Was this request sent by the page's script, asking for JSON?"""
+
+    return request.accept_mimetypes.best == 'application/json'
+
+
+def book_change_done(data, status=200, message=None):
+    """Answer a successful change with `data`, or redirect home."""
+
+    if wants_json():
+        return jsonify(data), status
+    if message:
+        flash(message, "success")
+    return redirect("/")
+
+
+def book_change_failed(message, status):
+    """Answer a refused change with an error, or flash it and redirect."""
+
+    if wants_json():
+        return jsonify({'error': message}), status
+    flash(message, "danger")
+    return redirect("/")
+
+
+@bp.route('/users/books/addread/<int:book_id>', methods=['POST'])
 def add_book_to_read(book_id):
     """Add a book from the book club suggestions to reads"""
 
     if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-    
-    book_object = Book.query.get_or_404(book_id)
-    
-    read_entry = Read(user_id=g.user.id, book_id=book_object.id)
-    g.user.reads.append(read_entry)
-    db.session.add(g.user)
+        return book_change_failed("Access unauthorized.", 401)
+
+    club_id = g.user.club_id
+    book_object = Book.in_club(club_id, book_id)
+    if book_object is None:
+        return book_change_failed("This book is no longer in the club.", 404)
+
+    done = {'book_id': book_id, 'read': True}
+    already_read = (db.session.query(Read.id)
+                    .filter_by(club_id=club_id, user_id=g.user.id,
+                               book_id=book_id)
+                    .first())
+    if already_read:
+        return book_change_done(done)
+
+    # Added on its own: appending to g.user.reads would load them all.
+    read_entry = Read(club_id=club_id, user_id=g.user.id,
+                      book_id=book_id, created_at=datetime.utcnow())
+    try:
+        with db.session.begin_nested():
+            db.session.add(read_entry)
+    except IntegrityError:
+        # Added since the check above (e.g. from another tab)
+        return book_change_done(done)
+
+    analytics.add_reads(club_id,
+                        [(g.user.id, book_id, read_entry.created_at)])
+    publish('read_added', club_id, user_id=g.user.id, book_id=book_id)
+    bump_user(club_id, g.user.id)
     db.session.commit()
 
-    return redirect(f"/")
+    return book_change_done(done)
 
-@app.route('/users/books/deleteread/<int:book_id>', methods=['POST'])
+@bp.route('/users/books/deleteread/<int:book_id>', methods=['POST'])
 def delete_book_to_read(book_id):
     """Delete a book from your reads"""
 
     if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return book_change_failed("Access unauthorized.", 401)
     
-    read_object = db.session.query(Read).filter_by(user_id=g.user.id, book_id=book_id).first()
-    if read_object:
-        db.session.delete(read_object)
-        db.session.commit()
-    else:
-        flash("No matching row found to delete.", "danger")
+    club_id = g.user.club_id
+    read_object = db.session.query(Read).filter_by(club_id=club_id, user_id=g.user.id, book_id=book_id).first()
+    if not read_object:
+        return book_change_failed("No matching row found to delete.", 404)
+
+    analytics.remove_reads(Read.club_id == club_id, Read.id == read_object.id)
+    db.session.delete(read_object)
+    publish('read_removed', club_id, user_id=g.user.id, book_id=book_id)
+    bump_user(club_id, g.user.id)
+    db.session.commit()
 
-    return redirect(f"/")
+    return book_change_done({'book_id': book_id, 'read': False})
 
-@app.route('/booksread/add', methods=['POST'])
+@bp.route('/booksread/add', methods=['POST'])
 def add_bookread():
     """Add any book to the books read"""
 
     if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    if request.method == 'POST':
-        title = request.form['booktitle']
-        imgurl = request.form['bookimage']
-        
-        if title and imgurl:
-            book_object = Book(booktitle=title, bookimag_url=imgurl)
-            db.session.add(book_object)
-            db.session.commit()
-            read_entry = Read(user_id=g.user.id, book_id=book_object.id)
-            g.user.reads.append(read_entry)
-
-            db.session.add(g.user)
-            db.session.commit()
-
-            return redirect(f"/")
-        elif title: # Title is mandatory
-            book_object = Book(booktitle=title)
-            db.session.add(book_object)
-            db.session.commit()
-    
-            read_entry = Read(user_id=g.user.id, book_id=book_object.id)
-            g.user.reads.append(read_entry)
+        return book_change_failed("Access unauthorized.", 401)
+
+    title = request.form.get('booktitle')
+    imgurl = request.form.get('bookimage')
+
+    if not title: # Title is mandatory
+        return book_change_failed("Need to add a booktitle", 400)
+
+    club_id = g.user.club_id
+    now = datetime.utcnow()
+    book_object = Book(club_id=club_id, booktitle=title, created_at=now)
+    if imgurl:
+        book_object.bookimag_url = imgurl
+    db.session.add(book_object)
+    # Get the book's id, so the book and the read go in one transaction.
+    db.session.flush()
+
+    db.session.add(Read(club_id=club_id, user_id=g.user.id,
+                        book_id=book_object.id, created_at=now))
+    analytics.add_books(club_id, [now])
+    analytics.add_reads(club_id, [(g.user.id, book_object.id, now)])
+    book = {
+        'id': book_object.id,
+        'booktitle': book_object.booktitle,
+        'bookimag_url': book_object.bookimag_url,
+    }
+    publish('book_added', club_id, **book)
+    publish('read_added', club_id, user_id=g.user.id, book_id=book_object.id)
+
+    bump_catalog(club_id)
+    bump_user(club_id, g.user.id)
+    # Look for a cover and author without making the user wait
+    enqueue('enrich_metadata', book_ids=[book_object.id])
+    db.session.commit()
 
-            db.session.add(g.user)
-            db.session.commit()
-        else:
-            flash("Need to add a booktitle", "danger")
-    
-    return redirect(f"/")
+    return book_change_done({'book': book}, 201)
 
-@app.route('/books/delete/<int:book_id>', methods=['POST'])
+@bp.route('/books/delete/<int:book_id>', methods=['POST'])
 def delete_book_from_database(book_id):
     """Delete a book from the database"""
 
     if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        return book_change_failed("Access unauthorized.", 401)
     
-    book_object = Book.query.get_or_404(book_id)
-    if book_object:
-        db.session.delete(book_object)
+    club_id = g.user.club_id
+    if not (db.session.query(Book.id)
+            .filter_by(club_id=club_id, id=book_id).first()):
+        return book_change_failed("No matching row found to delete.", 404)
+
+    readers = Read.query.filter_by(club_id=club_id, book_id=book_id).count()
+    if readers > current_app.config['BOOK_DELETE_INLINE_MAX_READS']:
+        enqueue('delete_book', priority=10, book_id=book_id, club_id=club_id)
         db.session.commit()
-    else:
-        flash("No matching row found to delete.", "danger")
+        return book_change_done(
+            {'book_id': book_id, 'deleted': False, 'queued': True}, 202,
+            message="This book has many readers. "
+                    "It will be removed shortly.")
+
+    analytics.remove_reads(Read.club_id == club_id, Read.book_id == book_id)
+    analytics.remove_books(Book.club_id == club_id, Book.id == book_id)
+    Book.bulk_delete(club_id, book_id)
+    publish('book_removed', club_id, id=book_id)
+    bump_catalog(club_id)
+    bump_user(club_id)
+    db.session.commit()
+
+    return book_change_done({'book_id': book_id, 'deleted': True})
 
-    return redirect(f"/")
 ##############################################################################
 # API for Book Search
 
 # Route to handle API requests
-@app.route('/search', methods=['GET'])
+@bp.route('/search', methods=['GET'])
 def search():
     # titles = []
     query = request.args.get('q')  # Get the search query from the URL
     if not query:
         return jsonify({'error': 'No query provided'}), 400
 
-    # Open Library API endpoint
-    api_url = "https://openlibrary.org/search.json"
-    params = {'q': query}  # Add query as a parameter
-
-    # Make the API call
-    response = requests.get(api_url, params=params)
-    # import pdb; pdb.set_trace()
+    # The local copy of Open Library first, topped up by the API
+    try:
+        books = search_everywhere(query, limit=5, fields=['title'])
+    except openlibrary.OpenLibraryError:
+        books = None
 
     # Check for a successful response
-    if response.status_code == 200:
-        data = response.json()
-        # books = data.get('docs', [])[:5]  # Limit to 5 results
-        books = data.get('docs', [])[:5]  # Limit to 5 results
+    if books is not None:
         titles = [f"{b['title']}" for b in books]
+        club_id = g.user.club_id if g.user else None
+        current_app.suggesters.for_club(club_id).add_remote_titles(titles)
         # return jsonify(titles)  # Return books as JSON
         if g.user:
             # Query Books table using the database library
-            books_table = db.session.query(Book).all()
+            books_table = (db.session.query(Book)
+                           .filter_by(club_id=g.user.club_id).all())
 
             # Store the data in g 
             g.books_table = books_table
@@ -356,22 +558,161 @@ def search():
     else:
         return jsonify({'error': 'Failed to fetch data'}), 500
 
+@bp.route('/suggest', methods=['GET'])
+def suggest():
+    """Titles completing the search box's text, from memory (no API call)."""
+
+    query = request.args.get('q', '')
+    suggester = current_app.suggesters.for_club(
+        g.user.club_id if g.user else None)
+    suggester.refresh_if_stale()
+    return jsonify(suggester.suggest(query))
+
+##############################################################################
+# Live updates
+
+
+@bp.route('/events')
+def live_events():
+    """Stream your club's catalog and reads changes to the page
+    (Server-Sent Events)."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return event_stream_response(g.user.club_id)
+
+
+##############################################################################
+# Club stats
+
+
+@bp.route('/stats')
+def club_stats():
+    """Your club's most read books, most active members and new books per
+    week.
+
+    Everything comes from the analytics rollup tables.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    club_id = g.user.club_id
+    this_month = datetime.utcnow()
+    return render_template(
+        'stats.html',
+        top_books=analytics.most_read_books(club_id),
+        top_members=analytics.most_active_members(club_id, this_month),
+        this_month=analytics.month_of(this_month),
+        weeks=analytics.new_books_per_week(club_id),
+        my_months=analytics.member_months(club_id, g.user.id))
+
+
+##############################################################################
+# Admin pages
+
+
+@bp.route('/admin/jobs')
+def admin_jobs():
+    """Show background job counts and latencies."""
+
+    if not is_admin():
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return render_template('admin/jobs.html', stats=dashboard_stats(),
+                           export_tables=TABLES, export_formats=MIMETYPES)
+
+
+@bp.route('/admin/profiles')
+def admin_profiles():
+    """List the saved request profiles (see profiler.py)."""
+
+    if not is_admin():
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return render_template(
+        'admin/profiles.html',
+        profiles=load_profiles(profile_dir(current_app)))
+
+
+@bp.route('/admin/templates')
+def admin_templates():
+    """Show render times and output sizes per template (see templating.py)."""
+
+    if not is_admin():
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    metrics = current_app.jinja_env.render_metrics
+    return render_template(
+        'admin/templates.html', templates=metrics.summary(),
+        since=datetime.utcfromtimestamp(metrics.started), pid=os.getpid())
+
+
+@bp.route('/admin/profiles/<name>')
+def admin_profile_file(name):
+    """Download a saved profile: JSON summary or flame graph stacks."""
+
+    if not is_admin():
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    directory = profile_dir(current_app)
+    if (not name.endswith(('.json', '.folded'))
+            or unsafe_reason(directory) is not None):
+        abort(404)
+    return send_from_directory(directory, name, as_attachment=True)
+
+
+@bp.route('/admin/export/<table>.<fmt>')
+def admin_export(table, fmt):
+    """Download a table as CSV, JSONL or Parquet, streamed as it is read."""
+
+    if not is_admin():
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    try:
+        data = export(table, fmt)
+    except ExportError as exc:
+        flash(str(exc), "danger")
+        return redirect("/admin/jobs")
+
+    return Response(
+        stream_with_context(data),
+        mimetype=MIMETYPES[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{table}.{fmt}"',
+            'Cache-Control': 'private, no-store',
+        })
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
+@anonymous_cache('pages', 'home')
+@conditional(catalog)
 def homepage():
     """Show homepage:
     """
     if g.user:
         # Query Books table using the database library
-        books_table = db.session.query(Book).all()
+        books_table = (db.session.query(Book)
+                       .filter_by(club_id=g.user.club_id).all())
 
         # Store the data in g 
         g.books_table = books_table
 
-        g.user_reads = db.session.query(Read).filter_by(user_id=g.user.id).all()
+        g.user_reads = (db.session.query(Read)
+                        .filter_by(club_id=g.user.club_id, user_id=g.user.id)
+                        .all())
         
         read_book_ids = [] 
         for read in g.user_reads:
@@ -393,12 +734,32 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers on every request.
+
+    Responses from `conditional` routes and the page cache set their own
+    Cache-Control (with an ETag, or private), which is left alone.
+    """
+
+    if 'ETag' in req.headers or req.cache_control.private:
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
     return req
+
+
+_import_finished = time.perf_counter()
+
+
+def __getattr__(name):
+    """Build `app` (`gunicorn app:app`, `flask run`) on first access only."""
+
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
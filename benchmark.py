@@ -0,0 +1,208 @@
+"""Compare the throughput of the gthread and gevent serving modes.
+
+    python benchmark.py --clients 200 --seconds 20 --upstream-ms 800
+
+Starts a stand-in for Open Library that answers after --upstream-ms. Then,
+for each worker class, it starts gunicorn (gunicorn.conf.py, one worker by
+default) pointed at the stand-in, and has --clients logged-in clients
+search as fast as they can for --seconds. Queries never match the local
+catalog, so every search waits on "Open Library". Prints requests per
+second and latency percentiles for each mode.
+
+Uses the database of the current environment (SUPABASE_DB_URL or
+SQLITE_PATH), where it signs up, and finally deletes, a member per mode.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+
+import requests
+
+CSRF_FIELD = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+##############################################################################
+# Stand-in for Open Library
+
+
+def serve_upstream(port, delay):
+    """Answer every search with a few docs, after `delay` seconds."""
+
+    body = json.dumps({'docs': [{'title': f"Benchmark Book {i}"}
+                                for i in range(5)]}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    server.serve_forever()
+
+
+##############################################################################
+# The app under test
+
+
+def start_app(worker_class, port, workers, upstream_url):
+    env = dict(os.environ,
+               GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(workers),
+               PORT=str(port),
+               OPENLIBRARY_SEARCH_URL=upstream_url)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--log-level',
+         'warning'], env=env)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn ({worker_class}) exited with "
+                             f"{server.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f"gunicorn ({worker_class}) did not start")
+
+
+def sign_up(base_url):
+    """Sign up a throwaway member; get their session cookies."""
+
+    session = requests.Session()
+    page = session.get(f"{base_url}/signup").text
+    token = CSRF_FIELD.search(page)
+    name = f"bench-{uuid.uuid4().hex[:12]}"
+    response = session.post(f"{base_url}/signup", data={
+        'csrf_token': token.group(1) if token else '',
+        'username': name,
+        'email': f"{name}@example.com",
+        'password': uuid.uuid4().hex,
+    }, allow_redirects=False)
+    if response.status_code != 302:
+        raise SystemExit(f"Could not sign up (HTTP {response.status_code})")
+    return session.cookies
+
+
+##############################################################################
+# Load
+
+
+def run_clients(base_url, cookies, clients, seconds):
+    """Search from `clients` threads for `seconds`.
+
+    Returns (latencies of the successful requests, error count).
+    """
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client(number):
+        session = requests.Session()
+        session.cookies.update(cookies)
+        sent = 0
+        while time.monotonic() < deadline:
+            sent += 1
+            started = time.perf_counter()
+            try:
+                response = session.get(
+                    f"{base_url}/api/v1/search",
+                    params={'q': f"zq benchmark {number} {sent}"},
+                    timeout=60)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(number,), daemon=True)
+               for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def summarize(worker_class, latencies, errors, seconds):
+    latencies = sorted(latencies)
+    if not latencies:
+        return f"{worker_class:8} no successful requests, {errors} errors"
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 \
+        else [latencies[0]] * 99
+    return (f"{worker_class:8} {len(latencies) / seconds:8.1f} req/s  "
+            f"p50 {cuts[49] * 1000:7.0f} ms  p95 {cuts[94] * 1000:7.0f} ms  "
+            f"{errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modes', default='gthread,gevent',
+                        help="worker classes to compare")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--upstream-ms', type=float, default=800)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    options = parser.parse_args()
+
+    upstream_port = options.port + 1
+    upstream = Process(target=serve_upstream,
+                       args=(upstream_port, options.upstream_ms / 1000),
+                       daemon=True)
+    upstream.start()
+    upstream_url = f"http://127.0.0.1:{upstream_port}/search.json"
+    base_url = f"http://127.0.0.1:{options.port}"
+
+    print(f"{options.clients} clients, {options.seconds:g} s, "
+          f"Open Library answering in {options.upstream_ms:g} ms, "
+          f"{options.workers} worker(s)")
+    try:
+        for worker_class in options.modes.split(','):
+            server = start_app(worker_class, options.port, options.workers,
+                               upstream_url)
+            try:
+                cookies = sign_up(base_url)
+                latencies, errors = run_clients(base_url, cookies,
+                                                options.clients,
+                                                options.seconds)
+                requests.post(f"{base_url}/users/delete", cookies=cookies,
+                              allow_redirects=False)
+            finally:
+                server.terminate()
+                server.wait()
+            print(summarize(worker_class, latencies, errors,
+                            options.seconds))
+    finally:
+        upstream.terminate()
+
+
+if __name__ == '__main__':
+    main()
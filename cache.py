@@ -0,0 +1,215 @@
+"""Template fragment caching for the BookClub pages.
+
+Templates wrap the markup they want to reuse in a cache block:
+
+    {% cache 'bookclub-book', book.id,
+             cache_version(club_version_name(CATALOG, g.user.club_id)) %}
+      ... markup ...
+    {% endcache %}
+
+The block is rendered once and reused for every request that builds the
+same key. Keys include version counters (see models.CacheVersion) which the
+routes bump when the underlying data changes, so stale fragments are never
+served: they just stop being asked for and fall out of the LRU.
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from models import CacheVersion
+
+# Names of the version counters, kept per club (see club_version_name).
+CATALOG = "catalog"     # books added/removed/changed
+TITLES = "titles"       # books added/removed/renamed (not enriched)
+MEMBERS = "members"     # any member's profile or reads changed
+
+
+def club_version_name(name, club_id):
+    """Name of one club's CATALOG, TITLES or MEMBERS counter."""
+
+    return f"{name}:{club_id}"
+
+
+def user_version_name(user_id):
+    """Name of the version counter for one user's profile and reads."""
+
+    return f"user:{user_id}"
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and total size in bytes.
+
+    A value's size is the length of its UTF-8 encoding unless given to `set`.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Get the value stored at `key`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size=None):
+        """Store `value` at `key`, evicting least recently used entries."""
+
+        if size is None:
+            size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+
+            while (len(self._entries) > self.max_entries
+                   or self.current_bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def delete(self, key):
+        """Drop the entry at `key`, if any."""
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+    def items(self):
+        """Get a snapshot list of (key, value) pairs."""
+
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja `{% cache key, ... %}...{% endcache %}` block."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=LRUCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('_cache_support', [nodes.List(key_parts)]),
+            [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key_parts, caller):
+        """Return the cached fragment for `key_parts`, rendering on a miss."""
+
+        cache = self.environment.fragment_cache
+        key = tuple(key_parts)
+
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
+
+
+def cache_version(*names):
+    """Get the current version of the named counters (template helper).
+
+    Versions are looked up once per request; a single name gives an int,
+    several give a tuple.
+    """
+
+    known = g.setdefault('cache_versions', {})
+    missing = [name for name in names if name not in known]
+    if missing:
+        known.update(CacheVersion.lookup(*missing))
+
+    if len(names) == 1:
+        return known[names[0]]
+    return tuple(known[name] for name in names)
+
+
+def bump_catalog(club_id, titles=True):
+    """Invalidate everything that shows the club's book catalog.
+
+    Pass `titles=False` when no book was added, removed or renamed (e.g.
+    only covers and authors were filled in), so the title indexes keep
+    theirs.
+    """
+
+    names = [club_version_name(CATALOG, club_id)]
+    if titles:
+        names.append(club_version_name(TITLES, club_id))
+    CacheVersion.bump(*names)
+    g.pop('cache_versions', None)
+
+
+def bump_user(club_id, user_id=None):
+    """Invalidate everything that shows this user's profile or reads.
+
+    Without a `user_id` (e.g. a user not flushed yet) only the club's
+    member listings are invalidated.
+    """
+
+    members = club_version_name(MEMBERS, club_id)
+    if user_id is None:
+        CacheVersion.bump(members)
+    else:
+        CacheVersion.bump(user_version_name(user_id), members)
+    g.pop('cache_versions', None)
+
+
+def init_cache(app):
+    """Install the fragment cache on the app's Jinja environment."""
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    cache = app.jinja_env.fragment_cache
+    cache.max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES',
+                                       cache.max_entries)
+    cache.max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES',
+                                     cache.max_bytes)
+
+    app.jinja_env.globals.update(
+        cache_version=cache_version,
+        club_version_name=club_version_name,
+        user_version_name=user_version_name,
+        CATALOG=CATALOG,
+        MEMBERS=MEMBERS,
+    )
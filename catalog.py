@@ -0,0 +1,321 @@
+"""Local copy of Open Library's book metadata, imported from its dumps.
+
+Download a dump from https://openlibrary.org/developers/dumps (works,
+editions and authors, or the all-types dump) and import it with
+
+    flask catalog import ol_dump_works_latest.txt.gz ol_dump_authors_latest.txt.gz
+
+Dumps are streamed line by line, parsed by a pool of processes and written
+in batches (COPY on Postgres), so memory use doesn't grow with dump size.
+`search` then answers title searches from the local tables, without the
+network; generator/ol_dump_sample.txt.gz is a small dump to try it on.
+`search_everywhere` tops those up with Open Library's free-text results.
+"""
+
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import time
+from itertools import islice
+
+import click
+
+from models import db, CatalogEntry, CatalogAuthor
+from suggest import normalize
+import openlibrary
+
+BATCH_SIZE = 5000
+PARSE_CHUNK_LINES = 20000
+
+KINDS = {
+    '/type/work': 'work',
+    '/type/edition': 'edition',
+}
+
+
+##############################################################################
+# Searching
+
+
+def search(query, limit=5):
+    """Get catalog entries whose title starts with `query`.
+
+    Entries are shaped like Open Library search docs (key, title,
+    author_name, cover_i), so callers can use either source.
+    """
+
+    prefix = normalize(query)
+    if not prefix:
+        return []
+
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite's LIKE can't use the index (it is case-insensitive): go
+        # through the FTS5 index, matching the title's first words.
+        matches = db.text(
+            "catalog_entries.rowid IN (SELECT rowid FROM catalog_entries_fts "
+            "WHERE catalog_entries_fts MATCH :match)").bindparams(
+                match=f'search_title : ^ "{prefix}" *')
+    else:
+        # normalize() leaves only letters, digits and spaces: no LIKE
+        # wildcards.
+        matches = CatalogEntry.search_title.like(f"{prefix}%")
+
+    rows = (db.session.query(CatalogEntry.key, CatalogEntry.title,
+                             CatalogEntry.cover_id, CatalogAuthor.name)
+            .outerjoin(CatalogAuthor,
+                       CatalogAuthor.key == CatalogEntry.author_key)
+            .filter(matches)
+            .order_by(CatalogEntry.search_title)
+            .limit(limit))
+
+    return [{
+        'key': key,
+        'title': title,
+        'author_name': [author] if author else [],
+        'cover_i': cover_id,
+    } for key, title, cover_id, author in rows]
+
+
+def search_everywhere(query, limit=5, fields=None):
+    """Search the catalog, then Open Library if that found under `limit`.
+
+    The catalog only matches the start of titles. Open Library also
+    matches authors and keywords, so its results fill the rest of the list
+    (catalog entries first, no duplicates). `fields` are the doc fields to
+    ask Open Library for. Raises openlibrary.OpenLibraryError only when
+    the catalog found nothing either.
+    """
+
+    docs = search(query, limit=limit)
+    if len(docs) >= limit:
+        return docs
+
+    if fields:
+        # Needed to spot duplicates
+        fields = list(fields) + [name for name in ('key', 'title')
+                                 if name not in fields]
+    try:
+        remote = openlibrary.search({'q': query}, limit=limit, fields=fields)
+    except openlibrary.OpenLibraryError:
+        if docs:
+            return docs
+        raise
+
+    seen = {doc['key'] for doc in docs}
+    seen.update(normalize(doc['title']) for doc in docs)
+    for doc in remote:
+        if len(docs) >= limit:
+            break
+        title = normalize(doc.get('title') or '')
+        if doc.get('key') in seen or title in seen:
+            continue
+        seen.update((doc.get('key'), title))
+        docs.append(doc)
+    return docs
+
+
+##############################################################################
+# Reading and parsing dumps
+
+
+def read_dump(path):
+    """Yield the lines of a (possibly gzipped) dump file."""
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as dump:
+        yield from dump
+
+
+def parse_line(line):
+    """Parse one dump line into an ('entry', ...) or ('author', ...) record.
+
+    Dump lines are tab-separated: type, key, revision, last modified, JSON.
+    Returns None for other types and for unusable lines.
+    """
+
+    try:
+        record_type, key, _, _, data = line.rstrip('\n').split('\t', 4)
+        data = json.loads(data)
+    except ValueError:
+        return None
+
+    if record_type == '/type/author':
+        name = data.get('name')
+        return ('author', key, name[:500]) if name else None
+
+    kind = KINDS.get(record_type)
+    title = data.get('title')
+    if kind is None or not title:
+        return None
+
+    author_key = None
+    for author in data.get('authors', []):
+        # Works: {"author": {"key": ...}}; editions: {"key": ...}
+        author_key = author.get('author', author).get('key')
+        if author_key:
+            break
+
+    cover_id = next((cover for cover in data.get('covers', [])
+                     if isinstance(cover, int) and cover > 0), None)
+
+    return ('entry', key, kind, title, normalize(title), author_key,
+            cover_id)
+
+
+def parse_lines(lines, processes):
+    """Yield records parsed from `lines`, using `processes` processes.
+
+    Lines are handed to the pool a chunk at a time (while the previous
+    chunk's records are being written), so only two chunks are ever held
+    in memory.
+    """
+
+    if processes <= 1:
+        yield from filter(None, map(parse_line, lines))
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        def submit():
+            chunk = list(islice(lines, PARSE_CHUNK_LINES))
+            if not chunk:
+                return None
+            return pool.map_async(parse_line, chunk, chunksize=500)
+
+        pending = submit()
+        while pending is not None:
+            records = pending.get()
+            pending = submit()
+            yield from filter(None, records)
+
+
+##############################################################################
+# Writing
+
+
+ENTRY_COLUMNS = ['key', 'kind', 'title', 'search_title', 'author_key',
+                 'cover_id']
+AUTHOR_COLUMNS = ['key', 'name']
+
+
+def write_rows(model, columns, rows):
+    """Insert or update `rows` (tuples in `columns` order) in one batch."""
+
+    if not rows:
+        return
+
+    table = model.__tablename__
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        # COPY into a temporary table, then upsert from it.
+        column_list = ', '.join(columns)
+        updates = ', '.join(f"{column} = EXCLUDED.{column}"
+                            for column in columns if column != 'key')
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS staging_{table} "
+                       f"(LIKE {table}) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(f"COPY staging_{table} ({column_list}) "
+                           f"FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"INSERT INTO {table} ({column_list}) "
+                       f"SELECT {column_list} FROM staging_{table} "
+                       f"ON CONFLICT (key) DO UPDATE SET {updates}")
+    elif dialect == 'sqlite':
+        # An upsert rather than INSERT OR REPLACE, whose implicit deletes
+        # don't fire the full-text index's triggers.
+        updates = ', '.join(f"{column} = excluded.{column}"
+                            for column in columns if column != 'key')
+        db.session.execute(db.text(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(':' + column for column in columns)}) "
+            f"ON CONFLICT (key) DO UPDATE SET {updates}"),
+            [dict(zip(columns, row)) for row in rows])
+    else:
+        db.session.execute(model.__table__.insert(),
+                           [dict(zip(columns, row)) for row in rows])
+
+    db.session.commit()
+
+
+def import_dumps(paths, processes=None, batch_size=BATCH_SIZE, progress=None):
+    """Import Open Library dump files into the catalog tables.
+
+    Returns {'entry': count, 'author': count}. `progress`, if given, is
+    called with those counts after every batch.
+    """
+
+    processes = processes or multiprocessing.cpu_count()
+    counts = {'entry': 0, 'author': 0}
+
+    # Keyed by Open Library key: a batch must not upsert a row twice.
+    batches = {'entry': {}, 'author': {}}
+    writers = {
+        'entry': (CatalogEntry, ENTRY_COLUMNS),
+        'author': (CatalogAuthor, AUTHOR_COLUMNS),
+    }
+
+    def flush(record_type):
+        model, columns = writers[record_type]
+        rows = list(batches[record_type].values())
+        write_rows(model, columns, rows)
+        counts[record_type] += len(rows)
+        batches[record_type].clear()
+        if progress:
+            progress(counts)
+
+    for path in paths:
+        for record in parse_lines(read_dump(path), processes):
+            record_type, row = record[0], record[1:]
+            batches[record_type][row[0]] = row
+            if len(batches[record_type]) >= batch_size:
+                flush(record_type)
+
+    for record_type in batches:
+        flush(record_type)
+
+    return counts
+
+
+##############################################################################
+# Commands
+
+
+def init_catalog(app):
+    """Add the `flask catalog` commands."""
+
+    @app.cli.group('catalog')
+    def catalog_cli():
+        """Manage the local Open Library catalog."""
+
+    @catalog_cli.command('import')
+    @click.argument('paths', nargs=-1, required=True,
+                    type=click.Path(exists=True, dir_okay=False))
+    @click.option('--processes', type=int, default=None,
+                  help="Parser processes (default: one per CPU).")
+    @click.option('--batch-size', type=int, default=BATCH_SIZE,
+                  help="Rows written per transaction.")
+    @click.option('--replace', is_flag=True,
+                  help="Empty the catalog before importing.")
+    def import_command(paths, processes, batch_size, replace):
+        """Import Open Library dump files (.txt or .txt.gz)."""
+
+        if replace:
+            CatalogEntry.query.delete()
+            CatalogAuthor.query.delete()
+            db.session.commit()
+
+        started = time.perf_counter()
+
+        def progress(counts):
+            click.echo(f"{counts['entry']} works/editions, "
+                       f"{counts['author']} authors "
+                       f"({time.perf_counter() - started:.1f}s)")
+
+        import_dumps(paths, processes=processes, batch_size=batch_size,
+                     progress=progress)
+        click.echo("Done.")
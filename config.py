@@ -0,0 +1,150 @@
+"""Configuration profiles for the BookClub app.
+
+Pick one with the BOOKCLUB_ENV environment variable (development,
+production or testing); see create_app in app.py.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_list(name):
+    """Get a comma-separated environment variable as a list."""
+
+    return [item.strip() for item in os.environ.get(name, '').split(',')
+            if item.strip()]
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    # If running on SUPABASE
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'SUPABASE_DB_URL', 'postgresql:///bookclub')
+
+    # Embedded mode (sqlitedb.py): keep everything in this SQLite file
+    # instead, e.g. SQLITE_PATH=bookclub.db
+    SQLITE_PATH = os.environ.get('SQLITE_PATH')
+    if SQLITE_PATH:
+        SQLALCHEMY_DATABASE_URI = (
+            f"sqlite:///{os.path.abspath(SQLITE_PATH)}")
+    SQLITE_CACHE_MB = int(os.environ.get('SQLITE_CACHE_MB', 64))
+    SQLITE_MMAP_MB = int(os.environ.get('SQLITE_MMAP_MB', 256))
+    SQLITE_BUSY_TIMEOUT_MS = int(
+        os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    # Connections kept open for the threads using the database (more are
+    # opened while more threads query at once)
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 16))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Database connections per process (default 5, plus 10 overflow). With
+    # gevent workers, size them for the requests querying at once.
+    SQLALCHEMY_POOL_SIZE = (int(os.environ['DB_POOL_SIZE'])
+                            if 'DB_POOL_SIZE' in os.environ else None)
+    SQLALCHEMY_MAX_OVERFLOW = (int(os.environ['DB_MAX_OVERFLOW'])
+                               if 'DB_MAX_OVERFLOW' in os.environ else None)
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # Load flask_debugtoolbar (development only)
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    FRAGMENT_CACHE_MAX_ENTRIES = int(
+        os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+    FRAGMENT_CACHE_MAX_BYTES = int(
+        os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+    # Usernames allowed on the /admin pages, e.g. ADMIN_USERNAMES="ana,luis"
+    ADMIN_USERNAMES = env_list('ADMIN_USERNAMES')
+
+    # Job worker threads to run inside each web process
+    # (0: run them with `flask jobs work`)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 0))
+
+    # Where uploaded reading list exports wait for their import job: a
+    # directory only the app's user can write to (unset: "imports" in the
+    # app's instance folder)
+    IMPORT_UPLOAD_DIR = os.environ.get('IMPORT_UPLOAD_DIR')
+    MAX_CONTENT_LENGTH = 50 * 1024 * 1024
+
+    # Live updates (events.py): "memory" reaches only the streams open in
+    # the same process; "postgres" uses LISTEN/NOTIFY to reach every worker.
+    EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'memory')
+    EVENTS_CHANNEL = os.environ.get('EVENTS_CHANNEL', 'bookclub_events')
+    # Streams are closed (and reopened by the browser) after this long
+    EVENTS_STREAM_SECONDS = int(os.environ.get('EVENTS_STREAM_SECONDS', 300))
+    # Streams open at once per worker process, past which pages poll. Each
+    # holds a gunicorn thread (of GUNICORN_THREADS), or a greenlet under
+    # gevent workers.
+    EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 4))
+    EVENTS_MAX_STREAMS_GEVENT = int(
+        os.environ.get('EVENTS_MAX_STREAMS_GEVENT', 400))
+
+    # Request profiling (profiler.py): requests sent with
+    # "X-Profile: <PROFILE_TOKEN>" are profiled, and so is a
+    # PROFILE_SAMPLE_RATE fraction (0 to 1) of all requests.
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+    # Trace allocations of the requests sent with the token (never sampled
+    # ones)
+    PROFILE_MEMORY = os.environ.get('PROFILE_MEMORY', '1') != '0'
+    # A directory only the app's user can write to (unset: "profiles" in
+    # the app's instance folder)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+
+    # Compiled templates (templating.py), kept across restarts and deploys.
+    # A directory only the app's user can write to; unset, Jinja's per-user
+    # one. Load them all when the app is created with TEMPLATE_WARMUP.
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+    TEMPLATE_WARMUP = False
+
+    # Books with more reads than this are deleted in chunks by a job
+    BOOK_DELETE_INLINE_MAX_READS = int(
+        os.environ.get('BOOK_DELETE_INLINE_MAX_READS', 10000))
+
+
+class DevelopmentConfig(Config):
+    """Local development: debug toolbar on."""
+
+    DEBUG_TOOLBAR = True
+
+
+class ProductionConfig(Config):
+    """Behind gunicorn: no debug tooling, templates loaded up front."""
+
+    TEMPLATE_WARMUP = True
+
+
+class TestingConfig(Config):
+    """Running tests: separate database, no CSRF, no page cache."""
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'TEST_DATABASE_URL', 'postgresql:///bookclub_test')
+    WTF_CSRF_ENABLED = False
+    PAGE_CACHE_ENABLED = False
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+def get_profile(name=None):
+    """Get the config class for `name`, defaulting to $BOOKCLUB_ENV."""
+
+    name = name or os.environ.get('BOOKCLUB_ENV', 'development')
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown BOOKCLUB_ENV profile {name!r}; "
+                         f"use one of {', '.join(PROFILES)}")
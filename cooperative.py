@@ -0,0 +1,57 @@
+"""Cooperative serving mode: gevent workers instead of threads.
+
+With GUNICORN_WORKER_CLASS=gevent (see gunicorn.conf.py), each worker
+process runs every request in a greenlet, and greenlets switch whenever one
+waits on the network. A request waiting on Open Library (/search) or on
+Postgres then holds no thread, so one process can have hundreds in flight
+(GUNICORN_WORKER_CONNECTIONS). Flask 1.0 views can't be `async def`; under
+gevent the same views get the same concurrency without being rewritten.
+
+For this to hold, everything has to wait cooperatively:
+
+- `patch` swaps in gevent's socket, ssl, select and threading (requests to
+  Open Library, the events listener) and makes psycopg2 use its
+  asynchronous mode, yielding to other greenlets while Postgres answers;
+- CPU-bound work, which would stall every greenlet of the process, goes
+  through `offload`: bcrypt hashing runs in a real thread (bcrypt releases
+  the GIL), so other requests keep being served meanwhile.
+
+Needs `gevent` and `psycogreen`. SQLite queries don't yield (they are short
+and local). The profiler's stack sampling (profiler.py) sees no samples
+under gevent, since every greenlet shares one OS thread.
+"""
+
+import sys
+
+
+def patch():
+    """Make the standard library and psycopg2 cooperative.
+
+    Call it before anything else is imported (gunicorn.conf.py does).
+    """
+
+    from gevent import monkey
+    monkey.patch_all()
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def is_patched():
+    """Is this process running under gevent's monkey patches?"""
+
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def offload(function, *args, **kwargs):
+    """Call CPU-bound `function` without stalling the other greenlets.
+
+    Under gevent it runs in the hub's pool of real threads; otherwise (sync
+    or thread workers) it is just called.
+    """
+
+    if is_patched():
+        import gevent
+        return gevent.get_hub().threadpool.apply(function, args, kwargs)
+    return function(*args, **kwargs)
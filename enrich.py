@@ -0,0 +1,226 @@
+"""Fill in missing book authors and covers from Open Library.
+
+Books without an author or with the default cover are looked up in the
+local catalog (see catalog.py) and then, for the rest, on Open Library with
+a few concurrent, rate-limited requests. Results are written back a batch
+at a time with one bulk UPDATE, and each book is stamped with
+`metadata_checked_at`, so an interrupted run picks up where it stopped.
+
+Runs as the `enrich_metadata` background job (queued when a book is added)
+or with `flask enrich run`; `flask enrich status` shows progress. The job
+fails when Open Library couldn't be reached for some books, so the job
+queue retries it (with backoff) for those books.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+
+from cache import bump_catalog
+from catalog import search as search_catalog
+from jobs import job
+from models import db, Book
+from suggest import normalize
+import openlibrary
+
+BATCH_SIZE = 50
+CONCURRENCY = 4
+REQUESTS_PER_SECOND = 2.0
+
+DEFAULT_BOOK_IMAGE = Book.bookimag_url.default.arg
+
+
+class LookupsFailed(Exception):
+    """Some books couldn't be looked up (Open Library errors)."""
+
+
+class RateLimiter:
+    """Spaces out calls to `wait` across threads to `per_second` a second."""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+
+def needs_metadata():
+    """SQL condition for books still missing an author or a cover."""
+
+    return db.and_(
+        Book.metadata_checked_at.is_(None),
+        db.or_(Book.bookauthor.is_(None),
+               Book.bookimag_url.is_(None),
+               Book.bookimag_url == DEFAULT_BOOK_IMAGE))
+
+
+def best_match(title, docs):
+    """Get the first doc whose title matches the book's, or None."""
+
+    wanted = normalize(title)
+    for doc in docs:
+        found = normalize(doc.get('title', ''))
+        if found and (found == wanted or found.startswith(wanted)
+                      or wanted.startswith(found)):
+            return doc
+    return None
+
+
+def lookup_online(title, limiter):
+    """Search Open Library for `title` (runs in a worker thread).
+
+    Returns the matching doc, None if there is none, or the exception if
+    the request failed (the book is then left for a later run).
+    """
+
+    limiter.wait()
+    try:
+        docs = openlibrary.search({'title': title}, limit=3,
+                                  fields=['title', 'author_name', 'cover_i'])
+    except openlibrary.OpenLibraryError as exc:
+        return exc
+    return best_match(title, docs)
+
+
+def metadata_update(book, doc, now):
+    """Build the bulk-update mapping for `book` from a search doc."""
+
+    book_id, title, author, image, club_id = book
+    update = {'id': book_id, 'club_id': club_id, 'metadata_checked_at': now}
+    if doc:
+        if not author and doc.get('author_name'):
+            update['bookauthor'] = doc['author_name'][0][:200]
+        if image in (None, DEFAULT_BOOK_IMAGE) and doc.get('cover_i'):
+            update['bookimag_url'] = openlibrary.cover_url(doc['cover_i'])
+    return update
+
+
+def enrich_books(book_ids=None, batch_size=BATCH_SIZE,
+                 concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND,
+                 progress=None):
+    """Look up metadata for books missing it (all of them, or `book_ids`).
+
+    Commits after every batch. Returns {'checked': n, 'updated': n,
+    'failed': n}; failed books (network errors) stay pending.
+    """
+
+    counts = {'checked': 0, 'updated': 0, 'failed': 0}
+    limiter = RateLimiter(rate)
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            query = (db.session.query(Book.id, Book.booktitle,
+                                      Book.bookauthor, Book.bookimag_url,
+                                      Book.club_id)
+                     .filter(needs_metadata(), Book.id > last_id))
+            if book_ids is not None:
+                query = query.filter(Book.id.in_(book_ids))
+            books = query.order_by(Book.id).limit(batch_size).all()
+            if not books:
+                break
+            last_id = books[-1][0]
+
+            # Local catalog first (on this thread: it uses the session)...
+            docs = {}
+            online = []
+            for book in books:
+                found = best_match(book[1], search_catalog(book[1], limit=3))
+                if found:
+                    docs[book[0]] = found
+                else:
+                    online.append(book)
+
+            # ...then Open Library, a few requests at a time.
+            results = executor.map(
+                lambda book: lookup_online(book[1], limiter), online)
+            for book, result in zip(online, results):
+                if isinstance(result, Exception):
+                    counts['failed'] += 1
+                else:
+                    docs[book[0]] = result
+
+            now = datetime.utcnow()
+            updates = [metadata_update(book, docs[book[0]], now)
+                       for book in books if book[0] in docs]
+            db.session.bulk_update_mappings(Book, updates)
+            for club_id in {update['club_id'] for update in updates}:
+                bump_catalog(club_id, titles=False)
+            db.session.commit()
+
+            counts['checked'] += len(updates)
+            counts['updated'] += sum(1 for update in updates
+                                     if len(update) > 3)
+            if progress:
+                progress(counts)
+
+    return counts
+
+
+def enrichment_status():
+    """Get counts of books with complete, checked and pending metadata."""
+
+    total = db.session.query(db.func.count(Book.id)).scalar()
+    pending = (db.session.query(db.func.count(Book.id))
+               .filter(needs_metadata()).scalar())
+    checked = (db.session.query(db.func.count(Book.id))
+               .filter(Book.metadata_checked_at.isnot(None)).scalar())
+    return {'total': total, 'pending': pending, 'checked': checked}
+
+
+@job('enrich_metadata')
+def enrich_metadata(book_ids=None):
+    """Background job: enrich the given books, or every pending book.
+
+    Raises LookupsFailed after the run if any lookup failed, so the job is
+    retried; the books done meanwhile are committed and skipped next time.
+    """
+
+    counts = enrich_books(book_ids=book_ids)
+    if counts['failed']:
+        raise LookupsFailed(f"{counts['failed']} book(s) could not be "
+                            f"looked up on Open Library")
+
+
+def init_enrich(app):
+    """Add the `flask enrich` commands."""
+
+    @app.cli.group('enrich')
+    def enrich_cli():
+        """Fill in missing book authors and covers."""
+
+    @enrich_cli.command('run')
+    @click.option('--batch-size', default=BATCH_SIZE,
+                  help="Books looked up and written per transaction.")
+    @click.option('--concurrency', default=CONCURRENCY,
+                  help="Concurrent Open Library requests.")
+    @click.option('--rate', default=REQUESTS_PER_SECOND,
+                  help="Maximum Open Library requests per second.")
+    def run_command(batch_size, concurrency, rate):
+        """Enrich every book still missing metadata."""
+
+        def progress(counts):
+            click.echo(f"{counts['checked']} checked, "
+                       f"{counts['updated']} updated, "
+                       f"{counts['failed']} failed")
+
+        enrich_books(batch_size=batch_size, concurrency=concurrency,
+                     rate=rate, progress=progress)
+        click.echo("Done.")
+
+    @enrich_cli.command('status')
+    def status_command():
+        """Show how many books still need metadata."""
+
+        status = enrichment_status()
+        click.echo(f"{status['pending']} of {status['total']} books pending "
+                   f"({status['checked']} checked so far)")
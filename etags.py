@@ -0,0 +1,113 @@
+"""Conditional GET support for the BookClub pages.
+
+A route decorated with `conditional(...)` gets a weak ETag built from the
+version counters of the data it shows (see cache.py), computed *before* the
+view runs. If the browser already has that version (`If-None-Match`), we
+answer 304 without running the view's queries or rendering its template.
+
+    @app.route('/users')
+    @conditional(members, catalog)
+    def list_users():
+        ...
+"""
+
+import hashlib
+import os
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+
+from cache import (CATALOG, MEMBERS, cache_version, club_version_name,
+                   user_version_name)
+
+
+##############################################################################
+# Stamps: each one names the version counters a page depends on.
+# They get the view's URL arguments, so they can depend on them.
+
+
+def catalog(**view_args):
+    """The page shows the viewer's club's book catalog."""
+
+    return [club_version_name(CATALOG, g.user.club_id)] if g.user else []
+
+
+def members(**view_args):
+    """The page shows every club member's profile and reads."""
+
+    return [club_version_name(MEMBERS, g.user.club_id)] if g.user else []
+
+
+def viewed_user(user_id, **view_args):
+    """The page shows the profile and reads of the user in the URL."""
+
+    return [user_version_name(user_id)]
+
+
+##############################################################################
+# ETag computation and decorator
+
+
+def compute_etag(stamps, view_args):
+    """Build the ETag for the current viewer and the given stamps.
+
+    The current user is always part of it (the navbar shows their name), as
+    is the APP_RELEASE config, so a deploy with new templates changes tags.
+    """
+
+    user_id = g.user.id if g.user else None
+    names = []
+    if user_id is not None:
+        names.append(user_version_name(user_id))
+    for stamp in stamps:
+        names.extend(name for name in stamp(**view_args) if name not in names)
+
+    versions = cache_version(*names) if names else ()
+    if len(names) == 1:
+        versions = (versions,)
+
+    raw = repr((current_app.config.get('APP_RELEASE', ''),
+                request.full_path, user_id, tuple(zip(names, versions))))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def conditional(*stamps):
+    """Serve the view with a weak ETag and answer matching requests with 304.
+
+    Only GETs (and HEADs) are handled; pages carrying flash messages are
+    always rendered, since rendering is what consumes the message.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (not current_app.config.get('CONDITIONAL_GET_ENABLED', True)
+                    or request.method not in ('GET', 'HEAD')
+                    or '_flashes' in session):
+                return view(*args, **kwargs)
+
+            etag = compute_etag(stamps, kwargs)
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            # Per-user pages: let the browser keep them, but always revalidate.
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+
+        return wrapper
+    return decorator
+
+
+def init_etags(app):
+    """Read conditional GET settings from the environment."""
+
+    app.config.setdefault('CONDITIONAL_GET_ENABLED',
+                          os.environ.get('CONDITIONAL_GET', '1') != '0')
+    app.config.setdefault('APP_RELEASE', os.environ.get('APP_RELEASE', ''))
@@ -0,0 +1,268 @@
+"""Live change events, pushed to browsers with Server-Sent Events.
+
+Code that changes a club's catalog or someone's reads calls `publish`
+before committing; once the transaction commits, the event goes to the
+/events streams of that club's members, and static/js/live.js patches the
+home page with it instead of the member reloading. Events rolled back are
+never sent.
+
+Two brokers carry the events:
+
+- `memory` (default): in-process only, so a stream sees the changes made
+  by its own worker process. Fine for `flask run` or a single worker.
+- `postgres`: events are sent with NOTIFY and every process LISTENs on
+  EVENTS_CHANNEL, so all workers see all changes. Set EVENTS_BACKEND.
+
+Under gunicorn's thread workers each open stream holds one of the worker's
+threads, so a process keeps at most EVENTS_MAX_STREAMS open (much more,
+EVENTS_MAX_STREAMS_GEVENT, under gevent workers, where a stream only holds
+a greenlet; see cooperative.py). Past that /events answers 503 and the page
+polls for changes instead. Streams end after EVENTS_STREAM_SECONDS and the
+browser reconnects by itself.
+"""
+
+import itertools
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from flask import Response, current_app
+from sqlalchemy import event
+
+import cooperative
+from models import db
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+RECONNECT_MILLISECONDS = 3000
+
+
+def publish(kind, club_id, **data):
+    """Send a change event to the club once the current transaction commits.
+
+    Does not commit: call it next to the change it describes.
+    """
+
+    db.session.info.setdefault('pending_events', []).append(
+        {'kind': kind, 'club_id': club_id, 'data': data})
+
+
+def ended_savepoint(session):
+    """Did the commit/rollback being handled only end a SAVEPOINT?"""
+
+    transaction = session.transaction
+    while transaction.parent is not None and not transaction.nested:
+        transaction = transaction.parent
+    return transaction.nested
+
+
+def send_pending(session):
+    if ended_savepoint(session):
+        return
+    events = session.info.pop('pending_events', None)
+    if not events or not current_app:
+        return
+    for pending in events:
+        try:
+            current_app.events.publish(pending)
+        except Exception:
+            # The change is committed; losing its event only costs a reload.
+            logger.exception("Could not publish %s event", pending['kind'])
+
+
+def drop_pending(session):
+    if not ended_savepoint(session):
+        session.info.pop('pending_events', None)
+
+
+##############################################################################
+# Brokers
+
+
+class MemoryBroker:
+    """Fans events out to the streams open in this process.
+
+    Each stream gets a bounded queue; a stream too slow to keep up loses
+    events rather than holding memory (the page is still right on reload).
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, limit=None):
+        """Get a queue of the events to come, or None if `limit` streams
+        are open already."""
+
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, change):
+        self.deliver(change)
+
+    def deliver(self, change):
+        """Hand `change` to every local stream."""
+
+        change = dict(change, id=next(self._ids))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(change)
+            except queue.Full:
+                pass
+
+
+class PostgresBroker(MemoryBroker):
+    """Sends events with NOTIFY; a thread per process LISTENs for them.
+
+    The listener starts with the first stream opened in a process, so it
+    runs in each gunicorn worker rather than in the preloading master.
+    """
+
+    def __init__(self, engine, channel):
+        super().__init__()
+        self.engine = engine
+        self.channel = channel
+        self._listener = None
+
+    def subscribe(self, limit=None):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, name='events-listener', daemon=True)
+                self._listener.start()
+        return super().subscribe(limit)
+
+    def publish(self, change):
+        # Outside the committed transaction: its own short one.
+        with self.engine.begin() as connection:
+            connection.execute(db.text("SELECT pg_notify(:channel, :payload)"),
+                               channel=self.channel,
+                               payload=json.dumps(change))
+
+    def _listen(self):
+        while True:
+            try:
+                connection = self.engine.raw_connection()
+                # Closed for good, not returned to the pool in autocommit.
+                connection.detach()
+                try:
+                    connection.set_isolation_level(0)  # autocommit
+                    cursor = connection.cursor()
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                    while True:
+                        if select.select([connection.connection], [], [],
+                                         KEEPALIVE_SECONDS) == ([], [], []):
+                            continue
+                        connection.connection.poll()
+                        while connection.connection.notifies:
+                            notify = connection.connection.notifies.pop(0)
+                            self.deliver(json.loads(notify.payload))
+                finally:
+                    connection.close()
+            except Exception:
+                logger.exception("Events listener lost its connection")
+                time.sleep(1)
+
+
+##############################################################################
+# Streaming
+
+
+def format_event(change):
+    """Encode an event in the text/event-stream format."""
+
+    return (f"id: {change['id']}\n"
+            f"event: {change['kind']}\n"
+            f"data: {json.dumps(change['data'])}\n\n")
+
+
+def stream(broker, subscriber, seconds, club_id):
+    """Yield a stream's text: the club's events as they come, comments to
+    keep alive."""
+
+    try:
+        yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                change = subscriber.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+            else:
+                if change.get('club_id') == club_id:
+                    yield format_event(change)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def max_streams(config):
+    """How many streams this process may keep open at once."""
+
+    if cooperative.is_patched():
+        return config['EVENTS_MAX_STREAMS_GEVENT']
+    return config['EVENTS_MAX_STREAMS']
+
+
+def event_stream_response(club_id):
+    """The /events response: the club's events, as they happen.
+
+    The generator does not touch the database, so no connection is held
+    while the stream is open. With max_streams() open already, answers 503
+    instead: the browser's EventSource gives up and the page polls.
+    """
+
+    broker = current_app.events
+    subscriber = broker.subscribe(limit=max_streams(current_app.config))
+    if subscriber is None:
+        return Response(
+            "Too many live streams open, poll instead.\n", status=503,
+            mimetype='text/plain',
+            headers={'Retry-After': str(RECONNECT_MILLISECONDS // 1000)})
+
+    seconds = current_app.config['EVENTS_STREAM_SECONDS']
+    response = Response(
+        stream(broker, subscriber, seconds, club_id),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'private, no-cache',
+            # Don't let nginx buffer the stream
+            'X-Accel-Buffering': 'no',
+        })
+    # Also when the client leaves before the stream has started
+    response.call_on_close(lambda: broker.unsubscribe(subscriber))
+    return response
+
+
+def init_events(app):
+    """Give the app its events broker and send events on commit."""
+
+    backend = app.config['EVENTS_BACKEND']
+    if backend == 'postgres':
+        with app.app_context():
+            engine = db.engine
+        app.events = PostgresBroker(engine, app.config['EVENTS_CHANNEL'])
+    elif backend == 'memory':
+        app.events = MemoryBroker()
+    else:
+        raise ValueError(f"Unknown EVENTS_BACKEND {backend!r}; "
+                         f"use memory or postgres")
+
+    if not event.contains(db.session, 'after_commit', send_pending):
+        event.listen(db.session, 'after_commit', send_pending)
+        event.listen(db.session, 'after_rollback', drop_pending)
@@ -0,0 +1,218 @@
+"""Export the clubs, users, books and reads as CSV, JSONL or Parquet.
+
+Rows are read through a server-side cursor (`yield_per`) and written out a
+chunk at a time, so memory use stays flat however big the table grows.
+Admins can download an export from /admin/export/<table>.<format>; scripts
+(e.g. nightly analytics snapshots) can run
+
+    flask export reads --format parquet --output reads.parquet
+
+Parquet needs pyarrow (`pip install pyarrow`); CSV and JSONL need nothing.
+"""
+
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+from itertools import islice
+
+import click
+
+from models import db, Club, User, Book, Read
+
+CHUNK_ROWS = 5000
+
+# Exported columns, id first. Users' emails and password hashes stay in the
+# database.
+TABLES = {
+    'clubs': [Club.id, Club.name, Club.created_at],
+    'users': [User.id, User.club_id, User.username, User.bio, User.location],
+    'books': [Book.id, Book.club_id, Book.booktitle, Book.bookauthor,
+              Book.bookimag_url, Book.metadata_checked_at, Book.created_at],
+    'reads': [Read.id, Read.club_id, Read.user_id, Read.book_id,
+              Read.created_at],
+}
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ExportError(Exception):
+    """The export can't be made as asked."""
+
+
+def column_names(table):
+    return [column.key for column in TABLES[table]]
+
+
+def read_rows(table, chunk_rows=CHUNK_ROWS):
+    """Yield lists of up to `chunk_rows` rows of `table`, in id order.
+
+    Rows are fetched `chunk_rows` at a time from a server-side cursor.
+    """
+
+    columns = TABLES[table]
+    rows = iter(db.session.query(*columns)
+                .order_by(columns[0])
+                .yield_per(chunk_rows))
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            return
+        yield chunk
+
+
+##############################################################################
+# Formats: each turns chunks of rows into a stream of bytes.
+
+
+def to_csv(names, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't export {value!r} as JSON")
+
+
+def to_jsonl(names, chunks):
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(names, row)), default=json_value)
+                      + '\n' for row in chunk).encode('utf-8')
+
+
+class ByteSink(io.RawIOBase):
+    """Write-only file collecting what pyarrow writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_schema(pa, table):
+    """Arrow schema for `table`'s exported columns."""
+
+    fields = []
+    for column in TABLES[table]:
+        python_type = column.type.python_type
+        if python_type is int:
+            arrow_type = pa.int64()
+        elif python_type is datetime:
+            arrow_type = pa.timestamp('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.key, arrow_type))
+    return pa.schema(fields)
+
+
+def import_pyarrow():
+    """Get the pyarrow modules Parquet exports need."""
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("Parquet exports need pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+def to_parquet(table, chunks, pa, pq):
+    """Write one Parquet row group per chunk, yielding the bytes as it goes."""
+
+    schema = parquet_schema(pa, table)
+    sink = ByteSink()
+    with pq.ParquetWriter(sink, schema, compression='snappy') as writer:
+        for chunk in chunks:
+            arrays = [pa.array(values, type=field.type)
+                      for values, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export(table, fmt, chunk_rows=CHUNK_ROWS):
+    """Get a generator of the bytes of `table` exported as `fmt`.
+
+    Raises ExportError for an unknown table or format, or when pyarrow is
+    missing for Parquet; the database is only queried as it is consumed.
+    """
+
+    if table not in TABLES:
+        raise ExportError(f"Unknown table {table!r}; "
+                          f"use one of {', '.join(TABLES)}")
+    if fmt not in MIMETYPES:
+        raise ExportError(f"Unknown format {fmt!r}; "
+                          f"use one of {', '.join(MIMETYPES)}")
+
+    chunks = read_rows(table, chunk_rows)
+    if fmt == 'csv':
+        return to_csv(column_names(table), chunks)
+    if fmt == 'jsonl':
+        return to_jsonl(column_names(table), chunks)
+
+    pa, pq = import_pyarrow()
+    return to_parquet(table, chunks, pa, pq)
+
+
+##############################################################################
+# Commands
+
+
+def init_export(app):
+    """Add the `flask export` command."""
+
+    @app.cli.command('export')
+    @click.argument('table', type=click.Choice(list(TABLES)))
+    @click.option('--format', 'fmt', type=click.Choice(list(MIMETYPES)),
+                  default='csv', help="Output format.")
+    @click.option('--output', '-o', type=click.Path(dir_okay=False),
+                  help="File to write (default: standard output).")
+    @click.option('--chunk-rows', type=int, default=CHUNK_ROWS,
+                  help="Rows fetched and written at a time.")
+    def export_command(table, fmt, output, chunk_rows):
+        """Export TABLE (clubs, users, books or reads)."""
+
+        try:
+            data = export(table, fmt, chunk_rows)
+        except ExportError as exc:
+            raise click.ClickException(str(exc))
+
+        if output is None:
+            for chunk in data:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(output, 'wb') as out:
+            for chunk in data:
+                out.write(chunk)
+        click.echo(f"Wrote {output}", err=True)
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length, Optional
 
@@ -15,12 +16,25 @@ class BookAddForm(FlaskForm):
     image_url = StringField('(Optional) Book Image URL')
 
 
+class ReadingImportForm(FlaskForm):
+    """Form for uploading a Goodreads/StoryGraph export."""
+
+    export = FileField('Goodreads or StoryGraph CSV export',
+                       validators=[FileRequired(), FileAllowed(['csv'])])
+
+
 class UserAddForm(FlaskForm):
     """Form for adding users."""
 
     username = StringField('Username', validators=[DataRequired()])
     email = StringField('E-mail', validators=[DataRequired(), Email()])
     password = PasswordField('Password', validators=[Length(min=6)])
+    # Started if it doesn't exist; joining an existing one takes its invite
+    # code. Empty joins the default club.
+    club = StringField('(Optional) Club', validators=[Optional(),
+                                                      Length(max=100)])
+    invite_code = StringField('(Optional) Club invite code',
+                              validators=[Optional(), Length(max=100)])
     # image_url = StringField('(Optional) Image URL')
 
 
@@ -0,0 +1,4 @@
+-- Add the heartbeat running jobs refresh (jobs.py) to an existing database.
+
+ALTER TABLE jobs ADD COLUMN heartbeat_at TIMESTAMP;
+UPDATE jobs SET heartbeat_at = started_at WHERE status = 'running';
@@ -0,0 +1,182 @@
+-- Move a database created before clubs existed to the club-partitioned
+-- schema of supabase_dbgenerator.sql. Everyone joins the default club.
+-- Works from the original schema (books, users, reads) or any later one:
+-- columns and tables added since are created when missing. Needs Postgres
+-- 12+. Then recompute the rollups: flask analytics rebuild
+
+BEGIN;
+
+-- Columns added after the original schema. Rows that predate them keep
+-- NULL: enrichment checks those books, and the rollups skip unknown dates.
+ALTER TABLE books ADD COLUMN IF NOT EXISTS metadata_checked_at TIMESTAMP;
+ALTER TABLE books ADD COLUMN IF NOT EXISTS created_at TIMESTAMP;
+ALTER TABLE reads ADD COLUMN IF NOT EXISTS created_at TIMESTAMP;
+
+CREATE TABLE clubs (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    invite_code TEXT,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+);
+
+INSERT INTO clubs (name) VALUES ('BookClub');
+
+ALTER TABLE users
+    ADD COLUMN club_id INTEGER NOT NULL DEFAULT 1
+        REFERENCES clubs(id) ON DELETE CASCADE;
+ALTER TABLE users ALTER COLUMN club_id DROP DEFAULT;
+ALTER TABLE users ADD CONSTRAINT uq_users_club_id UNIQUE (club_id, id);
+
+-- The rollups are rebuilt per club afterwards
+DROP TABLE IF EXISTS book_read_counts, member_month_reads, weekly_new_books;
+
+-- Copy books and reads into partitioned tables, keeping their ids (and
+-- sequences).
+ALTER TABLE reads RENAME TO reads_unpartitioned;
+ALTER TABLE books RENAME TO books_unpartitioned;
+
+CREATE TABLE books (
+    id INTEGER NOT NULL DEFAULT nextval('books_id_seq'),
+    club_id INTEGER NOT NULL REFERENCES clubs(id) ON DELETE CASCADE,
+    booktitle VARCHAR(200) NOT NULL,
+    bookauthor VARCHAR(200),
+    bookimag_url TEXT DEFAULT '/static/images/book_logo.png',
+    metadata_checked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    PRIMARY KEY (club_id, id)
+) PARTITION BY HASH (club_id);
+
+CREATE TABLE reads (
+    id INTEGER NOT NULL DEFAULT nextval('reads_id_seq'),
+    club_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    PRIMARY KEY (club_id, id),
+    FOREIGN KEY (club_id, user_id) REFERENCES users (club_id, id) ON DELETE CASCADE,
+    FOREIGN KEY (club_id, book_id) REFERENCES books (club_id, id) ON DELETE CASCADE
+) PARTITION BY HASH (club_id);
+
+DO $$
+BEGIN
+    FOR remainder IN 0..15 LOOP
+        EXECUTE format('CREATE TABLE books_p%s PARTITION OF books '
+                       'FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+                       remainder, remainder);
+        EXECUTE format('CREATE TABLE reads_p%s PARTITION OF reads '
+                       'FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+                       remainder, remainder);
+    END LOOP;
+END $$;
+
+INSERT INTO books (id, club_id, booktitle, bookauthor, bookimag_url,
+                   metadata_checked_at, created_at)
+SELECT id, 1, booktitle, bookauthor, bookimag_url, metadata_checked_at,
+       created_at
+FROM books_unpartitioned;
+
+-- A member reads a book once: keep the first of any duplicates
+INSERT INTO reads (id, club_id, user_id, book_id, created_at)
+SELECT DISTINCT ON (user_id, book_id) id, 1, user_id, book_id, created_at
+FROM reads_unpartitioned
+ORDER BY user_id, book_id, id;
+
+-- Indexes after the copy: faster than maintaining them row by row
+CREATE UNIQUE INDEX ix_reads_club_user ON reads (club_id, user_id, book_id);
+CREATE INDEX ix_reads_club_book ON reads (club_id, book_id);
+
+ALTER SEQUENCE books_id_seq OWNED BY books.id;
+ALTER SEQUENCE reads_id_seq OWNED BY reads.id;
+DROP TABLE reads_unpartitioned, books_unpartitioned;
+
+CREATE TABLE book_read_counts (
+    club_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    reads INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (club_id, book_id),
+    FOREIGN KEY (club_id, book_id) REFERENCES books (club_id, id) ON DELETE CASCADE
+);
+
+CREATE INDEX ix_book_read_counts_reads ON book_read_counts (club_id, reads, book_id);
+
+CREATE TABLE member_month_reads (
+    club_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    month DATE NOT NULL,
+    reads INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (club_id, user_id, month),
+    FOREIGN KEY (club_id, user_id) REFERENCES users (club_id, id) ON DELETE CASCADE
+);
+
+CREATE INDEX ix_member_month_reads_month ON member_month_reads (club_id, month, reads);
+
+CREATE TABLE weekly_new_books (
+    club_id INTEGER NOT NULL REFERENCES clubs(id) ON DELETE CASCADE,
+    week DATE NOT NULL,
+    books INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (club_id, week)
+);
+
+-- Tables added after the original schema that clubs don't change. An
+-- existing jobs table may also need migrate_job_heartbeats.sql.
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(100) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    last_error TEXT,
+    run_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+    created_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_jobs_polling ON jobs (status, priority, run_at);
+
+CREATE TABLE IF NOT EXISTS catalog_entries (
+    key VARCHAR(40) PRIMARY KEY,
+    kind VARCHAR(10) NOT NULL,
+    title TEXT NOT NULL,
+    search_title TEXT NOT NULL,
+    author_key VARCHAR(40),
+    cover_id INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS ix_catalog_entries_search_title
+    ON catalog_entries (search_title text_pattern_ops);
+
+CREATE TABLE IF NOT EXISTS catalog_authors (
+    key VARCHAR(40) PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS reading_imports (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    rows_seen INTEGER NOT NULL DEFAULT 0,
+    books_created INTEGER NOT NULL DEFAULT 0,
+    reads_created INTEGER NOT NULL DEFAULT 0,
+    rows_skipped INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_reading_imports_user_id
+    ON reading_imports (user_id);
+
+-- Cached pages were keyed on the old, club-less version counters
+DELETE FROM cache_versions WHERE name IN ('catalog', 'members');
+
+COMMIT;
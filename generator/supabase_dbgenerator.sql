@@ -1,27 +1,156 @@
 -- SQL script to create tables for Supabase from SQLAlchemy models
 
--- Table: books
-CREATE TABLE books (
+-- Needs Postgres 12+ (foreign keys to partitioned tables).
+-- Existing databases: see migrate_to_clubs.sql.
+
+-- Table: clubs
+CREATE TABLE clubs (
     id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    invite_code TEXT,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+);
+
+-- Members who don't name a club at signup join this one (models.DEFAULT_CLUB_ID)
+INSERT INTO clubs (name) VALUES ('BookClub');
+
+-- Table: books, hash-partitioned by club (models.CLUB_PARTITIONS)
+CREATE TABLE books (
+    id SERIAL NOT NULL,
+    club_id INTEGER NOT NULL REFERENCES clubs(id) ON DELETE CASCADE,
     booktitle VARCHAR(200) NOT NULL,
     bookauthor VARCHAR(200),
-    bookimag_url TEXT DEFAULT '/static/images/book_logo.png'
-);
+    bookimag_url TEXT DEFAULT '/static/images/book_logo.png',
+    metadata_checked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    PRIMARY KEY (club_id, id)
+) PARTITION BY HASH (club_id);
 
 -- Table: users
 CREATE TABLE users (
     id SERIAL PRIMARY KEY,
+    club_id INTEGER NOT NULL REFERENCES clubs(id) ON DELETE CASCADE,
     email TEXT NOT NULL UNIQUE,
     username TEXT NOT NULL UNIQUE,
     bio TEXT,
     location TEXT,
-    password TEXT NOT NULL
+    password TEXT NOT NULL,
+    CONSTRAINT uq_users_club_id UNIQUE (club_id, id)
 );
 
--- Table: reads
+-- Table: reads, hash-partitioned by club like books
 CREATE TABLE reads (
+    id SERIAL NOT NULL,
+    club_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+    PRIMARY KEY (club_id, id),
+    FOREIGN KEY (club_id, user_id) REFERENCES users (club_id, id) ON DELETE CASCADE,
+    FOREIGN KEY (club_id, book_id) REFERENCES books (club_id, id) ON DELETE CASCADE
+) PARTITION BY HASH (club_id);
+
+CREATE UNIQUE INDEX ix_reads_club_user ON reads (club_id, user_id, book_id);
+CREATE INDEX ix_reads_club_book ON reads (club_id, book_id);
+
+DO $$
+BEGIN
+    FOR remainder IN 0..15 LOOP
+        EXECUTE format('CREATE TABLE books_p%s PARTITION OF books '
+                       'FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+                       remainder, remainder);
+        EXECUTE format('CREATE TABLE reads_p%s PARTITION OF reads '
+                       'FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+                       remainder, remainder);
+    END LOOP;
+END $$;
+
+-- Table: cache_versions
+CREATE TABLE cache_versions (
+    name VARCHAR(100) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Table: jobs
+CREATE TABLE jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    last_error TEXT,
+    run_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+    created_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX ix_jobs_polling ON jobs (status, priority, run_at);
+
+-- Table: catalog_entries (imported from Open Library dumps)
+CREATE TABLE catalog_entries (
+    key VARCHAR(40) PRIMARY KEY,
+    kind VARCHAR(10) NOT NULL,
+    title TEXT NOT NULL,
+    search_title TEXT NOT NULL,
+    author_key VARCHAR(40),
+    cover_id INTEGER
+);
+
+CREATE INDEX ix_catalog_entries_search_title
+    ON catalog_entries (search_title text_pattern_ops);
+
+-- Table: catalog_authors (imported from Open Library dumps)
+CREATE TABLE catalog_authors (
+    key VARCHAR(40) PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+-- Table: reading_imports
+CREATE TABLE reading_imports (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE
+    filename TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    rows_seen INTEGER NOT NULL DEFAULT 0,
+    books_created INTEGER NOT NULL DEFAULT 0,
+    reads_created INTEGER NOT NULL DEFAULT 0,
+    rows_skipped INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX ix_reading_imports_user_id ON reading_imports (user_id);
+
+-- Analytics rollups (analytics.py), per club
+CREATE TABLE book_read_counts (
+    club_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    reads INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (club_id, book_id),
+    FOREIGN KEY (club_id, book_id) REFERENCES books (club_id, id) ON DELETE CASCADE
 );
 
+CREATE INDEX ix_book_read_counts_reads ON book_read_counts (club_id, reads, book_id);
+
+CREATE TABLE member_month_reads (
+    club_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    month DATE NOT NULL,
+    reads INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (club_id, user_id, month),
+    FOREIGN KEY (club_id, user_id) REFERENCES users (club_id, id) ON DELETE CASCADE
+);
+
+CREATE INDEX ix_member_month_reads_month ON member_month_reads (club_id, month, reads);
+
+CREATE TABLE weekly_new_books (
+    club_id INTEGER NOT NULL REFERENCES clubs(id) ON DELETE CASCADE,
+    week DATE NOT NULL,
+    books INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (club_id, week)
+);
@@ -0,0 +1,80 @@
+"""gunicorn settings, picked up automatically by `gunicorn app:app`.
+
+The app is built once in the master (preload_app) and its memory shared
+copy-on-write with the forked workers.
+"""
+
+import gc
+import os
+import shlex
+import sys
+
+os.environ.setdefault('BOOKCLUB_ENV', 'production')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# gthread: threads, so that open /events streams (events.py) don't take up
+# whole workers; at most EVENTS_MAX_STREAMS of a worker's threads hold one.
+# gevent: a greenlet per request, for many slow requests or streams at once
+# (see cooperative.py).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+preload_app = True
+
+
+def command_line_worker_class(args):
+    """The worker class given with -k/--worker-class in `args`, if any."""
+
+    found = None
+    for position, arg in enumerate(args):
+        if arg in ('-k', '--worker-class') and position + 1 < len(args):
+            found = args[position + 1]
+        elif arg.startswith('--worker-class='):
+            found = arg.split('=', 1)[1]
+        elif arg.startswith('-k') and len(arg) > 2:
+            found = arg[2:]
+    return found
+
+
+def is_gevent(worker_class_name):
+    # "gevent", "egg:gunicorn#gevent", "gunicorn.workers.ggevent.GeventWorker"
+    return 'gevent' in worker_class_name.lower()
+
+
+# The command line (and GUNICORN_CMD_ARGS) beat this file: patch for the
+# worker class gunicorn will really use.
+effective_worker_class = (
+    command_line_worker_class(sys.argv[1:])
+    or command_line_worker_class(
+        shlex.split(os.environ.get('GUNICORN_CMD_ARGS', '')))
+    or worker_class)
+
+if is_gevent(effective_worker_class):
+    # Before preload_app imports the app (and requests, psycopg2...).
+    import cooperative
+    cooperative.patch()
+
+
+def on_starting(server):
+    """Refuse to run gevent workers in a process gevent hasn't patched."""
+
+    import cooperative
+
+    if is_gevent(server.cfg.worker_class_str) and not cooperative.is_patched():
+        server.log.error(
+            "Worker class %s needs gevent's monkey patches, applied before "
+            "the app is loaded: set GUNICORN_WORKER_CLASS=gevent or pass "
+            "-k gevent on the command line.", server.cfg.worker_class_str)
+        sys.exit(1)
+
+
+def when_ready(server):
+    """Runs in the master once the app is loaded, before forking workers."""
+
+    app = server.app.wsgi()
+    server.log.info("App startup:\n%s", app.startup_report.as_text())
+
+    # Keep the garbage collector from touching (and so copying) the
+    # preloaded objects in every worker.
+    gc.freeze()
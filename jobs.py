@@ -0,0 +1,386 @@
+"""Background jobs for work that shouldn't hold up a request.
+
+Handlers are registered by name:
+
+    @job('fetch_cover')
+    def fetch_cover(book_id):
+        ...
+
+and queued from a route with `enqueue('fetch_cover', book_id=book.id)`.
+The job row is part of the route's transaction, so it is only visible to
+workers once the route commits.
+
+Workers poll the `jobs` table, claiming rows with SELECT ... FOR UPDATE
+SKIP LOCKED on Postgres (a conditional UPDATE makes the claim safe on
+databases without it). They run either as threads inside the web process
+(JOB_WORKERS > 0) or as a separate process: `flask jobs work`.
+
+While a job runs, its worker refreshes the job's heartbeat. Every worker
+pool looks for running jobs whose heartbeat stopped (their worker died)
+when it starts and then every STALE_AFTER, and queues them again, or fails
+them once out of attempts.
+"""
+
+import json
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+
+from metrics import percentile
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+GIVE_UP_HANDLERS = {}
+
+# Workers refresh the heartbeat of the job they run this often (seconds).
+# A running job whose heartbeat is older than STALE_AFTER is assumed lost
+# with its worker, and is queued again.
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER = timedelta(minutes=2)
+
+
+def job(kind, on_give_up=None):
+    """Register the decorated function as the handler for `kind` jobs.
+
+    `on_give_up`, if given, is called with the job's payload once the job
+    has failed for good (out of attempts), to clean up after it. It runs in
+    the transaction recording the failure.
+    """
+
+    def decorator(func):
+        HANDLERS[kind] = func
+        if on_give_up is not None:
+            GIVE_UP_HANDLERS[kind] = on_give_up
+        return func
+    return decorator
+
+
+def give_up(failed_job):
+    """Run the give-up handler of a job that failed for good, if any."""
+
+    handler = GIVE_UP_HANDLERS.get(failed_job.kind)
+    if handler is None:
+        return
+    try:
+        with db.session.begin_nested():
+            handler(**json.loads(failed_job.payload))
+    except Exception:
+        logger.exception("Give-up handler of job %s (%s) failed",
+                         failed_job.id, failed_job.kind)
+
+
+def enqueue(kind, priority=0, delay=0, max_attempts=5, **payload):
+    """Queue a `kind` job called with `payload`. Does not commit."""
+
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler registered for job kind {kind!r}")
+
+    new_job = Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        priority=priority,
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(new_job)
+    return new_job
+
+
+##############################################################################
+# Claiming and running jobs
+
+
+def requeue_stale():
+    """Queue again jobs whose worker died while running them.
+
+    The lost run counted as an attempt when it was claimed: jobs out of
+    attempts fail instead. Returns the number of jobs queued again.
+    """
+
+    now = datetime.utcnow()
+    last_heartbeat = db.func.coalesce(Job.heartbeat_at, Job.started_at)
+    stale = Job.query.filter(Job.status == 'running',
+                             last_heartbeat < now - STALE_AFTER)
+
+    lost_for_good = stale.filter(Job.attempts >= Job.max_attempts).all()
+    for lost_job in lost_for_good:
+        lost_job.status = 'failed'
+        lost_job.finished_at = now
+        lost_job.last_error = "Worker lost while running the job"
+        give_up(lost_job)
+    db.session.flush()
+    failed = len(lost_for_good)
+    requeued = stale.filter(Job.attempts < Job.max_attempts).update(
+        {Job.status: 'queued', Job.run_at: now},
+        synchronize_session=False)
+    db.session.commit()
+
+    if failed or requeued:
+        logger.warning("Lost jobs: %s queued again, %s failed",
+                       requeued, failed)
+    return requeued
+
+
+def claim_next():
+    """Claim the most urgent due job for this worker, or return None."""
+
+    now = datetime.utcnow()
+    candidate = (
+        Job.query
+        .filter(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.priority.desc(), Job.run_at)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    claimed = Job.query.filter_by(id=candidate.id, status='queued').update(
+        {
+            Job.status: 'running',
+            Job.started_at: now,
+            Job.heartbeat_at: now,
+            Job.attempts: Job.attempts + 1,
+        },
+        synchronize_session=False)
+    db.session.commit()
+
+    if not claimed:
+        # Another worker got it first.
+        return None
+    return Job.query.get(candidate.id)
+
+
+class Heartbeat(threading.Thread):
+    """Refreshes a running job's heartbeat until stopped.
+
+    Writes on a connection of its own, outside the job's transaction.
+    """
+
+    def __init__(self, engine, job_id, interval=None):
+        super().__init__(name=f"job-heartbeat-{job_id}", daemon=True)
+        self.engine = engine
+        self.job_id = job_id
+        self.interval = interval or HEARTBEAT_INTERVAL
+        self._done = threading.Event()
+
+    def run(self):
+        jobs = Job.__table__
+        while not self._done.wait(self.interval):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        jobs.update()
+                        .where(jobs.c.id == self.job_id)
+                        .where(jobs.c.status == 'running')
+                        .values(heartbeat_at=datetime.utcnow()))
+            except Exception:
+                logger.exception("Could not refresh the heartbeat of job %s",
+                                 self.job_id)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_job(claimed_job):
+    """Run a claimed job, then record success or schedule a retry."""
+
+    job_id = claimed_job.id
+    kind = claimed_job.kind
+
+    heartbeat = Heartbeat(db.engine, job_id)
+    heartbeat.start()
+    try:
+        HANDLERS[kind](**json.loads(claimed_job.payload))
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        failed_job = Job.query.get(job_id)
+        failed_job.last_error = traceback.format_exc()
+        if failed_job.attempts >= failed_job.max_attempts:
+            failed_job.status = 'failed'
+            failed_job.finished_at = datetime.utcnow()
+            logger.exception("Job %s (%s) failed for good", job_id, kind)
+            give_up(failed_job)
+        else:
+            # Exponential backoff: 2s, 4s, 8s...
+            failed_job.status = 'queued'
+            failed_job.run_at = (datetime.utcnow()
+                                 + timedelta(seconds=2 ** failed_job.attempts))
+            logger.warning("Job %s (%s) failed, will retry", job_id, kind)
+        db.session.commit()
+        return False
+
+    finally:
+        heartbeat.stop()
+
+    Job.query.filter_by(id=job_id).update(
+        {Job.status: 'done', Job.finished_at: datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    return True
+
+
+def work_once():
+    """Claim and run one job. Returns False if there was nothing to do."""
+
+    claimed_job = claim_next()
+    if claimed_job is None:
+        return False
+    run_job(claimed_job)
+    return True
+
+
+class WorkerPool:
+    """Threads that poll for and run jobs inside an app context."""
+
+    def __init__(self, app, threads=2, poll_interval=1.0,
+                 requeue_interval=STALE_AFTER.total_seconds()):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.requeue_interval = requeue_interval
+        self._stopping = threading.Event()
+        self._workers = []
+
+    def start(self):
+        self._requeue_stale()
+
+        for i in range(self.threads):
+            worker = threading.Thread(
+                target=self._run, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        # Jobs lost by other processes (or by this one before a restart)
+        reaper = threading.Thread(target=self._reap, name="job-reaper",
+                                  daemon=True)
+        reaper.start()
+        self._workers.append(reaper)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    busy = work_once()
+                except Exception:
+                    logger.exception("Job worker error")
+                    db.session.rollback()
+                    busy = False
+                finally:
+                    db.session.remove()
+            if not busy:
+                self._stopping.wait(self.poll_interval)
+
+    def _reap(self):
+        while not self._stopping.wait(self.requeue_interval):
+            self._requeue_stale()
+
+    def _requeue_stale(self):
+        with self.app.app_context():
+            try:
+                requeue_stale()
+            except Exception:
+                logger.exception("Could not requeue lost jobs")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+##############################################################################
+# Dashboard
+
+
+def dashboard_stats(recent=1000):
+    """Get job counts and latencies, per kind.
+
+    Latencies (queue wait and run time, in seconds) cover the `recent` most
+    recently finished jobs.
+    """
+
+    stats = {}
+
+    counts = (db.session.query(Job.kind, Job.status, db.func.count(Job.id))
+              .group_by(Job.kind, Job.status))
+    for kind, status, count in counts:
+        stats.setdefault(kind, {'counts': {}, 'waits': [], 'runs': []})
+        stats[kind]['counts'][status] = count
+
+    finished = (db.session.query(Job.kind, Job.run_at, Job.started_at,
+                                 Job.finished_at)
+                .filter(Job.finished_at.isnot(None))
+                .order_by(Job.finished_at.desc())
+                .limit(recent))
+    for kind, run_at, started_at, finished_at in finished:
+        kind_stats = stats[kind]
+        kind_stats['waits'].append((started_at - run_at).total_seconds())
+        kind_stats['runs'].append((finished_at - started_at).total_seconds())
+
+    for kind_stats in stats.values():
+        waits = kind_stats.pop('waits')
+        runs = kind_stats.pop('runs')
+        kind_stats['wait_p50'] = percentile(waits, 0.5)
+        kind_stats['wait_p95'] = percentile(waits, 0.95)
+        kind_stats['run_p50'] = percentile(runs, 0.5)
+        kind_stats['run_p95'] = percentile(runs, 0.95)
+
+    return stats
+
+
+##############################################################################
+# Setup
+
+
+def init_jobs(app):
+    """Add the `flask jobs` commands and, if configured, in-process workers.
+
+    In-process workers start with the first request, so that they are
+    created after gunicorn forks its workers.
+    """
+
+    @app.cli.group('jobs')
+    def jobs_cli():
+        """Run and inspect background jobs."""
+
+    @jobs_cli.command('work')
+    @click.option('--threads', default=2, help="Number of worker threads.")
+    @click.option('--poll-interval', default=1.0,
+                  help="Seconds to wait when the queue is empty.")
+    def work_command(threads, poll_interval):
+        """Run job workers until interrupted."""
+
+        pool = WorkerPool(app, threads=threads, poll_interval=poll_interval)
+        pool.start()
+        click.echo(f"Running {threads} job worker(s). Ctrl-C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop(timeout=10)
+
+    @jobs_cli.command('stats')
+    def stats_command():
+        """Print job counts and latencies."""
+
+        for kind, kind_stats in sorted(dashboard_stats().items()):
+            click.echo(f"{kind}: {kind_stats}")
+
+    if app.config.get('JOB_WORKERS'):
+        @app.before_first_request
+        def start_job_workers():
+            app.job_pool = WorkerPool(app, threads=app.config['JOB_WORKERS'])
+            app.job_pool.start()
@@ -0,0 +1,10 @@
+"""Small helpers shared by the app's latency and render metrics."""
+
+
+def percentile(values, fraction):
+    """Get the `fraction` percentile (0-1) of a list of numbers, or None."""
+
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
@@ -1,24 +1,119 @@
 """SQLAlchemy models for Warbler."""
 
+import secrets
 from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import PrimaryKeyConstraint
+
+from cooperative import offload
+
+
+class BookClubSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, also passing SQLALCHEMY_EXTRA_ENGINE_OPTIONS from
+    the app config to the engine (sqlitedb.py sets them)."""
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        result = super().apply_driver_hacks(app, sa_url, options)
+        options.update(app.config.get('SQLALCHEMY_EXTRA_ENGINE_OPTIONS', {}))
+        return result
+
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = BookClubSQLAlchemy()
+
+# Members who don't name a club at signup join this one (created with the
+# clubs table).
+DEFAULT_CLUB_ID = 1
+DEFAULT_CLUB_NAME = "BookClub"
+
+# On Postgres, books and reads are hash-partitioned by club_id into this
+# many partitions, so a club's queries only touch its own partition.
+CLUB_PARTITIONS = 16
+
+
+class Club(db.Model):
+    """A book club: its members share a catalog of books."""
+
+    __tablename__ = 'clubs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+        unique=True,
+    )
+
+    # Members give it to join the club at signup. None for the default
+    # club, which anyone may join.
+    invite_code = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    def __repr__(self):
+        return f"<Club #{self.id}: {self.name}>"
+
+    @classmethod
+    def join_or_start(cls, name, invite_code=None):
+        """Get the club called `name` if `invite_code` is its code, or start
+        it (with a new code) if there is no such club. Does not commit.
+
+        Returns None if the club exists and the code doesn't match.
+        """
+
+        club = cls.query.filter_by(name=name).first()
+        if club is None:
+            try:
+                with db.session.begin_nested():
+                    club = cls(name=name,
+                               invite_code=secrets.token_urlsafe(9))
+                    db.session.add(club)
+                return club
+            except IntegrityError:
+                # Started by someone else meanwhile
+                club = cls.query.filter_by(name=name).one()
+
+        if club.invite_code is None or secrets.compare_digest(
+                (invite_code or '').encode(), club.invite_code.encode()):
+            return club
+        return None
+
+event.listen(Club.__table__, 'after_create',
+             DDL(f"INSERT INTO clubs (name) VALUES ('{DEFAULT_CLUB_NAME}')"))
 
 
 class Book(db.Model):
-    """A Book read by the BookClub members."""
+    """A Book read by the members of a club."""
 
     __tablename__ = 'books'
-
+    __table_args__ = {
+        'postgresql_partition_by': 'HASH (club_id)',
+        'info': {'partitioned_by_club': True},
+    }
     id = db.Column(
         db.Integer,
         primary_key=True,
     )
 
+    club_id = db.Column(
+        db.Integer,
+        db.ForeignKey('clubs.id', ondelete='cascade'),
+        nullable=False,
+    )
+
     booktitle = db.Column(
         db.String(200),
         nullable=False,
@@ -32,18 +127,104 @@ class Book(db.Model):
         default="/static/images/book_logo.png",
     )
 
-    users_read = db.relationship('Read', cascade="all, delete-orphan")
+    # When enrich.py last looked up the missing author/cover (None: never)
+    metadata_checked_at = db.Column(
+        db.DateTime,
+    )
+
+    # None for books added before this was recorded
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    # Rows are found by club and id, so Postgres only looks in the club's
+    # partition (see partitioned_primary_key).
+    __mapper_args__ = {
+        'primary_key': [club_id, id],
+    }
+
+    # Reads are removed by the database (ON DELETE CASCADE), not loaded
+    # into the session one by one.
+    users_read = db.relationship(
+        'Read', cascade="all, delete-orphan", passive_deletes=True,
+        primaryjoin='and_(Book.club_id == Read.club_id, '
+                    'Book.id == foreign(Read.book_id))')
+
+    @classmethod
+    def in_club(cls, club_id, book_id):
+        """Get the club's book with id `book_id`, or None."""
+
+        return cls.query.get((club_id, book_id))
+
+    @classmethod
+    def bulk_delete(cls, club_id, book_id, chunk_size=None):
+        """Delete a book and its reads without loading them.
+
+        By default this is a single DELETE and the database cascades it to
+        the reads. With `chunk_size`, the reads are first deleted in chunks
+        (see delete_reads).
+
+        Does not commit the deletion of the book itself.
+        """
+
+        if chunk_size:
+            cls.delete_reads(club_id, book_id, chunk_size)
+
+        return (db.session.query(cls)
+                .filter_by(club_id=club_id, id=book_id)
+                .delete(synchronize_session=False))
+
+    @staticmethod
+    def delete_reads(club_id, book_id, chunk_size, before_chunk=None):
+        """Delete and commit a book's reads `chunk_size` rows at a time.
+
+        Removing a book read by thousands of members this way never holds
+        all their rows in one transaction. `before_chunk`, if given, is
+        called with the SQL conditions picking each chunk's reads just
+        before they are deleted, in the same transaction.
+        """
+
+        while True:
+            chunk = [read_id for (read_id,) in
+                     db.session.query(Read.id)
+                     .filter(Read.club_id == club_id,
+                             Read.book_id == book_id)
+                     .limit(chunk_size)]
+            if chunk:
+                criteria = [Read.club_id == club_id, Read.id.in_(chunk)]
+                if before_chunk:
+                    before_chunk(*criteria)
+                (db.session.query(Read)
+                 .filter(*criteria)
+                 .delete(synchronize_session=False))
+            db.session.commit()
+            if len(chunk) < chunk_size:
+                break
 
 class User(db.Model):
     """User in the system."""
 
     __tablename__ = 'users'
+    __table_args__ = (
+        # Target of the reads' (club_id, user_id) foreign key; also lists a
+        # club's members in id order.
+        db.UniqueConstraint('club_id', 'id', name='uq_users_club_id'),
+    )
 
     id = db.Column(
         db.Integer,
         primary_key=True,
     )
 
+    # Members belong to one club and only see its books and members
+    club_id = db.Column(
+        db.Integer,
+        db.ForeignKey('clubs.id', ondelete='cascade'),
+        nullable=False,
+        default=DEFAULT_CLUB_ID,
+    )
+
     email = db.Column(
         db.Text,
         nullable=False,
@@ -69,7 +250,12 @@ class User(db.Model):
         nullable=False,
     )
     
-    reads = db.relationship('Read', back_populates='user', cascade="all, delete-orphan")
+    reads = db.relationship('Read', back_populates='user', cascade="all, delete-orphan",
+                            passive_deletes=True,
+                            primaryjoin='and_(User.club_id == Read.club_id, '
+                                        'User.id == foreign(Read.user_id))')
+
+    club = db.relationship('Club')
 
 
     def __repr__(self):
@@ -77,18 +263,21 @@ class User(db.Model):
 
 
     @classmethod
-    def signup(cls, username, email, password):
+    def signup(cls, username, email, password, club_id=DEFAULT_CLUB_ID):
         """Sign up user.
 
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        # Slow on purpose: don't hold up other requests (cooperative.py)
+        hashed_pwd = offload(bcrypt.generate_password_hash,
+                             password).decode('UTF-8')
         
         user = User(
             username=username,
             email=email,
             password=hashed_pwd,
+            club_id=club_id,
         )
 
         db.session.add(user)
@@ -108,12 +297,24 @@ class User(db.Model):
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = offload(bcrypt.check_password_hash, user.password,
+                              password)
             if is_auth:
                 return user
 
         return False
     
+    @classmethod
+    def bulk_delete(cls, user_id):
+        """Delete a user with a single DELETE; the database removes the reads.
+
+        Does not commit.
+        """
+
+        return (db.session.query(cls)
+                .filter_by(id=user_id)
+                .delete(synchronize_session=False))
+
     @property
     def books_read(self):
         """Get all books read by the user."""
@@ -123,25 +324,463 @@ class Read(db.Model):
     """Accounts of books read by each user."""
 
     __tablename__ = 'reads'
+    __table_args__ = (
+        # The member and the book are always in the read's club, and
+        # cascaded deletes look in that club's partition only.
+        db.ForeignKeyConstraint(['club_id', 'user_id'],
+                                ['users.club_id', 'users.id'],
+                                ondelete='cascade'),
+        db.ForeignKeyConstraint(['club_id', 'book_id'],
+                                ['books.club_id', 'books.id'],
+                                ondelete='cascade'),
+        # A member reads a book once. Also indexed so that cascaded deletes
+        # (and per user/book lookups) don't scan the whole table.
+        db.Index('ix_reads_club_user', 'club_id', 'user_id', 'book_id',
+                 unique=True),
+        db.Index('ix_reads_club_book', 'club_id', 'book_id'),
+        {
+            'postgresql_partition_by': 'HASH (club_id)',
+            'info': {'partitioned_by_club': True},
+        },
+    )
 
     id = db.Column(
         db.Integer, 
         primary_key=True)
+
+    club_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
     
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade'),
         nullable=False,
     )
     
     book_id = db.Column(
         db.Integer,
-        db.ForeignKey('books.id', ondelete='cascade'),
         nullable=False,
     )
 
-    user = db.relationship('User')
-    book = db.relationship('Book')
+    # None for reads added before this was recorded
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    __mapper_args__ = {
+        'primary_key': [club_id, id],
+    }
+
+    # Both joins include club_id, which neither relationship writes: a
+    # read's club is set when it is created.
+    user = db.relationship(
+        'User',
+        primaryjoin='and_(User.club_id == Read.club_id, '
+                    'User.id == foreign(Read.user_id))')
+    book = db.relationship(
+        'Book',
+        primaryjoin='and_(Book.club_id == Read.club_id, '
+                    'Book.id == foreign(Read.book_id))')
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def partitioned_primary_key(constraint, compiler, **kw):
+    """On Postgres, key tables partitioned by club on (club_id, id).
+
+    Keys of a partitioned table must include the partition column. Other
+    databases keep `id` alone, so that it autoincrements; there a unique
+    index on (club_id, id) is the composite foreign keys' target.
+    """
+
+    if constraint.table.info.get('partitioned_by_club'):
+        return "PRIMARY KEY (club_id, id)"
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+event.listen(Book.__table__, 'after_create', DDL(
+    "CREATE UNIQUE INDEX uq_books_club_id ON books (club_id, id)")
+    .execute_if(dialect='sqlite'))
+for table in (Book.__table__, Read.__table__):
+    for remainder in range(CLUB_PARTITIONS):
+        event.listen(table, 'after_create', DDL(
+            f"CREATE TABLE {table.name}_p{remainder} "
+            f"PARTITION OF {table.name} FOR VALUES WITH (MODULUS {CLUB_PARTITIONS}, "
+            f"REMAINDER {remainder})").execute_if(dialect='postgresql'))
+
+class CacheVersion(db.Model):
+    """Version counters used to key and invalidate cached pages.
+
+    A counter is bumped in the same transaction as the change it describes,
+    so every worker sees the new version as soon as the change is committed.
+    """
+
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(
+        db.String(100),
+        primary_key=True,
+    )
+
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    @classmethod
+    def lookup(cls, *names):
+        """Get a {name: version} dict. Counters never bumped are at 0."""
+
+        versions = dict.fromkeys(names, 0)
+        rows = db.session.query(cls.name, cls.version).filter(
+            cls.name.in_(names))
+        for name, version in rows:
+            versions[name] = version
+        return versions
+
+    @classmethod
+    def bump(cls, *names):
+        """Increment the counters in `names` (creating them if needed).
+
+        Does not commit: call it before committing the change it describes.
+        """
+
+        for name in names:
+            updated = db.session.query(cls).filter_by(name=name).update(
+                {cls.version: cls.version + 1}, synchronize_session=False)
+            if not updated:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(cls(name=name, version=1))
+                except IntegrityError:
+                    # Another request created it first; bump that row.
+                    db.session.query(cls).filter_by(name=name).update(
+                        {cls.version: cls.version + 1},
+                        synchronize_session=False)
+
+class Job(db.Model):
+    """Background job waiting for, or done by, a worker (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_polling', 'status', 'priority', 'run_at'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    kind = db.Column(
+        db.String(50),
+        nullable=False,
+    )
+
+    # JSON-encoded keyword arguments for the job's handler
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+        default="{}",
+    )
+
+    # Higher runs first
+    priority = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # queued, running, done or failed
+    status = db.Column(
+        db.String(20),
+        nullable=False,
+        default="queued",
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+    )
+
+    # Refreshed by the worker while the job runs; a running job whose
+    # heartbeat stopped lost its worker (see jobs.requeue_stale).
+    heartbeat_at = db.Column(
+        db.DateTime,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.kind} {self.status}>"
+
+class CatalogEntry(db.Model):
+    """A work or edition imported from an Open Library dump (see catalog.py).
+
+    Searched before asking Open Library over the network.
+    """
+
+    __tablename__ = 'catalog_entries'
+    __table_args__ = (
+        # text_pattern_ops lets Postgres use the index for LIKE 'prefix%'
+        db.Index('ix_catalog_entries_search_title', 'search_title',
+                 postgresql_ops={'search_title': 'text_pattern_ops'}),
+    )
+
+    # Open Library key, e.g. /works/OL45804W or /books/OL7353617M
+    key = db.Column(
+        db.String(40),
+        primary_key=True,
+    )
+
+    # work or edition
+    kind = db.Column(
+        db.String(10),
+        nullable=False,
+    )
+
+    title = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # Normalized title (see suggest.normalize) for prefix searches
+    search_title = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # Open Library key of the first author, e.g. /authors/OL34184A
+    author_key = db.Column(
+        db.String(40),
+    )
+
+    cover_id = db.Column(
+        db.Integer,
+    )
+
+# On SQLite, catalog searches use an FTS5 index of the normalized titles
+# instead (see catalog.search), kept in sync by triggers.
+for statement in [
+    "CREATE VIRTUAL TABLE catalog_entries_fts USING fts5("
+    "search_title, content='catalog_entries', content_rowid='rowid')",
+    "CREATE TRIGGER catalog_entries_fts_insert AFTER INSERT ON catalog_entries "
+    "BEGIN INSERT INTO catalog_entries_fts (rowid, search_title) "
+    "VALUES (new.rowid, new.search_title); END",
+    "CREATE TRIGGER catalog_entries_fts_delete AFTER DELETE ON catalog_entries "
+    "BEGIN INSERT INTO catalog_entries_fts "
+    "(catalog_entries_fts, rowid, search_title) "
+    "VALUES ('delete', old.rowid, old.search_title); END",
+    "CREATE TRIGGER catalog_entries_fts_update AFTER UPDATE ON catalog_entries "
+    "BEGIN INSERT INTO catalog_entries_fts "
+    "(catalog_entries_fts, rowid, search_title) "
+    "VALUES ('delete', old.rowid, old.search_title); "
+    "INSERT INTO catalog_entries_fts (rowid, search_title) "
+    "VALUES (new.rowid, new.search_title); END",
+]:
+    event.listen(CatalogEntry.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(CatalogEntry.__table__, 'after_drop',
+             DDL("DROP TABLE IF EXISTS catalog_entries_fts")
+             .execute_if(dialect='sqlite'))
+
+class CatalogAuthor(db.Model):
+    """An author imported from an Open Library dump."""
+
+    __tablename__ = 'catalog_authors'
+
+    key = db.Column(
+        db.String(40),
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+class ReadingImport(db.Model):
+    """A member's upload of a Goodreads/StoryGraph export (readinglist.py)."""
+
+    __tablename__ = 'reading_imports'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+        index=True,
+    )
+
+    filename = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # queued, running, done or failed
+    status = db.Column(
+        db.String(20),
+        nullable=False,
+        default="queued",
+    )
+
+    rows_seen = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    books_created = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    reads_created = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # Rows not marked as read, without a title, or already in the reads
+    rows_skipped = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+class BookReadCount(db.Model):
+    """Rollup: how many members read each book (analytics.py)."""
+
+    __tablename__ = 'book_read_counts'
+    __table_args__ = (
+        db.ForeignKeyConstraint(['club_id', 'book_id'],
+                                ['books.club_id', 'books.id'],
+                                ondelete='cascade'),
+        # A club's most read books: one backward scan of this index
+        db.Index('ix_book_read_counts_reads', 'club_id', 'reads', 'book_id'),
+    )
+
+    club_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    book_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    reads = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+class MemberMonthReads(db.Model):
+    """Rollup: books each member added to their reads, per month."""
+
+    __tablename__ = 'member_month_reads'
+    __table_args__ = (
+        db.ForeignKeyConstraint(['club_id', 'user_id'],
+                                ['users.club_id', 'users.id'],
+                                ondelete='cascade'),
+        # A club's most active members of a month
+        db.Index('ix_member_month_reads_month', 'club_id', 'month', 'reads'),
+    )
+
+    club_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # First day of the month
+    month = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+    reads = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+class WeeklyNewBooks(db.Model):
+    """Rollup: books added to each club each week."""
+
+    __tablename__ = 'weekly_new_books'
+
+    club_id = db.Column(
+        db.Integer,
+        db.ForeignKey('clubs.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # The week's Monday
+    week = db.Column(
+        db.Date,
+        primary_key=True,
+    )
+
+    books = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,47 @@
+"""Client for the Open Library search API.
+
+`requests` is imported on first use, so processes that never search don't
+pay for loading it.
+"""
+
+import os
+
+# Overridable to point at a stand-in (e.g. benchmark.py's)
+SEARCH_URL = os.environ.get('OPENLIBRARY_SEARCH_URL',
+                            "https://openlibrary.org/search.json")
+COVER_URL = "https://covers.openlibrary.org/b/id/{}-M.jpg"
+TIMEOUT = 10
+
+
+class OpenLibraryError(Exception):
+    """Open Library could not be reached or answered with an error."""
+
+
+def search(params, limit=5, fields=None):
+    """Search Open Library and return the list of matching docs.
+
+    `params` are Open Library search parameters, e.g. {'q': ...} or
+    {'title': ...}. `fields` limits the fields returned for each doc.
+    """
+
+    import requests
+
+    params = dict(params, limit=limit)
+    if fields:
+        params['fields'] = ','.join(fields)
+
+    try:
+        response = requests.get(SEARCH_URL, params=params, timeout=TIMEOUT)
+    except requests.RequestException as exc:
+        raise OpenLibraryError(str(exc)) from exc
+
+    if response.status_code != 200:
+        raise OpenLibraryError(f"Open Library answered {response.status_code}")
+
+    return response.json().get('docs', [])[:limit]
+
+
+def cover_url(cover_id):
+    """Get the URL of a medium-size cover image from its Open Library id."""
+
+    return COVER_URL.format(cover_id)
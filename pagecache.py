@@ -0,0 +1,311 @@
+"""Full-page cache for the pages logged-out visitors see.
+
+Routes decorated with `anonymous_cache(...)` are stored the first time a
+logged-out visitor GETs them, then served straight from the cache by a
+before_request hook (so `add_user_to_g`, the view and the template are all
+skipped) until they expire or are purged.
+
+Only the query arguments a route lists (`query_args`) are part of the
+cache key; requests carrying any other argument skip the cache, so made-up
+URLs can't fill it.
+
+Entries live in an in-process LRU and, if PAGE_CACHE_DIR is set, in a disk
+tier shared by all workers on the machine. The disk tier is swept now and
+then: expired files are removed, then the oldest past
+PAGE_CACHE_DISK_MAX_ENTRIES. Each entry is tagged with
+surrogate keys so it can be purged by tag (`flask page-cache purge --tag`);
+the same keys are sent in the Surrogate-Key header for a fronting proxy.
+A purge reaches the disk tier at once and the workers' memory tiers when
+their entries expire (PAGE_CACHE_TTL seconds, also the proxies' max-age).
+
+Pages containing a CSRF token (signup/login forms) are cached with a
+placeholder that is swapped for the visitor's own token when served; they
+are marked private so proxies don't share them.
+"""
+
+import hashlib
+import json
+import os
+import time
+from functools import wraps
+
+import click
+from flask import current_app, g, make_response, request, session
+from flask_wtf.csrf import generate_csrf
+
+from cache import LRUCache
+
+CSRF_PLACEHOLDER = "\x00csrf-token\x00"
+
+# Sweep the disk tier at least this often (seconds)
+SWEEP_INTERVAL = 60
+
+
+class PageCache:
+    """Two-tier (memory + optional disk) store of rendered pages."""
+
+    def __init__(self, ttl=300, max_entries=500, max_bytes=8 * 1024 * 1024,
+                 directory=None, disk_max_entries=1000):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.directory = directory
+        self.disk_max_entries = disk_max_entries
+        self._last_sweep = time.time()
+        self._writes_since_sweep = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key):
+        """Get the unexpired entry at `key`, or None."""
+
+        entry = self.memory.get(key)
+
+        if entry is None and self.directory:
+            try:
+                with open(self._path(key)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                self.memory.set(key, entry, size=len(entry['body']))
+
+        if entry is None:
+            return None
+
+        if entry['expires'] < time.time():
+            self.delete(key)
+            return None
+
+        return entry
+
+    def set(self, key, body, content_type, tags, public):
+        """Store a page body at `key`."""
+
+        entry = {
+            'body': body,
+            'content_type': content_type,
+            'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+            'tags': list(tags),
+            'public': public,
+            'expires': time.time() + self.ttl,
+        }
+        self.memory.set(key, entry, size=len(body))
+
+        if self.directory:
+            # Write then rename so other workers never read half a file.
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+
+            self._writes_since_sweep += 1
+            if (self._writes_since_sweep * 10 >= self.disk_max_entries
+                    or time.time() - self._last_sweep >= SWEEP_INTERVAL):
+                self.sweep()
+
+        return entry
+
+    def sweep(self):
+        """Remove expired disk entries, then the oldest past the cap.
+
+        Files are dated by their modification time (written at set time).
+        Returns the number removed.
+        """
+
+        self._last_sweep = time.time()
+        self._writes_since_sweep = 0
+        expired_before = time.time() - self.ttl
+
+        files = []
+        for dir_entry in os.scandir(self.directory):
+            if not dir_entry.name.endswith('.json'):
+                continue
+            try:
+                files.append((dir_entry.stat().st_mtime, dir_entry.path))
+            except OSError:
+                continue
+        files.sort(reverse=True)
+
+        removed = 0
+        for position, (modified, path) in enumerate(files):
+            if position < self.disk_max_entries and modified > expired_before:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def delete(self, key):
+        """Drop the entry at `key` from both tiers."""
+
+        self.memory.delete(key)
+        if self.directory:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def purge(self, *tags):
+        """Drop every entry tagged with any of `tags` (all entries if none).
+
+        Returns the number of entries dropped from the disk tier, or from
+        memory when there is no disk tier.
+        """
+
+        tags = set(tags)
+        dropped = 0
+
+        for key, entry in self.memory.items():
+            if not tags or tags.intersection(entry['tags']):
+                self.memory.delete(key)
+                dropped += 1
+
+        if self.directory:
+            dropped = 0
+            for filename in os.listdir(self.directory):
+                path = os.path.join(self.directory, filename)
+                try:
+                    with open(path) as f:
+                        entry_tags = json.load(f)['tags']
+                    if not tags or tags.intersection(entry_tags):
+                        os.remove(path)
+                        dropped += 1
+                except (OSError, ValueError, KeyError):
+                    continue
+
+        return dropped
+
+
+##############################################################################
+# Request handling
+
+
+def _cache_key(query_args):
+    return (current_app.config.get('APP_RELEASE', ''), request.path,
+            tuple(sorted((name, value)
+                         for name, value in request.args.items(multi=True)
+                         if name in query_args)))
+
+
+def _is_cacheable_request(query_args):
+    return (current_app.config.get('PAGE_CACHE_ENABLED', True)
+            and request.method in ('GET', 'HEAD')
+            and '_flashes' not in session
+            and all(name in query_args for name in request.args))
+
+
+def _build_response(entry):
+    """Turn a cache entry into a response for the current visitor."""
+
+    body = entry['body']
+    if CSRF_PLACEHOLDER in body:
+        body = body.replace(CSRF_PLACEHOLDER, generate_csrf())
+
+    response = current_app.response_class(
+        body, content_type=entry['content_type'])
+    response.vary.add('Cookie')
+
+    if entry['public']:
+        # Identical for every logged-out visitor: proxies may share it.
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = (
+            f"public, max-age={current_app.page_cache.ttl}")
+        response.headers['Surrogate-Key'] = ' '.join(entry['tags'])
+        response = response.make_conditional(request)
+    else:
+        # Carries this visitor's CSRF token: never store it anywhere.
+        response.headers['Cache-Control'] = 'private, no-store'
+
+    return response
+
+
+def anonymous_cache(*tags, query_args=()):
+    """Cache this route's GET responses for logged-out visitors.
+
+    `tags` are the surrogate keys used to purge the cached pages.
+    `query_args` are the query arguments the page depends on; requests with
+    others are not cached.
+    """
+
+    query_args = frozenset(query_args)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Checked before rendering, which consumes flash messages.
+            cacheable = g.user is None and _is_cacheable_request(query_args)
+
+            response = make_response(view(*args, **kwargs))
+
+            if (not cacheable
+                    or response.status_code != 200
+                    or response.direct_passthrough):
+                return response
+
+            body = response.get_data(as_text=True)
+            csrf_token = g.get('csrf_token')
+            public = not (csrf_token and csrf_token in body)
+            if not public:
+                body = body.replace(csrf_token, CSRF_PLACEHOLDER)
+
+            entry = current_app.page_cache.set(
+                _cache_key(query_args), body, response.content_type, tags,
+                public)
+            return _build_response(entry)
+
+        wrapper.anonymous_cache = query_args
+        return wrapper
+    return decorator
+
+
+def init_page_cache(app, user_key):
+    """Set up the page cache and serve cached pages before anything else.
+
+    `user_key` is the session key present for logged-in users. Call this
+    before registering other before_request hooks, so hits skip them.
+    """
+
+    app.config.setdefault('PAGE_CACHE_ENABLED',
+                          os.environ.get('PAGE_CACHE', '1') != '0')
+    app.page_cache = PageCache(
+        ttl=int(os.environ.get('PAGE_CACHE_TTL', 300)),
+        directory=os.environ.get('PAGE_CACHE_DIR'),
+        disk_max_entries=int(
+            os.environ.get('PAGE_CACHE_DISK_MAX_ENTRIES', 1000)),
+    )
+
+    @app.before_request
+    def serve_cached_page():
+        """Answer anonymous GETs for cached pages from the cache."""
+
+        view = app.view_functions.get(request.endpoint)
+        query_args = getattr(view, 'anonymous_cache', None)
+        if query_args is None:
+            return None
+        if user_key in session or not _is_cacheable_request(query_args):
+            return None
+
+        entry = app.page_cache.get(_cache_key(query_args))
+        if entry is None:
+            return None
+        return _build_response(entry)
+
+    @app.cli.group('page-cache')
+    def page_cache_cli():
+        """Manage the anonymous full-page cache."""
+
+    @page_cache_cli.command('purge')
+    @click.option('--tag', 'tags', multiple=True,
+                  help="Surrogate key to purge (repeatable). Default: all.")
+    def purge_command(tags):
+        """Purge cached pages from the disk tier."""
+
+        dropped = app.page_cache.purge(*tags)
+        click.echo(f"Purged {dropped} cached page(s).")
@@ -0,0 +1,40 @@
+"""Directories only the app's user may use.
+
+The app keeps files other users must not read or replace (uploaded reading
+lists, request profiles, compiled templates) in directories it checks
+before using: owned by the app's user, not a symlink, and writable by
+nobody else. A directory made by someone else under a shared location such
+as /tmp fails these checks instead of being trusted.
+"""
+
+import os
+import stat
+
+
+def unsafe_reason(directory):
+    """Why `directory` can't hold the app's private files, or None if it can.
+    """
+
+    try:
+        status = os.lstat(directory)
+    except OSError as exc:
+        return str(exc)
+    if not stat.S_ISDIR(status.st_mode):
+        return f"{directory} is not a directory"
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        return f"{directory} belongs to another user"
+    if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return f"{directory} is writable by other users"
+    if not os.access(directory, os.W_OK):
+        return f"{directory} is not writable"
+    return None
+
+
+def private_directory(directory):
+    """Create `directory` (0700) if needed; get why it is unsafe, or None."""
+
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    except OSError:
+        pass
+    return unsafe_reason(directory)
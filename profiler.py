@@ -0,0 +1,371 @@
+"""Opt-in profiling of single requests, safe to leave installed in production.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>`, or at
+random for a PROFILE_SAMPLE_RATE fraction of requests (0 by default). For
+a profiled request:
+
+- a thread samples the request thread's stack every PROFILE_INTERVAL
+  seconds (a statistical profile: the request itself runs unmodified);
+- the time spent in SQL queries and in rendering templates is measured,
+  the rest being Python time;
+- for requests sent with the token and PROFILE_MEMORY on, tracemalloc
+  records what the request allocated, split the same way. tracemalloc is
+  process-wide (allocations of requests running at the same time are
+  included too) and slows every request of the process while on, so
+  randomly sampled requests never turn it on.
+
+Each profile is saved in PROFILE_DIR as a JSON summary plus collapsed-stack
+files (`<id>.cpu.folded`, `<id>.alloc.folded`) that flamegraph.pl or
+https://speedscope.app read directly; /admin/profiles lists them. Profiles
+show queries and stacks, so the directory must be private to the app's
+user (see privatedirs.py): nothing is saved to or read from one that isn't.
+"""
+
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from privatedirs import private_directory, unsafe_reason
+
+MEMORY_FRAMES = 30
+TOP_ALLOCATIONS = 15
+
+# Stack frames from these paths are database or template work.
+DB_PATHS = (os.sep + 'sqlalchemy' + os.sep, os.sep + 'psycopg2' + os.sep,
+            os.sep + 'sqlite3' + os.sep)
+TEMPLATE_PATHS = (os.sep + 'jinja2' + os.sep, 'templates' + os.sep)
+
+_local = threading.local()
+_memory_lock = threading.Lock()
+
+
+def category(filenames):
+    """Classify a stack (its frames' file names) as db, template or python.
+
+    Queries run while rendering (lazy loads) count as db.
+    """
+
+    filenames = list(filenames)
+    if any(path in filename for filename in filenames for path in DB_PATHS):
+        return 'db'
+    if any(path in filename
+           for filename in filenames for path in TEMPLATE_PATHS):
+        return 'template'
+    return 'python'
+
+
+def short_path(filename):
+    """Cut site-packages and the working directory off a file name."""
+
+    for marker in ('site-packages' + os.sep, os.getcwd() + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    return filename
+
+
+##############################################################################
+# Stack sampling
+
+
+class Sampler(threading.Thread):
+    """Counts the stacks of another thread, sampled at an interval."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profiler-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self.collapse(frame)] += 1
+
+    @staticmethod
+    def collapse(frame):
+        """Get a stack as (function label, file name) pairs, root first."""
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((f"{code.co_name} ({short_path(code.co_filename)}"
+                          f":{code.co_firstlineno})", code.co_filename))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+##############################################################################
+# Timing queries and templates
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_query(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_query(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None and profile.query_started is not None:
+        profile.db_seconds += time.perf_counter() - profile.query_started
+        profile.queries += 1
+        profile.query_started = None
+
+
+def _before_render(app, template, context, **extra):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        if profile.render_depth == 0:
+            profile.render_started = (time.perf_counter(), profile.db_seconds)
+        profile.render_depth += 1
+
+
+def _rendered(app, template, context, **extra):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None and profile.render_depth:
+        profile.render_depth -= 1
+        if profile.render_depth == 0:
+            started, db_seconds = profile.render_started
+            # Queries run while rendering are already counted as db time.
+            profile.template_seconds += (time.perf_counter() - started
+                                         - (profile.db_seconds - db_seconds))
+
+
+##############################################################################
+# Profiles
+
+
+class RequestProfile:
+    """Everything recorded while profiling one request."""
+
+    def __init__(self, interval, trace_memory):
+        self.id = (datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f-')
+                   + uuid.uuid4().hex[:8])
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.queries = 0
+        self.query_started = None
+        self.render_depth = 0
+        self.render_started = None
+        self.status = None
+
+        self.memory_before = None
+        # One traced request at a time, and never someone else's tracing.
+        if (trace_memory and not tracemalloc.is_tracing()
+                and _memory_lock.acquire(blocking=False)):
+            tracemalloc.start(MEMORY_FRAMES)
+            self.memory_before = tracemalloc.take_snapshot()
+
+        self.sampler = Sampler(threading.get_ident(), interval)
+        self.started = time.perf_counter()
+        self.sampler.start()
+
+    def finish(self):
+        """Stop recording. Returns (summary, cpu stacks, allocation stacks)."""
+
+        self.sampler.stop()
+        wall = time.perf_counter() - self.started
+
+        samples = Counter()
+        cpu_stacks = Counter()
+        for stack, count in self.sampler.stacks.items():
+            samples[category(filename for _, filename in stack)] += count
+            cpu_stacks[';'.join(label for label, _ in stack)] += count
+
+        summary = {
+            'id': self.id,
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': self.status,
+            'user_id': g.user.id if g.get('user') else None,
+            'wall_ms': wall * 1000,
+            'db_ms': self.db_seconds * 1000,
+            'template_ms': self.template_seconds * 1000,
+            'python_ms': max(0.0, wall - self.db_seconds
+                             - self.template_seconds) * 1000,
+            'queries': self.queries,
+            'samples': dict(samples),
+            'memory': None,
+        }
+
+        alloc_stacks = Counter()
+        if self.memory_before is not None:
+            try:
+                memory_after = tracemalloc.take_snapshot()
+                summary['memory'], alloc_stacks = self.memory_summary(
+                    self.memory_before, memory_after)
+                _, summary['memory']['peak_bytes'] = (
+                    tracemalloc.get_traced_memory())
+            finally:
+                tracemalloc.stop()
+                _memory_lock.release()
+                self.memory_before = None
+
+        return summary, cpu_stacks, alloc_stacks
+
+    @staticmethod
+    def memory_summary(before, after):
+        """Split what was allocated between two snapshots by category."""
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__)]
+        after = after.filter_traces(ignore)
+        before = before.filter_traces(ignore)
+
+        by_category = Counter()
+        stacks = Counter()
+        top = []
+        for diff in after.compare_to(before, 'traceback'):
+            if diff.size_diff <= 0:
+                continue
+            frames = list(reversed(diff.traceback))  # root first
+            kind = category(frame.filename for frame in frames)
+            by_category[kind] += diff.size_diff
+            stacks[';'.join(f"{short_path(frame.filename)}:{frame.lineno}"
+                            for frame in frames)] += diff.size_diff
+            top.append((diff.size_diff, diff.count_diff, kind,
+                        diff.traceback[0]))
+
+        top.sort(key=lambda item: item[0], reverse=True)
+        return {
+            'allocated_bytes': dict(by_category),
+            'top': [{'where': f"{short_path(frame.filename)}:{frame.lineno}",
+                     'bytes': size, 'blocks': count, 'category': kind}
+                    for size, count, kind, frame in top[:TOP_ALLOCATIONS]],
+        }, stacks
+
+
+def write_folded(path, stacks):
+    """Write stacks in the collapsed format flame graph tools read."""
+
+    with open(path, 'w') as folded:
+        for stack, weight in stacks.most_common():
+            folded.write(f"{stack} {weight}\n")
+
+
+def profile_dir(app):
+    """Get the directory profiles are saved to (see PROFILE_DIR)."""
+
+    return (app.config['PROFILE_DIR']
+            or os.path.join(app.instance_path, 'profiles'))
+
+
+def save_profile(directory, keep, summary, cpu_stacks, alloc_stacks):
+    reason = private_directory(directory)
+    if reason is not None:
+        raise RuntimeError(f"Not saving profiles: {reason}")
+    profile_id = summary['id']
+    write_folded(os.path.join(directory, f"{profile_id}.cpu.folded"),
+                 cpu_stacks)
+    if alloc_stacks:
+        write_folded(os.path.join(directory, f"{profile_id}.alloc.folded"),
+                     alloc_stacks)
+    with open(os.path.join(directory, f"{profile_id}.json"), 'w') as out:
+        json.dump(summary, out)
+
+    # Keep the newest `keep` profiles (ids sort by time).
+    for old_id in list_profile_ids(directory)[keep:]:
+        for suffix in ('.json', '.cpu.folded', '.alloc.folded'):
+            try:
+                os.remove(os.path.join(directory, old_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profile_ids(directory):
+    """Get the ids of the saved profiles, newest first."""
+
+    if unsafe_reason(directory) is not None:
+        return []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-len('.json')] for name in names
+                   if name.endswith('.json')), reverse=True)
+
+
+def load_profiles(directory, limit=100):
+    """Get the summaries of the newest saved profiles."""
+
+    profiles = []
+    for profile_id in list_profile_ids(directory)[:limit]:
+        try:
+            with open(os.path.join(directory, f"{profile_id}.json")) as saved:
+                profiles.append(json.load(saved))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_reason(config):
+    """Why profile this request: 'requested' (it carries the token),
+    'sampled', or None (don't)."""
+
+    token = config['PROFILE_TOKEN']
+    header = request.headers.get('X-Profile')
+    if token and header and hmac.compare_digest(header, token):
+        return 'requested'
+    rate = config['PROFILE_SAMPLE_RATE']
+    if rate > 0 and random.random() < rate:
+        return 'sampled'
+    return None
+
+
+def init_profiler(app):
+    """Profile the requests that ask for it (see the module docstring)."""
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+    @app.before_request
+    def start_profile():
+        reason = profile_reason(app.config)
+        if reason is not None:
+            _local.profile = RequestProfile(
+                app.config['PROFILE_INTERVAL'],
+                reason == 'requested' and app.config['PROFILE_MEMORY'])
+
+    @app.after_request
+    def note_profiled_status(response):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            profile.status = response.status_code
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    @app.teardown_request
+    def save_request_profile(exc):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return
+        _local.profile = None
+        if profile.status is None and exc is not None:
+            profile.status = 500
+        try:
+            save_profile(profile_dir(app), app.config['PROFILE_KEEP'],
+                         *profile.finish())
+        except Exception:
+            app.logger.exception("Could not save profile %s", profile.id)
@@ -0,0 +1,259 @@
+"""Import a member's reading list from a Goodreads or StoryGraph export.
+
+The uploaded CSV is saved to IMPORT_UPLOAD_DIR (a directory private to the
+app's user, see privatedirs.py) and imported by the
+`import_reading_list` background job, which must run on the same machine
+(in-process workers or `flask jobs work`). The file is read row by row and
+written in batches: each batch matches titles to existing books, creates
+the missing books and adds the reads in one transaction, then records its
+progress on the ReadingImport row the member's status page shows. A
+retried import resumes after the rows its earlier attempts committed.
+"""
+
+import csv
+import os
+import re
+from datetime import datetime
+from itertools import islice
+
+from cache import bump_catalog, bump_user
+from events import publish
+from jobs import enqueue, job
+import analytics
+from models import db, User, Book, Read, ReadingImport
+from privatedirs import private_directory
+from suggest import normalize
+
+BATCH_SIZE = 500
+
+# Column names in each service's export, and the values marking a book as
+# read.
+FORMATS = {
+    'goodreads': {
+        'title': 'Title',
+        'author': 'Author',
+        'status': 'Exclusive Shelf',
+        'read': {'read'},
+    },
+    'storygraph': {
+        'title': 'Title',
+        'author': 'Authors',
+        'status': 'Read Status',
+        'read': {'read'},
+    },
+}
+
+# Goodreads appends the series: "The Fellowship of the Ring (LOTR, #1)"
+SERIES_SUFFIX = re.compile(r'\s*\([^()]*#\s*[\d.]+\)\s*$')
+
+
+class ImportFormatError(Exception):
+    """The uploaded file is not an export we know how to read."""
+
+
+def book_key(title):
+    """Key under which two spellings of the same title match."""
+
+    return normalize(SERIES_SUFFIX.sub('', title))
+
+
+def detect_format(fieldnames):
+    """Get the FORMATS entry whose columns the CSV header has."""
+
+    for columns in FORMATS.values():
+        if {columns['title'], columns['status']} <= set(fieldnames or []):
+            return columns
+    raise ImportFormatError(
+        "This doesn't look like a Goodreads or StoryGraph export.")
+
+
+def batches(iterable, size):
+    """Yield lists of up to `size` items from `iterable`."""
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_batch(rows, columns, club_id, user_id, known_books, user_book_ids,
+                 counts):
+    """Add the reads (and missing books of the club) for one batch of CSV
+    rows.
+
+    `known_books` ({book key: id}) and `user_book_ids` are updated with what
+    this batch creates. Returns the ids of the books it created. Does not
+    commit.
+    """
+
+    new_books = {}
+    wanted_keys = []
+    now = datetime.utcnow()
+
+    for row in rows:
+        counts['rows_seen'] += 1
+        # Cut to what the books table stores, which known_books keys on
+        title = (row.get(columns['title']) or '').strip()[:200]
+        status = (row.get(columns['status']) or '').strip().lower()
+        key = book_key(title) if title else ''
+        if not key or status not in columns['read']:
+            counts['rows_skipped'] += 1
+            continue
+
+        if key not in known_books and key not in new_books:
+            author = (row.get(columns['author']) or '').strip()
+            new_books[key] = Book(club_id=club_id,
+                                  booktitle=title,
+                                  bookauthor=author[:200] or None,
+                                  created_at=now)
+        wanted_keys.append(key)
+
+    if new_books:
+        db.session.add_all(new_books.values())
+        db.session.flush()
+        for key, book in new_books.items():
+            known_books[key] = book.id
+        analytics.add_books(club_id, [now] * len(new_books))
+        counts['books_created'] += len(new_books)
+
+    reads = []
+    for key in wanted_keys:
+        book_id = known_books[key]
+        if book_id in user_book_ids:
+            counts['rows_skipped'] += 1
+            continue
+        user_book_ids.add(book_id)
+        reads.append({'club_id': club_id, 'user_id': user_id,
+                      'book_id': book_id, 'created_at': now})
+
+    db.session.bulk_insert_mappings(Read, reads)
+    analytics.add_reads(club_id,
+                        ((user_id, read['book_id'], now) for read in reads))
+    counts['reads_created'] += len(reads)
+
+    return [book.id for book in new_books.values()]
+
+
+def give_up_import(import_id, path, batch_size=BATCH_SIZE):
+    """The import is out of attempts: mark it failed, remove its upload."""
+
+    ReadingImport.query.filter_by(id=import_id).update(
+        {'status': 'failed', 'finished_at': datetime.utcnow()},
+        synchronize_session=False)
+    remove_upload(path)
+
+
+def remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@job('import_reading_list', on_give_up=give_up_import)
+def import_reading_list(import_id, path, batch_size=BATCH_SIZE):
+    """Background job: import the uploaded export at `path`."""
+
+    reading_import = ReadingImport.query.get(import_id)
+    if reading_import is None:
+        return
+    user_id = reading_import.user_id
+    club_id = (db.session.query(User.club_id)
+               .filter(User.id == user_id).scalar())
+
+    # Each batch commits its rows with the counts: a retry carries on
+    # from there.
+    counts = {name: getattr(reading_import, name) for name in
+              ('rows_seen', 'books_created', 'reads_created', 'rows_skipped')}
+    rows_done = counts['rows_seen']
+    reading_import.status = 'running'
+    reading_import.error = None
+    db.session.commit()
+
+    known_books = {book_key(title): book_id for book_id, title
+                   in db.session.query(Book.id, Book.booktitle)
+                   .filter(Book.club_id == club_id)}
+    user_book_ids = {book_id for (book_id,) in
+                     db.session.query(Read.book_id)
+                     .filter_by(club_id=club_id, user_id=user_id)}
+
+    try:
+        # utf-8-sig: Goodreads exports may start with a byte order mark
+        with open(path, newline='', encoding='utf-8-sig') as export:
+            reader = csv.DictReader(export)
+            columns = detect_format(reader.fieldnames)
+
+            for rows in batches(islice(reader, rows_done, None),
+                                batch_size):
+                created_books = import_batch(rows, columns, club_id,
+                                             user_id, known_books,
+                                             user_book_ids, counts)
+                if created_books:
+                    bump_catalog(club_id)
+                    # Look up covers for them, after the imports waiting
+                    enqueue('enrich_metadata', priority=-1,
+                            book_ids=created_books)
+                bump_user(club_id, user_id)
+                publish('reads_imported', club_id, user_id=user_id,
+                        books_created=counts['books_created'],
+                        reads_created=counts['reads_created'])
+                ReadingImport.query.filter_by(id=import_id).update(
+                    counts, synchronize_session=False)
+                db.session.commit()
+
+    except ImportFormatError as exc:
+        # Retrying won't help.
+        db.session.rollback()
+        ReadingImport.query.filter_by(id=import_id).update(
+            {'status': 'failed', 'error': str(exc),
+             'finished_at': datetime.utcnow()},
+            synchronize_session=False)
+        db.session.commit()
+        remove_upload(path)
+        return
+
+    except Exception as exc:
+        db.session.rollback()
+        ReadingImport.query.filter_by(id=import_id).update(
+            {'error': f"Interrupted ({exc})."},
+            synchronize_session=False)
+        db.session.commit()
+        raise
+
+    ReadingImport.query.filter_by(id=import_id).update(
+        {'status': 'done', 'finished_at': datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    remove_upload(path)
+
+
+def upload_dir(app):
+    """Get the directory uploads are saved to (see IMPORT_UPLOAD_DIR)."""
+
+    return (app.config['IMPORT_UPLOAD_DIR']
+            or os.path.join(app.instance_path, 'imports'))
+
+
+def start_import(user_id, upload, upload_dir):
+    """Save an uploaded export and queue its import. Does not commit.
+
+    `upload` is the werkzeug FileStorage; it is streamed to disk. Raises
+    RuntimeError if `upload_dir` isn't private to the app's user.
+    """
+
+    reason = private_directory(upload_dir)
+    if reason is not None:
+        raise RuntimeError(f"Not saving reading list uploads: {reason}")
+
+    reading_import = ReadingImport(user_id=user_id,
+                                   filename=upload.filename or 'export.csv')
+    db.session.add(reading_import)
+    db.session.flush()
+
+    path = os.path.join(upload_dir, f"reading-import-{reading_import.id}.csv")
+    upload.save(path)
+
+    enqueue('import_reading_list', import_id=reading_import.id, path=path)
+    return reading_import
@@ -1,20 +1,31 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
-from app import db
-from models import User, Book, Read
+from app import create_app
+from models import db, User, Book, Read, DEFAULT_CLUB_ID
+import analytics
 
+app = create_app()
 
-db.drop_all()
-db.create_all()
+with app.app_context():
+    db.drop_all()
+    db.create_all()
 
-with open('generator/bookclubusers.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    # Everything goes in the default club, created with the tables.
+    with open('generator/bookclubusers.csv') as users:
+        db.session.bulk_insert_mappings(
+            User, [dict(row, club_id=DEFAULT_CLUB_ID)
+                   for row in DictReader(users)])
 
-with open('generator/books.csv') as books:
-    db.session.bulk_insert_mappings(Book, DictReader(books))
+    with open('generator/books.csv') as books:
+        db.session.bulk_insert_mappings(
+            Book, [dict(row, club_id=DEFAULT_CLUB_ID)
+                   for row in DictReader(books)])
 
-with open('generator/reads.csv') as reads:
-    db.session.bulk_insert_mappings(Read, DictReader(reads))
+    with open('generator/reads.csv') as reads:
+        db.session.bulk_insert_mappings(
+            Read, [dict(row, club_id=DEFAULT_CLUB_ID)
+                   for row in DictReader(reads)])
 
-db.session.commit()
+    db.session.commit()
+    analytics.rebuild()
@@ -0,0 +1,112 @@
+"""Embedded SQLite mode, for small clubs and load-test rigs.
+
+Set SQLITE_PATH (e.g. `SQLITE_PATH=bookclub.db`) to keep everything in a
+local SQLite file instead of Postgres, then create the tables with
+`flask sqlite init`. The same models (and indexes) are used; catalog title
+searches go through an FTS5 index on SQLite (see models.py and
+catalog.search).
+
+Connections are shared by all threads (and greenlets) through a QueuePool:
+SQLITE_POOL_SIZE of them stay open, and past that more are opened for as
+long as they are needed, so any number of threads can query at once. Each
+is opened with:
+
+- WAL journaling, so readers never wait for the writer;
+- synchronous=NORMAL (safe with WAL; the last commits can be lost on power
+  failure, never corrupted), a larger page cache and memory-mapped reads;
+- foreign keys on, so ON DELETE CASCADE works as on Postgres;
+- a busy timeout, so concurrent writers wait instead of failing.
+"""
+
+import click
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+
+def is_sqlite(app):
+    return app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+
+
+def is_file(uri):
+    return uri not in ('sqlite://', 'sqlite:///', 'sqlite:///:memory:')
+
+
+def pragmas(config):
+    """The PRAGMA statements run on every new connection."""
+
+    return [
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA foreign_keys = ON",
+        f"PRAGMA busy_timeout = {config['SQLITE_BUSY_TIMEOUT_MS']}",
+        # Negative: in KiB rather than pages
+        f"PRAGMA cache_size = -{config['SQLITE_CACHE_MB'] * 1024}",
+        f"PRAGMA mmap_size = {config['SQLITE_MMAP_MB'] * 1024 * 1024}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+
+
+def init_sqlite(app):
+    """Tune the engine when the app runs on SQLite; add `flask sqlite`.
+
+    Call it after connect_db and before anything uses the database.
+    """
+
+    @app.cli.group('sqlite')
+    def sqlite_cli():
+        """Manage the embedded SQLite database."""
+
+    @sqlite_cli.command('init')
+    def init_command():
+        """Create the tables, indexes and full-text index."""
+
+        db.create_all()
+        click.echo(f"Created {app.config['SQLALCHEMY_DATABASE_URI']}")
+
+    @sqlite_cli.command('optimize')
+    def optimize_command():
+        """Refresh query planner statistics and compact the WAL file."""
+
+        with db.engine.connect() as connection:
+            connection.execute(db.text(
+                "INSERT INTO catalog_entries_fts (catalog_entries_fts) "
+                "VALUES ('optimize')"))
+            connection.execute(db.text("PRAGMA optimize"))
+            connection.execute(db.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        click.echo("Done.")
+
+    if not is_sqlite(app):
+        return
+
+    if is_file(app.config['SQLALCHEMY_DATABASE_URI']):
+        # A pool per thread would have to cover every thread that ever
+        # connects (web, job, heartbeat and CLI threads, or greenlets) and
+        # closes connections still in use past its size. Connections are
+        # handed from thread to thread instead, never used by two at once.
+        app.config['SQLALCHEMY_EXTRA_ENGINE_OPTIONS'] = {
+            'poolclass': QueuePool,
+            'pool_size': app.config['SQLITE_POOL_SIZE'],
+            'max_overflow': -1,
+            'connect_args': {'check_same_thread': False},
+        }
+
+    statements = pragmas(app.config)
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'connect')
+    def configure_connection(dbapi_connection, connection_record):
+        # Let SQLAlchemy, not the sqlite3 module, start transactions (see
+        # begin_transaction), so that SAVEPOINTs work.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin_transaction(connection):
+        connection.execute(db.text("BEGIN"))
@@ -0,0 +1,60 @@
+"""Measure how long it takes to build the app (see create_app in app.py).
+
+`flask startup-report` prints the report; it is also logged at INFO level
+whenever an app is created.
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not on Windows
+    resource = None
+
+
+def max_rss_mb():
+    """Get this process's peak resident memory in MB, or None if unknown."""
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class StartupReport:
+    """Wall-clock time spent in each named phase of app startup."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name`."""
+
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - phase_started)
+
+    def add(self, name, seconds):
+        """Add phase `name`, measured elsewhere."""
+
+        self.phases.append((name, seconds))
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def as_text(self):
+        lines = [f"{name:<30} {seconds * 1000:8.1f} ms"
+                 for name, seconds in self.phases]
+        lines.append(f"{'total':<30} {self.total * 1000:8.1f} ms")
+        rss = max_rss_mb()
+        if rss is not None:
+            lines.append(f"{'peak RSS':<30} {rss:8.1f} MB")
+        lines.append(f"{'modules loaded':<30} {len(sys.modules):8d}")
+        return "\n".join(lines)
@@ -0,0 +1,257 @@
+// Keep the home page's book lists current without reloading it:
+//
+// - the plus/minus buttons and the "Add Book" form post in the background
+//   (asking for JSON), change the list right away and undo the change if
+//   the server refuses it;
+// - changes made elsewhere arrive on the /events stream (Server-Sent
+//   Events) and are applied the same way. When the server has too many
+//   streams open it refuses ours, and the page polls itself instead.
+
+$(function () {
+  const $myBooks = $("[data-live=my-books]");
+  const $clubBooks = $("[data-live=club-books]");
+  const $readCount = $("[data-live=read-count]");
+  const $addBook = $("[data-live=add-book]");
+  if (!$clubBooks.length) return;
+  const userId = Number($myBooks.data("user-id"));
+  let pendingBooks = 0;
+
+  const ADD_READ = "/users/books/addread/";
+  const DELETE_READ = "/users/books/deleteread/";
+  const DELETE_BOOK = "/books/delete/";
+  const POLL_MILLISECONDS = 15000;
+
+  ////////////////////////////////////////////////////////////////////////////
+  // Building and finding list items
+
+  function postButton(action, buttonClass) {
+    return $("<form>", { method: "POST", action: action })
+      .append($("<button>", { class: buttonClass }));
+  }
+
+  function bookItem(bookId, title, imageUrl) {
+    return $("<li>", { class: "list-group-item", "data-book-id": bookId })
+      .append($("<span>", { class: "book-link" }).append(
+        $("<img>", { src: imageUrl, alt: "", class: "timeline-image" })))
+      .append($("<div>", { class: "review-area" }).append(
+        $("<span>", { class: "book-link" }).text(` ${title} `)));
+  }
+
+  function findBook($list, bookId) {
+    return $list.children(`[data-book-id="${bookId}"]`);
+  }
+
+  function addReadButton($clubBook) {
+    return $clubBook.find(`form[action^="${ADD_READ}"]`);
+  }
+
+  function updateReadCount() {
+    $readCount.text($myBooks.children().length);
+  }
+
+  function showNotice(message, category, reloadLink) {
+    $("#live-notice").remove();
+    const $notice = $("<div>", {
+      id: "live-notice",
+      class: `alert alert-${category}`,
+    }).text(`${message} `);
+    if (reloadLink) $notice.append($("<a>", { href: "/" }).text("Reload"));
+    $notice.insertBefore($clubBooks.closest(".row"));
+  }
+
+  // Each change below is done in two steps so that it can be applied
+  // ahead of the server's answer and undone if the server refuses it.
+
+  function markRead(bookId) {
+    const $clubBook = findBook($clubBooks, bookId);
+    const $plus = addReadButton($clubBook).detach();
+    let $myBook = $();
+    if ($clubBook.length && !findBook($myBooks, bookId).length) {
+      $myBook = bookItem(bookId,
+                         $clubBook.find(".review-area .book-link").text().trim(),
+                         $clubBook.find("img").attr("src"))
+        .append(postButton(DELETE_READ + bookId, "minus malt"))
+        .appendTo($myBooks);
+    }
+    updateReadCount();
+    return function undo() {
+      $myBook.remove();
+      if ($plus.length) $clubBook.append($plus);
+      updateReadCount();
+    };
+  }
+
+  function markUnread(bookId) {
+    const $myBook = findBook($myBooks, bookId);
+    const $next = $myBook.next();
+    $myBook.detach();
+    const $clubBook = findBook($clubBooks, bookId);
+    let $plus = $();
+    if ($clubBook.length && !addReadButton($clubBook).length) {
+      $plus = postButton(ADD_READ + bookId, "plus palt").appendTo($clubBook);
+    }
+    updateReadCount();
+    return function undo() {
+      $plus.remove();
+      if ($next.length) $myBook.insertBefore($next);
+      else $myBook.appendTo($myBooks);
+      updateReadCount();
+    };
+  }
+
+  function removeBook(bookId) {
+    const removed = [$myBooks, $clubBooks].map(function ($list) {
+      const $item = findBook($list, bookId);
+      return { $list: $list, $item: $item, $next: $item.next() };
+    });
+    for (const { $item } of removed) $item.detach();
+    updateReadCount();
+    return function undo() {
+      for (const { $list, $item, $next } of removed) {
+        if ($next.length) $item.insertBefore($next);
+        else $item.appendTo($list);
+      }
+      updateReadCount();
+    };
+  }
+
+  function addClubBook(book) {
+    if (findBook($clubBooks, book.id).length) return;
+    bookItem(book.id, book.booktitle, book.bookimag_url)
+      .append(postButton(DELETE_BOOK + book.id, "minus malt"))
+      .append(postButton(ADD_READ + book.id, "plus palt"))
+      .appendTo($clubBooks);
+  }
+
+  ////////////////////////////////////////////////////////////////////////////
+  // This member's clicks
+
+  async function send(form) {
+    const response = await fetch(form.action, {
+      method: "POST",
+      body: new FormData(form),
+      headers: { Accept: "application/json" },
+      credentials: "same-origin",
+    });
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+      throw new Error(data.error || "Something went wrong, please try again.");
+    }
+    return data;
+  }
+
+  $(document).on("submit", "[data-live] li form", async function (event) {
+    event.preventDefault();
+    const action = new URL(this.action).pathname;
+    const bookId = Number(action.split("/").pop());
+
+    let undo;
+    if (action.startsWith(ADD_READ)) undo = markRead(bookId);
+    else if (action.startsWith(DELETE_READ)) undo = markUnread(bookId);
+    else if (action.startsWith(DELETE_BOOK)) undo = removeBook(bookId);
+    else return this.submit();
+
+    try {
+      const data = await send(this);
+      if (data.queued) {
+        showNotice("This book has many readers. It will be removed shortly.",
+                   "success", false);
+      }
+    } catch (error) {
+      undo();
+      showNotice(error.message, "danger", false);
+    }
+  });
+
+  $addBook.on("submit", async function (event) {
+    event.preventDefault();
+    const form = this;
+    const title = form.booktitle.value.trim();
+    if (!title) return;
+
+    // Shown at once under a placeholder id, swapped for the real one after.
+    const placeholderId = `pending-${++pendingBooks}`;
+    const imageUrl = form.bookimage.value || "/static/images/book_logo.png";
+    const $clubBook = bookItem(placeholderId, title, imageUrl)
+      .appendTo($clubBooks);
+    const $myBook = bookItem(placeholderId, title, imageUrl)
+      .appendTo($myBooks);
+    updateReadCount();
+
+    try {
+      const { book } = await send(form);
+      form.reset();
+      // The /events stream may have brought the book in already.
+      findBook($clubBooks, book.id).not($clubBook).remove();
+      findBook($myBooks, book.id).not($myBook).remove();
+      $clubBook.attr("data-book-id", book.id)
+        .append(postButton(DELETE_BOOK + book.id, "minus malt"));
+      $myBook.attr("data-book-id", book.id)
+        .append(postButton(DELETE_READ + book.id, "minus malt"));
+    } catch (error) {
+      $clubBook.remove();
+      $myBook.remove();
+      showNotice(error.message, "danger", false);
+    }
+    updateReadCount();
+  });
+
+  ////////////////////////////////////////////////////////////////////////////
+  // Everyone else's changes
+
+  // Without a stream: fetch this page now and then (answered with a 304
+  // while nothing changed) and take its lists when its ETag moves.
+  function pollForChanges() {
+    let etag = null;
+    setInterval(async function () {
+      const response = await fetch("/", {
+        cache: "no-cache",
+        credentials: "same-origin",
+      }).catch(() => null);
+      if (!response || !response.ok) return;
+      const tag = response.headers.get("ETag");
+      if (tag === etag) return;
+      // Don't overwrite books still being added
+      if ($("[data-book-id^=pending-]").length) return;
+      etag = tag;
+      const page = new DOMParser().parseFromString(await response.text(),
+                                                   "text/html");
+      $myBooks.html($(page).find("[data-live=my-books]").html());
+      $clubBooks.html($(page).find("[data-live=club-books]").html());
+      updateReadCount();
+    }, POLL_MILLISECONDS);
+  }
+
+  if (!window.EventSource) return pollForChanges();
+  const source = new EventSource("/events");
+
+  source.addEventListener("error", function () {
+    // Refused (503) rather than just dropped: don't reconnect, poll.
+    if (source.readyState === EventSource.CLOSED) pollForChanges();
+  });
+
+  source.addEventListener("book_added", function (event) {
+    addClubBook(JSON.parse(event.data));
+  });
+
+  source.addEventListener("book_removed", function (event) {
+    removeBook(JSON.parse(event.data).id);
+  });
+
+  source.addEventListener("read_added", function (event) {
+    const read = JSON.parse(event.data);
+    if (read.user_id === userId) markRead(read.book_id);
+  });
+
+  source.addEventListener("read_removed", function (event) {
+    const read = JSON.parse(event.data);
+    if (read.user_id === userId) markUnread(read.book_id);
+  });
+
+  source.addEventListener("reads_imported", function (event) {
+    const summary = JSON.parse(event.data);
+    if (summary.user_id === userId || summary.books_created) {
+      showNotice("New books were imported.", "info", true);
+    }
+  });
+});
@@ -0,0 +1,30 @@
+// Fill the navbar search box's <datalist> with title suggestions.
+
+$(function () {
+  const $search = $("#search");
+  const $suggestions = $("#search-suggestions");
+  let timer = null;
+  let lastQuery = "";
+
+  $search.on("input", function () {
+    clearTimeout(timer);
+    timer = setTimeout(async function () {
+      const query = $search.val().trim();
+      if (query === lastQuery) return;
+      lastQuery = query;
+      if (!query) {
+        $suggestions.empty();
+        return;
+      }
+
+      const response = await fetch(`/suggest?q=${encodeURIComponent(query)}`);
+      if (!response.ok || query !== lastQuery) return;
+      const titles = await response.json();
+
+      $suggestions.empty();
+      for (const title of titles) {
+        $suggestions.append($("<option>").attr("value", title));
+      }
+    }, 100);
+  });
+});
@@ -0,0 +1,250 @@
+"""Title autocomplete for the navbar search box (/suggest?q=).
+
+Suggestions come from an in-memory index of the club's book titles plus
+titles its members recently found on Open Library, so answering a keystroke
+touches neither the database nor the network. Each club has its own index,
+which checks the club's titles version counter at most every
+REFRESH_INTERVAL seconds and, when it changed, applies only the
+added/removed/renamed books. Metadata enrichment leaves that counter
+alone, so filling in covers never reloads the titles.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from cache import TITLES, club_version_name
+from models import db, Book, CacheVersion
+
+REFRESH_INTERVAL = 5.0
+MAX_REMOTE_TITLES = 1000
+MAX_KEY_CHARS = 32
+
+# Separates an index key from the id of the title it points to. Sorts
+# before every character a key can contain.
+SEPARATOR = "\x00"
+
+
+def normalize(text):
+    """Lowercase, strip accents and reduce punctuation to single spaces."""
+
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[\W_]+', ' ', text.lower()).strip()
+
+
+class PrefixIndex:
+    """Sorted array of "key\\0id" strings, searched by bisection.
+
+    Each title is indexed once per word, so a query matches the start of
+    any word. Keys are cut to MAX_KEY_CHARS to keep the array small.
+    """
+
+    def __init__(self):
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _entries_for(title_id, title):
+        words = normalize(title).split(' ')
+        for i in range(len(words)):
+            key = ' '.join(words[i:])[:MAX_KEY_CHARS]
+            if key:
+                yield f"{key}{SEPARATOR}{title_id}"
+
+    def add(self, title_id, title):
+        for entry in self._entries_for(title_id, title):
+            insort(self._entries, entry)
+
+    def add_many(self, titles):
+        """Add (title id, title) pairs with a single sort.
+
+        Inserting entries one by one moves the array's tail every time;
+        building a whole catalog that way is quadratic.
+        """
+
+        for title_id, title in titles:
+            self._entries.extend(self._entries_for(title_id, title))
+        self._entries.sort()
+
+    def remove(self, title_id, title):
+        for entry in self._entries_for(title_id, title):
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def search(self, prefix, limit):
+        """Get the ids of up to `limit` titles with a key starting `prefix`."""
+
+        prefix = prefix[:MAX_KEY_CHARS]
+        found = []
+        i = bisect_left(self._entries, prefix)
+        while (i < len(self._entries) and len(found) < limit
+               and self._entries[i].startswith(prefix)):
+            title_id = self._entries[i].rsplit(SEPARATOR, 1)[1]
+            found.append(title_id)
+            i += 1
+        return found
+
+
+class Suggester:
+    """Index of a club's book titles and recent Open Library titles.
+
+    Without a `club_id` (logged-out visitors), only Open Library titles.
+    """
+
+    def __init__(self, club_id=None, refresh_interval=REFRESH_INTERVAL,
+                 max_remote=MAX_REMOTE_TITLES):
+        self.club_id = club_id
+        self.refresh_interval = refresh_interval
+        self.max_remote = max_remote
+        self.index = PrefixIndex()
+        self._titles = {}               # title id -> title
+        self._books = {}                # book id -> title
+        self._remote = OrderedDict()    # normalized title -> title id
+        self._remote_counter = 0
+        self._titles_version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _add(self, title_id, title):
+        self._titles[title_id] = title
+        self.index.add(title_id, title)
+
+    def _add_many(self, titles):
+        titles = list(titles)
+        self._titles.update(titles)
+        self.index.add_many(titles)
+
+    def _remove(self, title_id):
+        title = self._titles.pop(title_id, None)
+        if title is not None:
+            self.index.remove(title_id, title)
+
+    def refresh_if_stale(self):
+        """Apply catalog changes, checking at most every refresh_interval.
+
+        One request checks at a time. While the index has never been
+        loaded the others wait for it; after that they answer from the
+        index as it is.
+        """
+
+        if self.club_id is None:
+            return
+        if not self._refresh_lock.acquire(
+                blocking=self._titles_version is None):
+            return
+        try:
+            now = time.monotonic()
+            if now - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = now
+
+            name = club_version_name(TITLES, self.club_id)
+            version = CacheVersion.lookup(name)[name]
+            if version == self._titles_version:
+                return
+
+            books = dict(db.session.query(Book.id, Book.booktitle)
+                         .filter(Book.club_id == self.club_id))
+            with self._lock:
+                for book_id, title in self._books.items():
+                    if books.get(book_id) != title:
+                        self._remove(f"b{book_id}")
+                self._add_many((f"b{book_id}", title)
+                               for book_id, title in books.items()
+                               if self._books.get(book_id) != title)
+                self._books = books
+                self._titles_version = version
+        finally:
+            self._refresh_lock.release()
+
+    def add_remote_titles(self, titles):
+        """Remember titles found on Open Library, forgetting the oldest."""
+
+        with self._lock:
+            for title in titles:
+                key = normalize(title)
+                if not key:
+                    continue
+                if key in self._remote:
+                    self._remote.move_to_end(key)
+                    continue
+
+                self._remote_counter += 1
+                title_id = f"r{self._remote_counter}"
+                self._remote[key] = title_id
+                self._add(title_id, title)
+
+                if len(self._remote) > self.max_remote:
+                    _, oldest_id = self._remote.popitem(last=False)
+                    self._remove(oldest_id)
+
+    def suggest(self, query, limit=8):
+        """Get up to `limit` titles with a word starting with `query`.
+
+        Club books come first, then titles starting with the query, then
+        shorter titles.
+        """
+
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        with self._lock:
+            candidates = self.index.search(prefix, limit * 4)
+            titles = {title_id: self._titles[title_id]
+                      for title_id in candidates}
+
+        if len(prefix) > MAX_KEY_CHARS:
+            # Keys are cut short: check the rest of the query too.
+            titles = {title_id: title for title_id, title in titles.items()
+                      if prefix in normalize(title)}
+
+        ranked = sorted(
+            titles.items(),
+            key=lambda item: (not item[0].startswith('b'),
+                              not normalize(item[1]).startswith(prefix),
+                              len(item[1])))
+
+        suggestions = []
+        seen = set()
+        for _, title in ranked:
+            if title.lower() not in seen:
+                seen.add(title.lower())
+                suggestions.append(title)
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+class ClubSuggesters:
+    """The Suggester of each club, made the first time it is asked for."""
+
+    def __init__(self, **options):
+        self._options = options
+        self._suggesters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._suggesters)
+
+    def for_club(self, club_id):
+        with self._lock:
+            suggester = self._suggesters.get(club_id)
+            if suggester is None:
+                suggester = Suggester(club_id, **self._options)
+                self._suggesters[club_id] = suggester
+            return suggester
+
+
+def init_suggest(app):
+    """Give the app its title indexes (each built on its first /suggest)."""
+
+    app.suggesters = ClubSuggesters()
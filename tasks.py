@@ -0,0 +1,43 @@
+"""Background job handlers (see jobs.py)."""
+
+from cache import bump_catalog, bump_user
+from jobs import job
+from enrich import enrich_books
+from events import publish
+from models import db, Book, Read
+import analytics
+
+READ_DELETE_CHUNK = 5000
+
+
+@job('fetch_cover')
+def fetch_cover(book_id):
+    """Look the book up on Open Library and use its cover, if it has one.
+
+    Kept for jobs queued before enrich_metadata, which does this too.
+    """
+
+    enrich_books(book_ids=[book_id])
+
+
+@job('delete_book')
+def delete_book(book_id, club_id=None):
+    """Delete a popular book, removing its reads in chunks first."""
+
+    if club_id is None:
+        # Queued before books belonged to clubs
+        club_id = (db.session.query(Book.club_id)
+                   .filter(Book.id == book_id).scalar())
+        if club_id is None:
+            return
+
+    Book.delete_reads(club_id, book_id, READ_DELETE_CHUNK,
+                      before_chunk=analytics.remove_reads)
+    # Reads added since the last chunk go with the book.
+    analytics.remove_reads(Read.club_id == club_id, Read.book_id == book_id)
+    analytics.remove_books(Book.club_id == club_id, Book.id == book_id)
+    Book.bulk_delete(club_id, book_id)
+    publish('book_removed', club_id, id=book_id)
+    bump_catalog(club_id)
+    bump_user(club_id)
+    db.session.commit()
@@ -0,0 +1,167 @@
+"""Compiled-template cache, startup warmup and per-template render metrics.
+
+Jinja compiles a template to Python code the first time it is loaded,
+which every gunicorn worker used to pay for on its first hits.
+
+- Compiled templates are kept in a Jinja bytecode cache, so processes load
+  them instead of compiling them again. `flask templates compile` fills
+  it, e.g. as a build step. Entries are keyed on the template's source: an
+  edited template is recompiled. The cache holds code the app runs, so its
+  directory must be private to the app's user: TEMPLATE_CACHE_DIR if set
+  (created 0700; refused if someone else owns it or can write to it),
+  otherwise Jinja's own per-user directory under the temporary directory.
+- With TEMPLATE_WARMUP on (production), every template is loaded when the
+  app is created. With gunicorn's preload_app that happens once, in the
+  master, and the forked workers start with all templates in memory.
+- Every render is timed and its output measured, per template.
+  /admin/templates shows the numbers of the process serving it (each
+  gunicorn worker has its own). Render times include the queries run while
+  rendering (lazy loads).
+"""
+
+import threading
+import time
+from collections import deque
+
+import click
+from jinja2 import FileSystemBytecodeCache, Template
+
+from metrics import percentile
+from privatedirs import private_directory
+
+TEMPLATE_EXTENSIONS = ('html', 'txt', 'xml')
+
+# Renders per template kept for the percentiles
+RECENT_RENDERS = 1000
+
+
+class RenderMetrics:
+    """Render count, time and output size per template, in this process."""
+
+    def __init__(self, recent=RECENT_RENDERS):
+        self.recent = recent
+        self.started = time.time()
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, size):
+        with self._lock:
+            stats = self._templates.get(name)
+            if stats is None:
+                stats = self._templates[name] = {
+                    'renders': 0,
+                    'seconds': 0.0,
+                    'bytes': 0,
+                    'max_bytes': 0,
+                    'recent': deque(maxlen=self.recent),
+                }
+            stats['renders'] += 1
+            stats['seconds'] += seconds
+            stats['bytes'] += size
+            stats['max_bytes'] = max(stats['max_bytes'], size)
+            stats['recent'].append(seconds)
+
+    def summary(self):
+        """Get each template's stats, the most total render time first."""
+
+        with self._lock:
+            templates = [(name, dict(stats, recent=list(stats['recent'])))
+                         for name, stats in self._templates.items()]
+
+        rows = []
+        for name, stats in templates:
+            rows.append({
+                'name': name,
+                'renders': stats['renders'],
+                'total_ms': stats['seconds'] * 1000,
+                'mean_ms': stats['seconds'] * 1000 / stats['renders'],
+                'p50_ms': percentile(stats['recent'], 0.5) * 1000,
+                'p95_ms': percentile(stats['recent'], 0.95) * 1000,
+                'mean_bytes': stats['bytes'] / stats['renders'],
+                'max_bytes': stats['max_bytes'],
+            })
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+
+class MeteredTemplate(Template):
+    """A template that records its renders in its environment's metrics.
+
+    Only whole renders are counted: templates it extends or includes are
+    part of its own time and size.
+    """
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        output = super().render(*args, **kwargs)
+        self.environment.render_metrics.record(
+            self.name or '<string>', time.perf_counter() - started,
+            len(output.encode('utf-8')))
+        return output
+
+
+def bytecode_cache(app):
+    """Get the bytecode cache (see the module docstring), or None.
+
+    None when the directory is unsafe or can't be written, rather than
+    failing template loads later.
+    """
+
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if not directory:
+        try:
+            return FileSystemBytecodeCache()
+        except RuntimeError as exc:
+            # Jinja's per-user directory failed the same checks
+            app.logger.warning("Not caching compiled templates: %s", exc)
+            return None
+
+    reason = private_directory(directory)
+    if reason is not None:
+        app.logger.warning("Not caching compiled templates: %s", reason)
+        return None
+    return FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """Load every template, compiling it or reading it from the cache.
+
+    Loaded templates stay in the Jinja environment's memory. Returns their
+    names.
+    """
+
+    env = app.jinja_env
+    names = env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def init_templating(app):
+    """Cache compiled templates and measure renders; add `flask templates`.
+
+    Call it before anything loads a template. Warming up is left to the
+    caller (compile_templates), once the app has all its template globals.
+    """
+
+    env = app.jinja_env
+    env.bytecode_cache = bytecode_cache(app)
+    env.template_class = MeteredTemplate
+    env.render_metrics = RenderMetrics()
+
+    @app.cli.group('templates')
+    def templates_cli():
+        """Manage compiled templates."""
+
+    @templates_cli.command('compile')
+    def compile_command():
+        """Compile every template into the bytecode cache."""
+
+        if env.bytecode_cache is None:
+            raise click.ClickException("The template cache directory is "
+                                       "unsafe or not writable")
+        started = time.perf_counter()
+        names = compile_templates(app)
+        click.echo(f"Compiled {len(names)} templates into "
+                   f"{env.bytecode_cache.directory} in "
+                   f"{(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,101 @@
+"""Shared fixtures: a fresh app, on a fresh database, for every test.
+
+Tests run against a SQLite file per test (the embedded mode of
+sqlitedb.py). Set TEST_DATABASE_URL to run them against Postgres instead;
+its tables are then dropped after every test.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TestingConfig  # noqa: E402
+from models import db  # noqa: E402
+
+ON_POSTGRES = bool(os.environ.get('TEST_DATABASE_URL'))
+
+
+@pytest.fixture
+def make_app(monkeypatch, tmp_path):
+    """Build the app with `config` overrides, tables created.
+
+    Settings read while the app is built (e.g. PAGE_CACHE_ENABLED) must be
+    given here rather than set on app.config afterwards.
+    """
+
+    contexts = []
+
+    def make(**config):
+        import app as app_module
+
+        if not ON_POSTGRES:
+            monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI',
+                                f"sqlite:///{tmp_path / 'test.db'}")
+        monkeypatch.setattr(TestingConfig, 'IMPORT_UPLOAD_DIR',
+                            str(tmp_path / 'imports'), raising=False)
+        monkeypatch.setattr(TestingConfig, 'PROFILE_DIR',
+                            str(tmp_path / 'profiles'), raising=False)
+        monkeypatch.setattr(TestingConfig, 'TEMPLATE_CACHE_DIR',
+                            str(tmp_path / 'templates'), raising=False)
+        for name, value in config.items():
+            monkeypatch.setattr(TestingConfig, name, value, raising=False)
+
+        app = app_module.create_app('testing')
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        db.create_all()
+        return app
+
+    yield make
+
+    for context in reversed(contexts):
+        db.session.remove()
+        if ON_POSTGRES:
+            db.drop_all()
+        context.pop()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def signup(client, username, **fields):
+    """Sign `client` up (and so log it in) as `username`."""
+
+    data = dict(username=username, email=f"{username}@example.com",
+                password='secret1')
+    data.update(fields)
+    response = client.post('/signup', data=data)
+    assert response.status_code == 302, response.data
+    return response
+
+
+@pytest.fixture
+def member(app, client):
+    """A client logged in as alice, of the default club."""
+
+    signup(client, 'alice')
+    return client
+
+
+def add_book(client, title, **fields):
+    """Add a book (and read it) as `client`; get its JSON."""
+
+    data = dict(booktitle=title)
+    data.update(fields)
+    response = client.post('/booksread/add', data=data,
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 201, response.data
+    return response.get_json()['book']
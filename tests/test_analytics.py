@@ -0,0 +1,76 @@
+"""Reading stats rollups (analytics.py)."""
+
+from datetime import date, datetime
+
+import analytics
+from models import BookReadCount, MemberMonthReads, WeeklyNewBooks
+
+from conftest import add_book, signup
+
+JSON = {'Accept': 'application/json'}
+
+
+def rollups():
+    return (sorted((r.book_id, r.reads) for r in BookReadCount.query),
+            sorted((r.user_id, r.month, r.reads)
+                   for r in MemberMonthReads.query),
+            sorted((r.week, r.books) for r in WeeklyNewBooks.query))
+
+
+def test_periods():
+    assert analytics.month_of(datetime(2024, 2, 29, 23)) == date(2024, 2, 1)
+    assert analytics.week_of(datetime(2024, 3, 3)) == date(2024, 2, 26)
+    assert analytics.week_of(None) is None
+
+
+def test_rollups_follow_reads_as_they_change(app, member):
+    dune = add_book(member, 'Dune')
+    emma = add_book(member, 'Emma')
+    bob = app.test_client()
+    signup(bob, 'bob')
+    assert bob.post(f"/users/books/addread/{dune['id']}",
+                    headers=JSON).status_code == 200
+
+    books = dict(rollups()[0])
+    assert books == {dune['id']: 2, emma['id']: 1}
+    assert [(b.booktitle, reads) for b, reads
+            in analytics.most_read_books(1)] == [('Dune', 2), ('Emma', 1)]
+
+    assert bob.post(f"/users/books/deleteread/{dune['id']}",
+                    headers=JSON).status_code == 200
+    assert dict(rollups()[0]) == {dune['id']: 1, emma['id']: 1}
+
+    assert member.post(f"/books/delete/{emma['id']}",
+                       headers=JSON).status_code == 200
+    books, member_months, weeks = rollups()
+    assert books == [(dune['id'], 1)]
+    assert [reads for _, _, reads in member_months] == [1]
+    assert [count for _, count in weeks] == [1]
+
+
+def test_rebuild_matches_the_incremental_counts(app, member):
+    for title in ('Dune', 'Emma', 'Ulysses'):
+        add_book(member, title)
+    incremental = rollups()
+
+    assert analytics.rebuild() == {'books': 3, 'member_months': 1,
+                                   'weeks': 1}
+    assert rollups() == incremental
+
+
+def test_rebuild_command(app, member):
+    add_book(member, 'Dune')
+    result = app.test_cli_runner().invoke(args=['analytics', 'rebuild'])
+    assert result.output.strip() == "1 books, 1 member-months, 1 weeks"
+
+
+def test_stats_api_and_page(member):
+    add_book(member, 'Dune')
+
+    stats = member.get('/api/v1/stats').get_json()['data']
+    assert stats['most_read_books'][0]['booktitle'] == 'Dune'
+    assert stats['most_active_members']['members'][0]['username'] == 'alice'
+    assert stats['new_books_per_week'][0]['books'] == 1
+
+    assert member.get('/api/v1/stats?month=May').status_code == 400
+    assert b'Dune' in member.get('/stats').data
@@ -0,0 +1,68 @@
+"""JSON API v1 (api.py)."""
+
+import gzip
+import json
+
+from conftest import add_book
+
+
+def test_login_is_required(client):
+    response = client.get('/api/v1/books')
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Access unauthorized.'}
+
+
+def test_fields_are_selected(member):
+    add_book(member, 'Dune')
+    data = member.get('/api/v1/books?fields=id,booktitle').get_json()['data']
+    assert data == [{'id': data[0]['id'], 'booktitle': 'Dune'}]
+
+    response = member.get('/api/v1/books?fields=id,isbn')
+    assert response.status_code == 400
+    assert 'isbn' in response.get_json()['error']
+
+
+def test_users_never_show_emails_or_passwords(member):
+    member_data = member.get('/api/v1/users').get_json()['data'][0]
+    assert set(member_data) == {'id', 'username', 'bio', 'location'}
+    assert member.get('/api/v1/users?fields=password').status_code == 400
+
+
+def test_cursor_pages_cover_every_row_once(member):
+    titles = [f"Book {i}" for i in range(7)]
+    for title in titles:
+        add_book(member, title)
+
+    seen = []
+    url = '/api/v1/books?limit=3&fields=booktitle'
+    cursor = ''
+    while cursor is not None:
+        page = member.get(f"{url}&cursor={cursor}").get_json()
+        assert len(page['data']) <= 3
+        seen.extend(row['booktitle'] for row in page['data'])
+        cursor = page['next_cursor']
+
+    assert seen == titles
+
+
+def test_bad_cursors_and_limits_are_refused(member):
+    assert member.get('/api/v1/books?cursor=!!!').status_code == 400
+    assert member.get('/api/v1/books?limit=many').status_code == 400
+
+
+def test_user_books_are_the_member_reads(member):
+    add_book(member, 'Dune')
+    user_id = member.get('/api/v1/users').get_json()['data'][0]['id']
+    books = member.get(f"/api/v1/users/{user_id}/books").get_json()['data']
+    assert [book['booktitle'] for book in books] == ['Dune']
+    assert member.get('/api/v1/books/999').status_code == 404
+
+
+def test_large_responses_are_gzipped(member):
+    for i in range(20):
+        add_book(member, f"A fairly long book title number {i}")
+
+    response = member.get('/api/v1/books',
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.data))['data']) == 20
@@ -0,0 +1,61 @@
+"""Adding and removing books and reads from the home page, in place."""
+
+from models import Book, Read
+
+from conftest import add_book, signup
+
+JSON = {'Accept': 'application/json'}
+
+
+def test_adding_a_book_adds_the_book_and_its_read(app, member):
+    book = add_book(member, 'Dune', bookimage='http://covers/dune.jpg')
+
+    assert book['booktitle'] == 'Dune'
+    assert book['bookimag_url'] == 'http://covers/dune.jpg'
+    assert [(r.user.username, r.book_id) for r in Read.query] == \
+        [('alice', book['id'])]
+
+
+def test_reads_are_added_and_removed(app, member):
+    book = add_book(member, 'Dune')
+    reader = app.test_client()
+    signup(reader, 'bob')
+
+    added = reader.post(f"/users/books/addread/{book['id']}", headers=JSON)
+    assert added.get_json() == {'book_id': book['id'], 'read': True}
+    again = reader.post(f"/users/books/addread/{book['id']}", headers=JSON)
+    assert again.status_code == 200
+    assert Read.query.count() == 2
+
+    removed = reader.post(f"/users/books/deleteread/{book['id']}",
+                          headers=JSON)
+    assert removed.get_json() == {'book_id': book['id'], 'read': False}
+    assert Read.query.count() == 1
+
+
+def test_refused_changes_answer_an_error(client, member):
+    missing = member.post('/users/books/addread/999', headers=JSON)
+    assert missing.status_code == 404
+    assert missing.get_json()['error']
+
+    assert member.post('/users/books/deleteread/999',
+                       headers=JSON).status_code == 404
+    assert member.post('/booksread/add', data={},
+                       headers=JSON).status_code == 400
+
+
+def test_visitors_are_refused(client):
+    response = client.post('/booksread/add', data={'booktitle': 'Dune'},
+                           headers=JSON)
+    assert response.status_code == 401
+    assert Book.query.count() == 0
+
+
+def test_form_posts_still_redirect_home(member):
+    response = member.post('/booksread/add', data={'booktitle': 'Dune'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/')
+
+    refused = member.post('/users/books/addread/999')
+    assert refused.status_code == 302
+    assert b'no longer in the club' in member.get('/').data
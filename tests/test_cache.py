@@ -0,0 +1,58 @@
+"""Fragment cache (cache.py)."""
+
+from cache import LRUCache, CATALOG, club_version_name, cache_version
+from models import CacheVersion, DEFAULT_CLUB_ID
+
+from conftest import add_book
+
+
+def test_lru_evicts_least_recently_used_entries():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_is_bounded_by_bytes():
+    cache = LRUCache(max_bytes=10)
+    cache.set('a', 'x' * 6)
+    cache.set('b', 'y' * 6)
+
+    assert cache.get('a') is None
+    assert cache.current_bytes == 6
+    cache.set('huge', 'z' * 11)
+    assert cache.get('huge') is None
+
+
+def test_cache_block_renders_once_per_key(app):
+    template = app.jinja_env.from_string(
+        "{% cache 'test-block', key %}{{ value }}{% endcache %}")
+
+    assert template.render(key=1, value='first') == 'first'
+    assert template.render(key=1, value='second') == 'first'
+    assert template.render(key=2, value='second') == 'second'
+
+
+def test_bump_changes_the_version(app):
+    name = club_version_name(CATALOG, DEFAULT_CLUB_ID)
+    before = CacheVersion.lookup(name)[name]
+    CacheVersion.bump(name)
+
+    with app.test_request_context():
+        assert cache_version(name) == before + 1
+
+
+def test_home_page_shows_books_added_after_caching(app, member):
+    add_book(member, 'Dune')
+    assert b'Dune' in member.get('/').data
+
+    add_book(member, 'Emma')
+    page = member.get('/').data
+    assert b'Dune' in page and b'Emma' in page
+    assert len(app.jinja_env.fragment_cache) > 0
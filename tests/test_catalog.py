@@ -0,0 +1,104 @@
+"""Offline Open Library catalog (catalog.py)."""
+
+import os
+
+import pytest
+
+import openlibrary
+from catalog import import_dumps, search, search_everywhere
+from models import CatalogAuthor, CatalogEntry
+
+SAMPLE_DUMP = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'generator', 'ol_dump_sample.txt.gz')
+
+
+@pytest.fixture
+def imported(app):
+    return import_dumps([SAMPLE_DUMP], processes=1)
+
+
+@pytest.fixture
+def open_library(monkeypatch):
+    """Stand in for Open Library; records the queries it gets."""
+
+    calls = []
+    docs = [{'key': '/works/OL2W', 'title': 'The Lord of the Rings'},
+            {'key': '/works/OL99W', 'title': 'The Silmarillion'},
+            {'key': '/works/OL98W', 'title': 'Unfinished Tales'}]
+
+    def fake_search(params, limit=5, fields=None):
+        calls.append(params['q'])
+        if 'offline' in calls:
+            raise openlibrary.OpenLibraryError("unreachable")
+        return docs[:limit]
+
+    monkeypatch.setattr(openlibrary, 'search', fake_search)
+    return calls
+
+
+def test_sample_dump_import_counts(imported):
+    # 6 works and 2 editions; the redirect is skipped
+    assert imported == {'entry': 8, 'author': 4}
+    assert CatalogEntry.query.count() == 8
+    assert CatalogAuthor.query.count() == 4
+
+
+def test_importing_again_updates_in_place(imported):
+    import_dumps([SAMPLE_DUMP], processes=1, batch_size=3)
+    assert CatalogEntry.query.count() == 8
+
+
+def test_parsing_in_processes_gives_the_same_rows(app):
+    assert import_dumps([SAMPLE_DUMP], processes=2) == \
+        {'entry': 8, 'author': 4}
+
+
+def test_search_matches_title_prefixes(imported):
+    hobbits = search('the hob')
+    assert [doc['title'] for doc in hobbits] == [
+        'The Hobbit', 'The Hobbit, or There and Back Again']
+    assert hobbits[0] == {'key': '/works/OL1W', 'title': 'The Hobbit',
+                          'author_name': ['J. R. R. Tolkien'],
+                          'cover_i': 6979861}
+
+    sinuhe = search('Sinuhe EGYPTILÄINEN')
+    assert [doc['key'] for doc in sinuhe] == ['/works/OL5W']
+    assert sinuhe[0]['cover_i'] is None
+
+    assert len(search('the', limit=2)) == 2
+    assert search('tolkien') == []
+
+
+def test_full_local_pages_skip_open_library(imported, open_library):
+    assert len(search_everywhere('the', limit=2)) == 2
+    assert open_library == []
+
+
+def test_few_local_hits_are_topped_up(imported, open_library):
+    titles = [doc['title'] for doc in search_everywhere('the lord', 5)]
+    assert titles == ['The Lord of the Rings', 'The Silmarillion',
+                      'Unfinished Tales']
+
+    by_author = search_everywhere('tolkien', 5)
+    assert len(by_author) == 3
+
+
+def test_open_library_errors_only_matter_without_local_hits(
+        imported, open_library):
+    with pytest.raises(openlibrary.OpenLibraryError):
+        search_everywhere('offline')
+
+    assert [doc['title'] for doc in search_everywhere('emma')] == ['Emma']
+
+
+def test_search_page_shows_author_matches(imported, open_library, member):
+    page = member.get('/search?q=tolkien')
+    assert page.status_code == 200
+    assert b'The Silmarillion' in page.data
+
+
+def test_logged_out_visitors_can_search(imported, open_library, client):
+    page = client.get('/search?q=tolkien')
+    assert page.status_code == 200
+    assert b'The Silmarillion' in page.data
+    assert b'invite code' not in page.data
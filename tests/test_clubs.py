@@ -0,0 +1,74 @@
+"""Clubs: joining them, and keeping each club's data to itself."""
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Club, Read, User, DEFAULT_CLUB_ID
+
+from conftest import add_book, signup
+
+JSON = {'Accept': 'application/json'}
+
+
+def club_of(username):
+    return User.query.filter_by(username=username).one().club
+
+
+def test_new_names_start_a_club_with_an_invite_code(client):
+    signup(client, 'alice', club='Book Thieves')
+
+    club = club_of('alice')
+    assert club.name == 'Book Thieves'
+    assert len(club.invite_code) >= 12
+    assert club.invite_code.encode() in client.get('/').data
+
+
+def test_joining_a_club_takes_its_invite_code(app):
+    signup(app.test_client(), 'alice', club='Book Thieves')
+    code = club_of('alice').invite_code
+
+    intruder = app.test_client()
+    for guess in ('', 'letmein'):
+        page = intruder.post('/signup', data=dict(
+            username='mallory', email='m@example.com', password='secret1',
+            club='Book Thieves', invite_code=guess))
+        assert page.status_code == 200
+        assert b'ask one of its members' in page.data
+    assert User.query.filter_by(username='mallory').count() == 0
+
+    signup(app.test_client(), 'bob', club='Book Thieves', invite_code=code)
+    assert club_of('bob').name == 'Book Thieves'
+
+
+def test_the_default_club_is_open(client):
+    signup(client, 'alice')
+    assert club_of('alice').id == DEFAULT_CLUB_ID
+    assert club_of('alice').invite_code is None
+    assert Club.join_or_start('BookClub').id == DEFAULT_CLUB_ID
+
+
+def test_members_only_see_their_own_club(app, member):
+    dune = add_book(member, 'Dune')
+    other = app.test_client()
+    signup(other, 'bob', club='Book Thieves')
+    add_book(other, 'Emma')
+
+    assert b'Dune' not in other.get('/').data
+    assert [b['booktitle'] for b in
+            other.get('/api/v1/books').get_json()['data']] == ['Emma']
+    assert other.post(f"/users/books/addread/{dune['id']}",
+                      headers=JSON).status_code == 404
+
+
+def test_a_book_is_read_once_per_member(app, member):
+    book = add_book(member, 'Dune')
+    alice = User.query.filter_by(username='alice').one()
+
+    assert member.post(f"/users/books/addread/{book['id']}",
+                       headers=JSON).status_code == 200
+    assert Read.query.count() == 1
+
+    db.session.add(Read(club_id=alice.club_id, user_id=alice.id,
+                        book_id=book['id']))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
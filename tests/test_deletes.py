@@ -0,0 +1,68 @@
+"""Deleting users and books with database-side cascades."""
+
+from jobs import work_once
+from models import Book, Read, User, DEFAULT_CLUB_ID
+
+from conftest import add_book, signup
+
+JSON = {'Accept': 'application/json'}
+
+
+def test_deleting_a_user_deletes_their_reads(app, member):
+    add_book(member, 'Dune')
+    add_book(member, 'Emma')
+    assert Read.query.count() == 2
+
+    assert member.post('/users/delete').status_code == 302
+    assert User.query.count() == 0
+    assert Read.query.count() == 0
+    assert Book.query.count() == 2
+
+
+def test_deleting_a_book_deletes_its_reads(app, member):
+    book = add_book(member, 'Dune')
+    reader = app.test_client()
+    signup(reader, 'bob')
+    reader.post(f"/users/books/addread/{book['id']}", headers=JSON)
+    assert Read.query.count() == 2
+
+    response = member.post(f"/books/delete/{book['id']}", headers=JSON)
+    assert response.get_json() == {'book_id': book['id'], 'deleted': True}
+    assert Book.query.count() == 0
+    assert Read.query.count() == 0
+
+
+def test_popular_books_are_deleted_by_a_job(make_app):
+    app = make_app(BOOK_DELETE_INLINE_MAX_READS=1)
+    client = app.test_client()
+    signup(client, 'alice')
+    book = add_book(client, 'Dune')
+    reader = app.test_client()
+    signup(reader, 'bob')
+    reader.post(f"/users/books/addread/{book['id']}", headers=JSON)
+
+    response = client.post(f"/books/delete/{book['id']}", headers=JSON)
+    assert response.status_code == 202
+    assert response.get_json()['queued'] is True
+    assert Book.query.count() == 1
+
+    assert work_once()
+    assert Book.query.count() == 0
+    assert Read.query.count() == 0
+
+
+def test_reads_are_deleted_in_chunks(app, member):
+    book = add_book(member, 'Dune')
+    for name in ('bob', 'carol', 'dave', 'erin'):
+        reader = app.test_client()
+        signup(reader, name)
+        reader.post(f"/users/books/addread/{book['id']}", headers=JSON)
+
+    chunks = []
+    Book.delete_reads(DEFAULT_CLUB_ID, book['id'], chunk_size=2,
+                      before_chunk=lambda *criteria: chunks.append(
+                          Read.query.filter(*criteria).count()))
+
+    assert chunks == [2, 2, 1]
+    assert Read.query.count() == 0
+    assert Book.query.count() == 1
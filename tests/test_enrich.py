@@ -0,0 +1,75 @@
+"""Background metadata enrichment (enrich.py)."""
+
+import os
+
+import pytest
+
+import openlibrary
+from catalog import import_dumps
+from jobs import work_once
+from models import db, Book, Job
+
+from conftest import add_book
+
+SAMPLE_DUMP = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'generator', 'ol_dump_sample.txt.gz')
+
+
+@pytest.fixture
+def open_library(monkeypatch):
+    """Open Library stand-in; set `.down` to make it fail."""
+
+    class FakeOpenLibrary:
+        down = False
+        calls = 0
+
+        def search(self, params, limit=5, fields=None):
+            self.calls += 1
+            if self.down:
+                raise openlibrary.OpenLibraryError("timed out")
+            return [{'title': params['title'], 'author_name': ['Ann Author'],
+                     'cover_i': 42}]
+
+    fake = FakeOpenLibrary()
+    monkeypatch.setattr(openlibrary, 'search', fake.search)
+    return fake
+
+
+def test_books_are_enriched_from_the_local_catalog(member, open_library):
+    import_dumps([SAMPLE_DUMP], processes=1)
+    book = add_book(member, 'The Hobbit')
+
+    assert work_once()
+    hobbit = Book.query.filter_by(id=book['id']).one()
+    assert hobbit.bookauthor == 'J. R. R. Tolkien'
+    assert hobbit.bookimag_url == openlibrary.cover_url(6979861)
+    assert hobbit.metadata_checked_at is not None
+    assert open_library.calls == 0
+
+
+def test_books_are_enriched_from_open_library(member, open_library):
+    book = add_book(member, 'Obscure Poems')
+
+    assert work_once()
+    poems = Book.query.filter_by(id=book['id']).one()
+    assert poems.bookauthor == 'Ann Author'
+    assert poems.bookimag_url == openlibrary.cover_url(42)
+
+
+def test_failed_lookups_are_retried_by_the_job_queue(member, open_library):
+    open_library.down = True
+    book = add_book(member, 'Obscure Poems')
+
+    assert work_once()
+    job = Job.query.filter_by(kind='enrich_metadata').one()
+    assert job.status == 'queued'
+    assert 'LookupsFailed' in job.last_error
+    assert Book.query.filter_by(id=book['id']).one().bookauthor is None
+
+    open_library.down = False
+    job.run_at = job.created_at
+    db.session.commit()
+    assert work_once()
+    assert Job.query.get(job.id).status == 'done'
+    assert Book.query.filter_by(id=book['id']).one().bookauthor == \
+        'Ann Author'
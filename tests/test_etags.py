@@ -0,0 +1,49 @@
+"""Conditional GETs (etags.py)."""
+
+from conftest import add_book, signup
+
+
+def test_unchanged_page_answers_304(member):
+    first = member.get('/users')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    again = member.get('/users', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+def test_etag_changes_with_the_data(member):
+    etag = member.get('/users').headers['ETag']
+    add_book(member, 'Dune')
+
+    response = member.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_etags_differ_per_viewer(app, member):
+    other = app.test_client()
+    signup(other, 'bob')
+
+    assert member.get('/users').headers['ETag'] != \
+        other.get('/users').headers['ETag']
+
+
+def test_json_endpoints_are_conditional(member):
+    add_book(member, 'Dune')
+    first = member.get('/api/v1/books')
+    etag = first.headers['ETag']
+
+    again = member.get('/api/v1/books', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+
+
+def test_can_be_turned_off(make_app):
+    app = make_app(CONDITIONAL_GET_ENABLED=False)
+    client = app.test_client()
+    signup(client, 'alice')
+
+    assert 'ETag' not in client.get('/users').headers
@@ -0,0 +1,88 @@
+"""Live change events (events.py)."""
+
+import pytest
+
+import cooperative
+import events
+from models import db
+
+from conftest import add_book, signup
+
+
+@pytest.fixture
+def streams(make_app):
+    """An app whose workers keep at most 2 streams open."""
+
+    return make_app(EVENTS_MAX_STREAMS=2, EVENTS_STREAM_SECONDS=60)
+
+
+def open_stream(client):
+    response = client.get('/events')
+    if response.status_code == 200:
+        assert next(response.response) == b"retry: 3000\n\n"
+    return response
+
+
+def test_committed_changes_reach_the_stream(streams):
+    member = streams.test_client()
+    signup(member, 'alice')
+    live = open_stream(member)
+
+    add_book(member, 'Dune')
+
+    event = next(live.response).decode()
+    assert event.startswith('id: ')
+    assert 'event: book_added\n' in event and '"Dune"' in event
+    live.close()
+    assert not streams.events._subscribers
+
+
+def test_streams_only_carry_their_clubs_events(monkeypatch):
+    monkeypatch.setattr(events, 'KEEPALIVE_SECONDS', 0.01)
+    broker = events.MemoryBroker()
+    subscriber = broker.subscribe()
+    broker.publish({'kind': 'book_added', 'club_id': 2, 'data': {'id': 7}})
+    broker.publish({'kind': 'book_added', 'club_id': 1, 'data': {'id': 8}})
+
+    text = ''.join(events.stream(broker, subscriber, 0.05, club_id=1))
+    assert 'data: {"id": 8}' in text
+    assert '"id": 7' not in text
+    assert ': keepalive' in text
+    assert not broker._subscribers
+
+
+def test_rolled_back_changes_are_not_sent(app):
+    subscriber = app.events.subscribe()
+    events.publish('book_added', 1, id=1)
+    db.session.rollback()
+    db.session.commit()
+    assert subscriber.empty()
+
+
+def test_streams_past_the_limit_are_refused(streams):
+    member = streams.test_client()
+    signup(member, 'alice')
+    first, second = open_stream(member), open_stream(member)
+
+    refused = open_stream(member)
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '3'
+
+    first.close()
+    assert open_stream(member).status_code == 200
+    second.close()
+
+
+def test_gevent_workers_allow_more_streams(streams, monkeypatch):
+    monkeypatch.setattr(cooperative, 'is_patched', lambda: True)
+    member = streams.test_client()
+    signup(member, 'alice')
+
+    opened = [open_stream(member) for _ in range(5)]
+    assert {response.status_code for response in opened} == {200}
+    for response in opened:
+        response.close()
+
+
+def test_streams_are_for_members(client):
+    assert client.get('/events').status_code == 302
@@ -0,0 +1,84 @@
+"""Table exports (export.py)."""
+
+import csv
+import io
+import json
+
+import pytest
+
+from export import export, ExportError
+
+from conftest import add_book, signup
+
+
+def exported(table, fmt, **kwargs):
+    return b''.join(export(table, fmt, **kwargs))
+
+
+def test_csv_has_a_header_and_every_row(app, member):
+    for title in ('Dune', 'Emma', 'Ulysses'):
+        add_book(member, title)
+
+    rows = list(csv.reader(io.StringIO(exported('books', 'csv').decode())))
+    assert rows[0][:3] == ['id', 'club_id', 'booktitle']
+    assert [row[2] for row in rows[1:]] == ['Dune', 'Emma', 'Ulysses']
+
+
+def test_rows_are_written_a_chunk_at_a_time(app, member):
+    for title in ('Dune', 'Emma', 'Ulysses'):
+        add_book(member, title)
+
+    chunks = [chunk for chunk in export('reads', 'jsonl', chunk_rows=2)
+              if chunk]
+    assert len(chunks) == 2
+    reads = [json.loads(line) for chunk in chunks
+             for line in chunk.decode().splitlines()]
+    assert len(reads) == 3
+    assert reads[0]['created_at'].startswith('20')
+
+
+def test_parquet(app, member):
+    pq = pytest.importorskip('pyarrow.parquet')
+    add_book(member, 'Dune')
+
+    table = pq.read_table(io.BytesIO(exported('books', 'parquet')))
+    assert table.column('booktitle').to_pylist() == ['Dune']
+
+
+def test_unknown_tables_and_formats_are_refused(app):
+    with pytest.raises(ExportError):
+        export('passwords', 'csv')
+    with pytest.raises(ExportError):
+        export('books', 'xlsx')
+
+
+def test_command_writes_a_file(app, tmp_path):
+    output = tmp_path / 'clubs.jsonl'
+    result = app.test_cli_runner().invoke(
+        args=['export', 'clubs', '--format', 'jsonl', '--output',
+              str(output)])
+    assert result.exit_code == 0, result.output
+
+    clubs = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [club['name'] for club in clubs] == ['BookClub']
+
+
+def test_command_help_lists_every_table(app):
+    result = app.test_cli_runner().invoke(args=['export', '--help'])
+    assert 'clubs, users, books or reads' in result.output
+
+
+def test_downloads_are_for_admins(make_app):
+    app = make_app(ADMIN_USERNAMES=['alice'])
+    admin = app.test_client()
+    signup(admin, 'alice')
+
+    download = admin.get('/admin/export/users.csv')
+    assert download.status_code == 200
+    assert download.mimetype == 'text/csv'
+    assert b'alice' in download.data
+    assert b'alice@example.com' not in download.data
+
+    member = app.test_client()
+    signup(member, 'bob')
+    assert member.get('/admin/export/users.csv').status_code == 302
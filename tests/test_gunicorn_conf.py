@@ -0,0 +1,76 @@
+"""gunicorn settings (gunicorn.conf.py)."""
+
+import os
+import runpy
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import cooperative
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                    'gunicorn.conf.py')
+
+
+@pytest.fixture
+def load_conf(monkeypatch):
+    """Run the settings file for a command line; count the patch calls."""
+
+    patches = []
+    monkeypatch.setattr(cooperative, 'patch', lambda: patches.append(1))
+    monkeypatch.setenv('BOOKCLUB_ENV', 'testing')
+    monkeypatch.delenv('GUNICORN_WORKER_CLASS', raising=False)
+    monkeypatch.delenv('GUNICORN_CMD_ARGS', raising=False)
+
+    def load(*argv, **environ):
+        for name, value in environ.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setattr(sys, 'argv', ['gunicorn', *argv, 'app:app'])
+        settings = runpy.run_path(CONF)
+        return settings, len(patches)
+    return load
+
+
+@pytest.mark.parametrize('argv, environ', [
+    ((), {'GUNICORN_WORKER_CLASS': 'gevent'}),
+    (('-k', 'gevent'), {}),
+    (('-kgevent',), {}),
+    (('--worker-class=gunicorn.workers.ggevent.GeventWorker',), {}),
+    ((), {'GUNICORN_CMD_ARGS': '--workers 2 -k gevent'}),
+])
+def test_gevent_workers_are_patched_for(load_conf, argv, environ):
+    settings, patches = load_conf(*argv, **environ)
+    assert patches == 1
+
+
+def test_the_command_line_wins(load_conf):
+    settings, patches = load_conf('-k', 'gthread',
+                                  GUNICORN_WORKER_CLASS='gevent')
+    assert patches == 0
+    assert settings['effective_worker_class'] == 'gthread'
+
+
+def test_thread_workers_are_not_patched(load_conf):
+    settings, patches = load_conf()
+    assert patches == 0
+    assert settings['worker_class'] == 'gthread'
+
+
+def test_unpatched_gevent_workers_refuse_to_start(load_conf, monkeypatch):
+    settings, _ = load_conf()
+    errors = []
+    server = SimpleNamespace(
+        cfg=SimpleNamespace(worker_class_str='gevent'),
+        log=SimpleNamespace(error=lambda *args: errors.append(args)))
+
+    monkeypatch.setattr(cooperative, 'is_patched', lambda: False)
+    with pytest.raises(SystemExit):
+        settings['on_starting'](server)
+    assert errors
+
+    monkeypatch.setattr(cooperative, 'is_patched', lambda: True)
+    settings['on_starting'](server)
+    server.cfg.worker_class_str = 'gthread'
+    monkeypatch.setattr(cooperative, 'is_patched', lambda: False)
+    settings['on_starting'](server)
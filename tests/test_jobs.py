@@ -0,0 +1,165 @@
+"""Background job queue (jobs.py)."""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from jobs import enqueue, job, requeue_stale, work_once
+from models import db, Job
+
+from conftest import signup
+
+calls = []
+
+
+@job('test_record')
+def record(value):
+    calls.append(value)
+
+
+@job('test_fail', on_give_up=lambda: calls.append('gave up'))
+def fail():
+    raise RuntimeError("boom")
+
+
+@job('test_slow')
+def slow(seconds):
+    time.sleep(seconds)
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+
+def running_job(started_ago, heartbeat_ago=None, attempts=1,
+                max_attempts=5):
+    now = datetime.utcnow()
+    lost = Job(kind='test_record', payload='{"value": 1}', status='running',
+               attempts=attempts, max_attempts=max_attempts,
+               started_at=now - started_ago,
+               heartbeat_at=(now - heartbeat_ago
+                             if heartbeat_ago is not None else None))
+    db.session.add(lost)
+    db.session.commit()
+    return lost.id
+
+
+def test_jobs_run_after_commit_most_urgent_first(app):
+    enqueue('test_record', value='low')
+    enqueue('test_record', priority=10, value='high')
+    db.session.commit()
+
+    while work_once():
+        pass
+
+    assert calls == ['high', 'low']
+    assert {j.status for j in Job.query} == {'done'}
+
+
+def test_unknown_kinds_are_refused(app):
+    with pytest.raises(ValueError):
+        enqueue('no_such_job')
+
+
+def test_failures_back_off_then_fail_for_good(app):
+    failing = enqueue('test_fail', max_attempts=2)
+    db.session.commit()
+
+    work_once()
+    failing = Job.query.get(failing.id)
+    assert failing.status == 'queued'
+    assert failing.run_at > datetime.utcnow()
+    assert 'boom' in failing.last_error
+
+    failing.run_at = datetime.utcnow()
+    db.session.commit()
+    assert calls == []
+    work_once()
+    assert Job.query.get(failing.id).status == 'failed'
+    assert calls == ['gave up']
+
+
+def test_running_jobs_refresh_their_heartbeat(app, monkeypatch):
+    monkeypatch.setattr(jobs, 'HEARTBEAT_INTERVAL', 0.05)
+    slow_job = enqueue('test_slow', seconds=0.4)
+    db.session.commit()
+
+    work_once()
+    db.session.expire_all()
+    finished = Job.query.get(slow_job.id)
+    assert finished.status == 'done'
+    assert finished.heartbeat_at > finished.started_at + timedelta(
+        seconds=0.1)
+
+
+def test_only_jobs_with_a_stale_heartbeat_are_requeued(app):
+    alive = running_job(started_ago=timedelta(hours=2),
+                        heartbeat_ago=timedelta(seconds=10))
+    lost = running_job(started_ago=timedelta(hours=2),
+                       heartbeat_ago=timedelta(minutes=10))
+
+    assert requeue_stale() == 1
+    assert Job.query.get(alive).status == 'running'
+    assert Job.query.get(lost).status == 'queued'
+
+
+def test_lost_jobs_out_of_attempts_fail(app):
+    lost = running_job(started_ago=timedelta(hours=1),
+                       heartbeat_ago=timedelta(hours=1),
+                       attempts=3, max_attempts=3)
+
+    assert requeue_stale() == 0
+    lost = Job.query.get(lost)
+    assert lost.status == 'failed'
+    assert lost.finished_at is not None
+    assert calls == []
+
+
+def test_give_up_handlers_run_for_lost_jobs(app):
+    lost = Job(kind='test_fail', payload='{}', status='running',
+               attempts=5, max_attempts=5, started_at=datetime.utcnow(),
+               heartbeat_at=datetime.utcnow() - timedelta(hours=1))
+    db.session.add(lost)
+    db.session.commit()
+
+    requeue_stale()
+    assert Job.query.get(lost.id).status == 'failed'
+    assert calls == ['gave up']
+
+
+def test_running_pools_requeue_jobs_lost_meanwhile(app):
+    pool = jobs.WorkerPool(app, threads=1, poll_interval=0.05,
+                           requeue_interval=0.05)
+    pool.start()
+    try:
+        lost = running_job(started_ago=timedelta(hours=1),
+                           heartbeat_ago=timedelta(minutes=10))
+        deadline = time.monotonic() + 5
+        while calls != [1] and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        pool.stop(timeout=5)
+
+    assert calls == [1]
+    db.session.rollback()  # end the read transaction started above
+    assert Job.query.get(lost).status == 'done'
+
+
+def test_dashboard_is_for_admins(make_app):
+    app = make_app(ADMIN_USERNAMES=['alice'])
+    enqueue('test_record', value=1)
+    db.session.commit()
+    work_once()
+
+    admin = app.test_client()
+    signup(admin, 'alice')
+    page = admin.get('/admin/jobs')
+    assert page.status_code == 200
+    assert b'test_record' in page.data
+
+    member = app.test_client()
+    signup(member, 'bob')
+    assert member.get('/admin/jobs').status_code == 302
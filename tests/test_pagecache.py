@@ -0,0 +1,89 @@
+"""Anonymous full-page cache (pagecache.py)."""
+
+import os
+import time
+
+from pagecache import PageCache
+
+from conftest import signup
+
+
+def test_entries_expire(monkeypatch):
+    cache = PageCache(ttl=10)
+    cache.set('k', 'body', 'text/html', ['pages'], public=True)
+    assert cache.get('k')['body'] == 'body'
+
+    later = time.time() + 11
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert cache.get('k') is None
+
+
+def test_purge_by_tag_reaches_other_workers_disk_tier(tmp_path):
+    worker = PageCache(directory=str(tmp_path))
+    other_worker = PageCache(directory=str(tmp_path))
+    worker.set('home', 'home page', 'text/html', ['pages', 'home'], True)
+    worker.set('login', 'login page', 'text/html', ['pages', 'login'], True)
+
+    assert other_worker.get('home')['body'] == 'home page'
+    assert other_worker.purge('home') == 1
+
+    assert PageCache(directory=str(tmp_path)).get('home') is None
+    assert PageCache(directory=str(tmp_path)).get('login') is not None
+
+
+def test_anonymous_pages_are_served_from_the_cache(make_app):
+    app = make_app(PAGE_CACHE_ENABLED=True)
+    client = app.test_client()
+
+    first = client.get('/')
+    assert first.headers['Surrogate-Key'] == 'pages home'
+    assert first.headers['Cache-Control'].startswith('public')
+
+    hits = app.page_cache.memory.hits
+    second = client.get('/')
+    assert second.data == first.data
+    assert app.page_cache.memory.hits == hits + 1
+
+    assert client.get('/', headers={'If-None-Match': first.headers['ETag']}
+                      ).status_code == 304
+
+
+def test_members_are_never_served_cached_pages(make_app):
+    app = make_app(PAGE_CACHE_ENABLED=True)
+    client = app.test_client()
+    anonymous_page = client.get('/').data
+
+    signup(client, 'alice')
+    page = client.get('/')
+    assert page.data != anonymous_page
+    assert 'Surrogate-Key' not in page.headers
+
+
+def test_made_up_query_arguments_skip_the_cache(make_app):
+    app = make_app(PAGE_CACHE_ENABLED=True)
+    client = app.test_client()
+
+    for n in range(20):
+        response = client.get(f'/login?x={n}')
+        assert response.status_code == 200
+        assert 'Surrogate-Key' not in response.headers
+    assert len(app.page_cache.memory) == 0
+
+    assert 'Surrogate-Key' in client.get('/login').headers
+    assert len(app.page_cache.memory) == 1
+
+
+def test_disk_tier_sweep_drops_expired_then_oldest(tmp_path, monkeypatch):
+    cache = PageCache(ttl=10, directory=str(tmp_path), disk_max_entries=3)
+    for n in range(5):
+        cache.set(f'page-{n}', 'body', 'text/html', ['pages'], True)
+        os.utime(cache._path(f'page-{n}'), (n, time.time() - 5 + n))
+
+    cache.sweep()
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(cache._path(f'page-{n}')) for n in (2, 3, 4))
+
+    later = time.time() + 8
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert cache.sweep() == 2
+    assert os.listdir(tmp_path) == [os.path.basename(cache._path('page-4'))]
@@ -0,0 +1,82 @@
+"""Request profiling (profiler.py)."""
+
+import json
+import os
+import tracemalloc
+
+import pytest
+
+from conftest import signup
+
+TOKEN = 'let-me-profile'
+
+
+@pytest.fixture
+def profiled(make_app):
+    return make_app(PROFILE_TOKEN=TOKEN, ADMIN_USERNAMES=['alice'])
+
+
+def saved_profile(app, response):
+    profile_id = response.headers['X-Profile-Id']
+    with open(os.path.join(app.config['PROFILE_DIR'],
+                           f"{profile_id}.json")) as saved:
+        return json.load(saved)
+
+
+def test_requests_with_the_token_are_profiled(profiled):
+    client = profiled.test_client()
+    signup(client, 'alice')
+
+    response = client.get('/users', headers={'X-Profile': TOKEN})
+    profile = saved_profile(profiled, response)
+    assert profile['endpoint'] == 'main.list_users'
+    assert profile['status'] == 200
+    assert profile['queries'] > 0
+    assert sum(profile['memory']['allocated_bytes'].values()) > 0
+    assert not tracemalloc.is_tracing()
+
+    page = client.get('/admin/profiles')
+    assert response.headers['X-Profile-Id'].encode() in page.data
+
+
+def test_other_requests_are_not(profiled):
+    client = profiled.test_client()
+    assert 'X-Profile-Id' not in client.get('/').headers
+    assert 'X-Profile-Id' not in client.get(
+        '/', headers={'X-Profile': 'guess'}).headers
+
+
+def test_sampled_requests_never_trace_memory(make_app, monkeypatch):
+    app = make_app(PROFILE_SAMPLE_RATE=1.0)
+
+    def fail(*args):
+        raise AssertionError("tracemalloc started for a sampled request")
+
+    monkeypatch.setattr(tracemalloc, 'start', fail)
+    response = app.test_client().get('/')
+    profile = saved_profile(app, response)
+    assert profile['memory'] is None
+    assert profile['wall_ms'] > 0
+
+
+def test_memory_tracing_can_be_turned_off(make_app):
+    app = make_app(PROFILE_TOKEN=TOKEN, PROFILE_MEMORY=False)
+    response = app.test_client().get('/', headers={'X-Profile': TOKEN})
+    assert saved_profile(app, response)['memory'] is None
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="POSIX only")
+def test_shared_profile_directories_are_not_used(make_app, tmp_path):
+    directory = tmp_path / 'shared'
+    directory.mkdir()
+    (directory / 'planted.json').write_text('{"id": "planted"}')
+    os.chmod(directory, 0o777)
+    app = make_app(PROFILE_TOKEN=TOKEN, ADMIN_USERNAMES=['alice'],
+                   PROFILE_DIR=str(directory))
+    client = app.test_client()
+    signup(client, 'alice')
+
+    client.get('/users', headers={'X-Profile': TOKEN})
+    assert [p.name for p in directory.iterdir()] == ['planted.json']
+    assert b'planted' not in client.get('/admin/profiles').data
+    assert client.get('/admin/profiles/planted.json').status_code == 404
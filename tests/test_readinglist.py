@@ -0,0 +1,169 @@
+"""Reading list imports (readinglist.py)."""
+
+import io
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import readinglist
+from jobs import work_once
+from models import db, Book, Job, Read, ReadingImport, DEFAULT_CLUB_ID
+
+from conftest import signup
+
+GOODREADS_HEADER = 'Book Id,Title,Author,Exclusive Shelf\n'
+
+
+def goodreads_csv(*rows):
+    lines = [f'{n},"{title}",{author},{shelf}\n'
+             for n, (title, author, shelf) in enumerate(rows, 1)]
+    return GOODREADS_HEADER + ''.join(lines)
+
+
+def upload(client, text, filename='goodreads_library_export.csv'):
+    response = client.post(
+        '/users/import',
+        data={'export': (io.BytesIO(text.encode()), filename)},
+        content_type='multipart/form-data')
+    assert response.status_code == 302, response.data
+    import_id = int(response.headers['Location'].rsplit('/', 1)[1])
+    return ReadingImport.query.get(import_id)
+
+
+def import_job(import_id):
+    return next(j for j in Job.query.filter_by(kind='import_reading_list')
+                if json.loads(j.payload)['import_id'] == import_id)
+
+
+def run_import(import_id, **payload):
+    """Run the import's job now, even if it is waiting to retry."""
+
+    queued = import_job(import_id)
+    queued.run_at = datetime.utcnow()
+    if payload:
+        queued.payload = json.dumps({**json.loads(queued.payload),
+                                     **payload})
+    db.session.commit()
+    work_once()
+    db.session.expire_all()
+    return ReadingImport.query.get(import_id)
+
+
+def test_import_adds_books_and_reads(member):
+    reading_import = upload(member, goodreads_csv(
+        ('Dune (Dune, #1)', 'Frank Herbert', 'read'),
+        ('Emma', 'Jane Austen', 'read'),
+        ('Dune', 'Frank Herbert', 'read'),
+        ('Ulysses', 'James Joyce', 'to-read'),
+    ))
+    path = json.loads(import_job(reading_import.id).payload)['path']
+
+    done = run_import(reading_import.id)
+    assert done.status == 'done'
+    assert (done.rows_seen, done.books_created, done.reads_created,
+            done.rows_skipped) == (4, 2, 2, 2)
+    assert {b.booktitle for b in Book.query} == {'Dune (Dune, #1)', 'Emma'}
+    assert Read.query.count() == 2
+    assert not os.path.exists(path)
+
+
+def test_titles_match_on_what_is_stored(member):
+    long_title = 'A' * 200
+    reading_import = upload(member, goodreads_csv(
+        (long_title + ' part one', 'Anon', 'read'),
+        (long_title + ' part two', 'Anon', 'read'),
+    ))
+    run_import(reading_import.id)
+
+    again = upload(member, goodreads_csv((long_title, 'Anon', 'read')))
+    done = run_import(again.id)
+
+    assert [b.booktitle for b in Book.query] == [long_title]
+    assert (done.books_created, done.reads_created) == (0, 0)
+
+
+def test_retries_resume_where_the_last_attempt_stopped(member, monkeypatch):
+    reading_import = upload(member, goodreads_csv(
+        ('Dune', 'Frank Herbert', 'read'),
+        ('Emma', 'Jane Austen', 'read'),
+        ('Ulysses', 'James Joyce', 'read'),
+    ))
+    real_import_batch = readinglist.import_batch
+
+    def fail_on_emma(rows, *args):
+        if rows[0]['Title'] == 'Emma':
+            raise RuntimeError("database went away")
+        return real_import_batch(rows, *args)
+
+    monkeypatch.setattr(readinglist, 'import_batch', fail_on_emma)
+    interrupted = run_import(reading_import.id, batch_size=1)
+    assert interrupted.status == 'running'
+    assert interrupted.rows_seen == 1
+    assert 'database went away' in interrupted.error
+
+    monkeypatch.setattr(readinglist, 'import_batch', real_import_batch)
+    done = run_import(reading_import.id)
+    assert done.status == 'done'
+    assert (done.rows_seen, done.books_created, done.reads_created) == \
+        (3, 3, 3)
+    assert done.error is None
+
+
+def test_imports_out_of_attempts_fail(member, monkeypatch):
+    reading_import = upload(member, goodreads_csv(('Dune', 'F', 'read')))
+    path = json.loads(import_job(reading_import.id).payload)['path']
+    import_job(reading_import.id).max_attempts = 2
+    db.session.commit()
+
+    def broken(*args):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(readinglist, 'import_batch', broken)
+    assert run_import(reading_import.id).status == 'running'
+    failed = run_import(reading_import.id)
+
+    assert failed.status == 'failed'
+    assert failed.finished_at is not None
+    assert import_job(reading_import.id).status == 'failed'
+    assert not os.path.exists(path)
+    assert b'database went away' in member.get(
+        f'/users/import/{reading_import.id}').data
+
+
+def test_unknown_formats_fail_at_once(member):
+    reading_import = upload(member, 'Name,Rating\nDune,5\n')
+
+    failed = run_import(reading_import.id)
+    assert failed.status == 'failed'
+    assert "doesn't look like" in failed.error
+    assert import_job(reading_import.id).status == 'done'
+
+
+def test_only_the_imported_books_are_enriched(member):
+    db.session.add(Book(club_id=DEFAULT_CLUB_ID, booktitle='Ulysses'))
+    db.session.commit()
+    reading_import = upload(member, goodreads_csv(
+        ('Dune', 'Frank Herbert', 'read'),
+        ('Emma', 'Jane Austen', 'read'),
+    ))
+    run_import(reading_import.id, batch_size=1)
+
+    enriched = [json.loads(j.payload)['book_ids'] for j in
+                Job.query.filter_by(kind='enrich_metadata').order_by(Job.id)]
+    ids = {b.booktitle: b.id for b in Book.query}
+    assert enriched == [[ids['Dune']], [ids['Emma']]]
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="POSIX only")
+def test_shared_upload_directories_are_refused(make_app, tmp_path):
+    directory = tmp_path / 'shared'
+    directory.mkdir()
+    os.chmod(directory, 0o777)
+    client = make_app(IMPORT_UPLOAD_DIR=str(directory)).test_client()
+    signup(client, 'alice')
+
+    with pytest.raises(RuntimeError, match='writable by other users'):
+        upload(client, goodreads_csv(('Dune', 'Frank Herbert', 'read')))
+    assert not any(directory.iterdir())
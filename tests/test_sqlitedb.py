@@ -0,0 +1,95 @@
+"""Embedded SQLite mode (sqlitedb.py)."""
+
+import threading
+
+import pytest
+
+import catalog
+from models import db, CatalogEntry
+
+from conftest import ON_POSTGRES
+
+pytestmark = pytest.mark.skipif(ON_POSTGRES, reason="SQLite only")
+
+
+def pragma(name):
+    return db.session.execute(db.text(f"PRAGMA {name}")).scalar()
+
+
+def test_connections_are_tuned(make_app):
+    make_app(SQLITE_CACHE_MB=8, SQLITE_BUSY_TIMEOUT_MS=1234)
+
+    assert pragma('journal_mode') == 'wal'
+    assert pragma('synchronous') == 1  # NORMAL
+    assert pragma('foreign_keys') == 1
+    assert pragma('busy_timeout') == 1234
+    assert pragma('cache_size') == -8 * 1024
+
+
+def test_threads_share_connections_past_the_pool_size(make_app):
+    make_app(SQLITE_POOL_SIZE=2)
+    threads = 8
+    barrier = threading.Barrier(threads)
+    results, errors = [], []
+
+    def query():
+        try:
+            with db.engine.connect() as connection:
+                barrier.wait(timeout=5)
+                results.append(connection.execute(
+                    db.text("SELECT count(*) FROM users")).scalar())
+        except Exception as exc:
+            errors.append(exc)
+
+    for _ in range(3):
+        running = [threading.Thread(target=query) for _ in range(threads)]
+        for thread in running:
+            thread.start()
+        for thread in running:
+            thread.join()
+
+    assert errors == []
+    assert results == [0] * threads * 3
+    assert db.engine.pool.checkedout() == 0
+    assert db.engine.pool.size() == 2
+
+
+def test_savepoints_roll_back_alone(app):
+    db.session.add(CatalogEntry(key='/works/1', kind='entry', title='Dune',
+                                search_title='dune'))
+    with pytest.raises(RuntimeError):
+        with db.session.begin_nested():
+            db.session.add(CatalogEntry(key='/works/2', kind='entry',
+                                        title='Emma', search_title='emma'))
+            raise RuntimeError
+    db.session.commit()
+
+    assert [e.key for e in CatalogEntry.query] == ['/works/1']
+
+
+def test_full_text_index_follows_the_catalog(app):
+    entry = CatalogEntry(key='/works/1', kind='entry', title='Dune Messiah',
+                         search_title='dune messiah')
+    db.session.add(entry)
+    db.session.commit()
+    assert [d['title'] for d in catalog.search('dune mes')] == \
+        ['Dune Messiah']
+    assert catalog.search('messiah') == []
+
+    entry.title, entry.search_title = 'Emma', 'emma'
+    db.session.commit()
+    assert catalog.search('dune') == []
+    assert [d['title'] for d in catalog.search('Emm')] == ['Emma']
+
+    db.session.delete(entry)
+    db.session.commit()
+    assert catalog.search('emma') == []
+
+
+def test_commands(app):
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['sqlite', 'init']).exit_code == 0
+
+    result = runner.invoke(args=['sqlite', 'optimize'])
+    assert result.exit_code == 0, result.output
+    assert result.output == "Done.\n"
@@ -0,0 +1,54 @@
+"""App factory, config profiles and the startup report."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from config import get_profile, TestingConfig
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_profiles_are_picked_by_name():
+    assert get_profile('testing') is TestingConfig
+    with pytest.raises(ValueError):
+        get_profile('staging')
+
+
+def test_startup_report_lists_phases(app):
+    phases = dict(app.startup_report.phases)
+    assert {'import app module', 'create Flask app', 'extensions',
+            'routes'} <= set(phases)
+    assert app.startup_report.total == pytest.approx(sum(phases.values()))
+    assert 'total' in app.startup_report.as_text()
+
+
+def test_startup_report_command(app):
+    result = app.test_cli_runner().invoke(args=['startup-report'])
+    assert result.exit_code == 0
+    assert 'extensions' in result.output
+
+
+def test_building_the_app_stays_lazy(tmp_path):
+    """No database connection, no debug toolbar, no requests in production.
+    """
+
+    code = (
+        "import sys, app\n"
+        "built = app.create_app('production')\n"
+        "print(sorted(name for name in ('flask_debugtoolbar', 'requests')\n"
+        "             if name in sys.modules))\n"
+    )
+    env = dict(os.environ,
+               SUPABASE_DB_URL=f"sqlite:///{tmp_path / 'lazy.db'}",
+               TEMPLATE_CACHE_DIR=str(tmp_path / 'templates'))
+    env.pop('SQLITE_PATH', None)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True
+                            ).stdout
+
+    assert output.strip() == '[]'
+    # SQLite creates the file on the first connection
+    assert not (tmp_path / 'lazy.db').exists()
@@ -0,0 +1,127 @@
+"""Title autocomplete (suggest.py)."""
+
+import random
+import threading
+import time
+
+from cache import bump_catalog
+from models import db
+from suggest import PrefixIndex, Suggester, normalize
+
+from conftest import add_book
+
+WORDS = ['war', 'peace', 'night', 'river', 'garden', 'winter', 'house',
+         'stone', 'shadow', 'light', 'queen', 'empire', 'ocean', 'fire']
+
+
+def catalog(size, seed=1):
+    rng = random.Random(seed)
+    return [(f"b{i}", ' '.join(rng.choice(WORDS).title()
+                               for _ in range(rng.randint(1, 5))))
+            for i in range(size)]
+
+
+def test_normalize_strips_case_accents_and_punctuation():
+    assert normalize("  Les Misérables: Tome-1 ") == 'les miserables tome 1'
+
+
+def test_prefix_search_matches_the_start_of_any_word():
+    index = PrefixIndex()
+    index.add_many([('1', 'War and Peace'), ('2', 'The Warden'),
+                    ('3', 'Peace Talks')])
+
+    assert sorted(index.search('war', 10)) == ['1', '2']
+    assert sorted(index.search('peace', 10)) == ['1', '3']
+    assert index.search('and p', 10) == ['1']
+    assert index.search('zebra', 10) == []
+
+
+def test_bulk_and_one_by_one_builds_agree():
+    titles = catalog(500)
+    bulk = PrefixIndex()
+    bulk.add_many(titles)
+    one_by_one = PrefixIndex()
+    for title_id, title in titles:
+        one_by_one.add(title_id, title)
+
+    assert bulk._entries == one_by_one._entries
+    bulk.remove(*titles[0])
+    assert len(bulk) < len(one_by_one)
+
+
+def test_building_and_searching_a_large_catalog_is_fast():
+    titles = catalog(100000)
+
+    started = time.perf_counter()
+    suggester = Suggester()
+    suggester._add_many(titles)
+    build_seconds = time.perf_counter() - started
+    assert build_seconds < 10
+
+    timings = []
+    for prefix in ['w', 'wa', 'win', 'sha', 'o', 'queen e', 'light ri']:
+        started = time.perf_counter()
+        assert suggester.suggest(prefix)
+        timings.append(time.perf_counter() - started)
+    # The request's budget is 5 ms per keystroke
+    assert sorted(timings)[len(timings) // 2] < 0.005
+
+
+def test_club_books_come_first_and_follow_the_catalog(app, member):
+    add_book(member, 'Winter Garden')
+    suggester = app.suggesters.for_club(1)
+    suggester.add_remote_titles(['Winter Is Coming', 'Wintering'])
+
+    assert member.get('/suggest?q=win').get_json()[0] == 'Winter Garden'
+
+    add_book(member, 'Winterland')
+    suggester._checked_at = 0
+    assert 'Winterland' in member.get('/suggest?q=winterl').get_json()
+
+
+def test_concurrent_requests_load_the_titles_once(app, member):
+    add_book(member, 'Winter Garden')
+    suggester = app.suggesters.for_club(1)
+    loads = []
+    add_many = suggester._add_many
+
+    def slow_add_many(titles):
+        loads.append(1)
+        time.sleep(0.1)
+        add_many(titles)
+    suggester._add_many = slow_add_many
+
+    def refresh():
+        with app.app_context():
+            suggester.refresh_if_stale()
+            results.append(suggester.suggest('win'))
+
+    results = []
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == [1]
+    assert results == [['Winter Garden']] * 8
+
+
+def test_enrichment_does_not_reload_the_titles(app, member):
+    add_book(member, 'Winter Garden')
+    suggester = app.suggesters.for_club(1)
+    suggester.refresh_if_stale()
+    loads = []
+    suggester._add_many = lambda titles: loads.append(list(titles))
+
+    with app.test_request_context():
+        bump_catalog(1, titles=False)
+        db.session.commit()
+    suggester._checked_at = 0
+    suggester.refresh_if_stale()
+    assert loads == []
+
+    add_book(member, 'Winterland')
+    suggester._checked_at = 0
+    suggester.refresh_if_stale()
+    assert loads == [[('b2', 'Winterland')]]
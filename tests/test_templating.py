@@ -0,0 +1,66 @@
+"""Compiled-template cache and render metrics (templating.py)."""
+
+import os
+import stat
+
+import pytest
+
+import privatedirs
+
+from conftest import signup
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_the_cache_directory_is_created_private(make_app, tmp_path):
+    app = make_app()
+    directory = tmp_path / 'templates'
+
+    assert app.jinja_env.bytecode_cache.directory == str(directory)
+    assert mode(directory) == 0o700
+
+    result = app.test_cli_runner().invoke(args=['templates', 'compile'])
+    assert result.exit_code == 0, result.output
+    assert any(directory.iterdir())
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="POSIX only")
+@pytest.mark.parametrize('unsafe', ['world_writable', 'foreign', 'symlink'])
+def test_unsafe_cache_directories_are_refused(make_app, tmp_path,
+                                              monkeypatch, unsafe):
+    directory = tmp_path / 'shared'
+    if unsafe == 'symlink':
+        (tmp_path / 'elsewhere').mkdir(mode=0o700)
+        directory.symlink_to(tmp_path / 'elsewhere')
+    else:
+        directory.mkdir()
+        os.chmod(directory, 0o777 if unsafe == 'world_writable' else 0o700)
+    if unsafe == 'foreign':
+        uid = os.getuid()
+        monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+
+    app = make_app(TEMPLATE_CACHE_DIR=str(directory))
+    assert app.jinja_env.bytecode_cache is None
+    assert signup(app.test_client(), 'alice')
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="POSIX only")
+def test_by_default_jinjas_per_user_directory_is_used(make_app):
+    app = make_app(TEMPLATE_CACHE_DIR=None)
+    directory = app.jinja_env.bytecode_cache.directory
+
+    assert privatedirs.unsafe_reason(directory) is None
+    assert str(os.getuid()) in os.path.basename(directory)
+
+
+def test_renders_are_measured(make_app):
+    app = make_app(ADMIN_USERNAMES=['alice'])
+    client = app.test_client()
+    signup(client, 'alice')
+    client.get('/')
+
+    names = [row['name'] for row in app.jinja_env.render_metrics.summary()]
+    assert 'home.html' in names
+    assert b'home.html' in client.get('/admin/templates').data